@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Measures the throughput of every registered similarity method
+
+Every method is run against pairs of synthetic images at several resolutions and against the pairs of
+files/product-cat-photos.csv. Each case runs in a fresh process, so its peak memory usage is not affected by the
+previous cases. A case is measured twice:
+
+    * cold: the decoded image cache is disabled, every pair decodes its images
+    * warm: every image is already in the decoded image cache, only the comparison is measured
+
+The decode time is the difference of the two. Results are saved as JSON, a previous result file can be given
+with --compare to print the change of every case.
+
+Usage:
+    python benchmarks/benchmark_distances.py [--output results.json] [--compare old.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import image_compare
+from image_compare.cache import image_cache
+from image_compare.file_handlers import CSVInputHandler
+from image_compare.models import FilePair
+from image_compare.similarity import get_supported_similarity_methods, get_similarity_measurement
+
+
+CORPUS_FILE = "files/product-cat-photos.csv"
+DEFAULT_RESOLUTIONS = [256, 1024, 2048]
+SYNTHETIC_PAIRS = 4
+
+
+def make_synthetic_pairs(folder, resolution, count=SYNTHETIC_PAIRS, seed=0):
+    """Writes `count` pairs of smooth random RGB images and their noisy copies as PNG files
+
+    :return: list of (image1, image2) paths
+    """
+    random = np.random.RandomState(seed)
+    pairs = []
+    for i in range(count):
+        # Upscaled low resolution noise looks more like a photo than white noise, and compresses like one
+        small = random.randint(0, 256, (resolution // 16 + 1, resolution // 16 + 1, 3)).astype(np.uint8)
+        image = Image.fromarray(small).resize((resolution, resolution), Image.BICUBIC)
+        noisy = np.asarray(image).astype(np.int16) + random.randint(-8, 9, (resolution, resolution, 3))
+        paths = [os.path.join(folder, f"{resolution}-{i}-{suffix}.png") for suffix in ("a", "b")]
+        image.save(paths[0])
+        Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)).save(paths[1])
+        pairs.append(tuple(paths))
+    return pairs
+
+
+def get_corpus_pairs(filename=CORPUS_FILE):
+    """Returns the (image1, image2) paths of the existing pairs of the input file"""
+    return [(pair.image1, pair.image2) for pair in CSVInputHandler(filename)
+            if os.path.exists(pair.image1) and os.path.exists(pair.image2)]
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident set size of this process in MB"""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_pairs(distance, pairs):
+    """Calculates the similarity of every pair, returns the wall and the CPU time in seconds"""
+    similarity = get_similarity_measurement(distance)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for image1, image2 in pairs:
+        similarity(FilePair(image1, image2))
+    return time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def run_case(distance, pairs, repeat):
+    """Measures a single method over the given pairs, the best of `repeat` runs is reported
+
+    :return: dictionary of the measurements
+    """
+    rss_baseline = get_peak_rss_mb()
+    image_cache.resize(0)
+    cold = min(run_pairs(distance, pairs) for _ in range(repeat))
+
+    image_cache.resize(sys.maxsize)
+    run_pairs(distance, pairs)
+    warm = min(run_pairs(distance, pairs) for _ in range(repeat))
+    image_cache.clear()
+
+    return {
+        "pairs": len(pairs),
+        "pairs_per_sec": len(pairs) / cold[0] if cold[0] > 0 else None,
+        "wall_time": cold[0],
+        "cpu_time": cold[1],
+        "decode_time": max(0.0, cold[0] - warm[0]),
+        "compute_time": warm[0],
+        "rss_baseline_mb": rss_baseline,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+def run_benchmarks(distances, datasets, repeat):
+    """Runs every distance on every dataset, each case in a new process
+
+    :param distances: list of method names
+    :param datasets: dictionary of dataset name -> list of (image1, image2) paths
+    :param repeat: number of runs per case
+    :return: list of result dictionaries
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for dataset, pairs in datasets.items():
+        for distance in distances:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_case, distance, pairs, repeat).result()
+            result.update(distance=distance, dataset=dataset)
+            print(f"{dataset:<16}{distance:<10}{result['pairs_per_sec']:>10.2f} pairs/s"
+                  f"{result['decode_time']:>10.3f}s decode{result['compute_time']:>10.3f}s compute"
+                  f"{result['peak_rss_mb']:>10.1f} MB")
+            results.append(result)
+    return results
+
+
+def compare_results(old_results, new_results):
+    """Prints the throughput change of every case found in both result lists"""
+    old_cases = {(result["dataset"], result["distance"]): result for result in old_results}
+    print(f"{'dataset':<16}{'distance':<10}{'old pairs/s':>12}{'new pairs/s':>12}{'change':>9}")
+    for result in new_results:
+        old = old_cases.get((result["dataset"], result["distance"]))
+        if old is None or not old["pairs_per_sec"] or not result["pairs_per_sec"]:
+            continue
+        change = result["pairs_per_sec"] / old["pairs_per_sec"] - 1
+        print(f"{result['dataset']:<16}{result['distance']:<10}{old['pairs_per_sec']:>12.2f}"
+              f"{result['pairs_per_sec']:>12.2f}{change:>+9.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default=f"benchmark-{image_compare.__version__}.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="JSON file of previous results to compare with")
+    parser.add_argument("--distance", action="append", default=None,
+                        help="method to measure, can be repeated, all registered methods by default")
+    parser.add_argument("--resolution", type=int, action="append", default=None,
+                        help="side length of the synthetic images, can be repeated")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per case, the best one is reported")
+    parser.add_argument("--no-corpus", action="store_true", help=f"do not measure the pairs of {CORPUS_FILE}")
+    args = parser.parse_args(argv)
+
+    distances = args.distance or list(get_supported_similarity_methods())
+    with tempfile.TemporaryDirectory() as folder:
+        datasets = {f"synthetic-{resolution}": make_synthetic_pairs(folder, resolution)
+                    for resolution in args.resolution or DEFAULT_RESOLUTIONS}
+        if not args.no_corpus:
+            datasets["corpus"] = get_corpus_pairs()
+        results = run_benchmarks(distances, datasets, args.repeat)
+
+    report = {
+        "version": image_compare.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results are written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as compare_file:
+            compare_results(json.load(compare_file)["results"], results)
+
+
+if __name__ == "__main__":
+    main()
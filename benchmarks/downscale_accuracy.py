@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Compares the ssim and nrmse results of downscaled images with the full resolution results
+
+Every pair of same size images in files/images is compared at full resolution and at each working resolution,
+the similarities, their differences and the elapsed times are written to files/evaluation/downscale_accuracy.csv
+and a summary is printed.
+
+Usage:
+    python benchmarks/downscale_accuracy.py [MAX_SIDE ...]
+"""
+
+import os
+import sys
+import csv
+import itertools
+from collections import defaultdict
+
+from image_compare import similarity
+from image_compare.cache import image_cache
+from image_compare.models import FilePair
+
+
+IMAGES_FOLDER = "files/images"
+OUTPUT_FILE = "files/evaluation/downscale_accuracy.csv"
+DISTANCES = ["ssim", "nrmse"]
+DEFAULT_MAX_SIDES = [256, 512, 1024]
+
+
+def get_same_size_pairs(folder):
+    """Returns every pair of images in the folder with the same size, images of a category share their size"""
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    categories = defaultdict(list)
+    for path in paths:
+        name = os.path.basename(path)
+        # e.g. cat-hue.png -> cat, nature-1-box.png -> nature-1
+        category = next((prefix for prefix in ("cat", "cityscape", "nature-1", "nature-2")
+                         if name == f"{prefix}.png" or name.startswith(f"{prefix}-")), name)
+        categories[category].append(path)
+    return [(category, image1, image2) for category, category_paths in categories.items()
+            for image1, image2 in itertools.combinations(category_paths, 2)]
+
+
+def calculate(distance, image1, image2, max_side):
+    similarity.set_max_side(max_side)
+    pair = FilePair(image1, image2)
+    similarity.get_similarity_measurement(distance)(pair)
+    return pair
+
+
+def main(max_sides):
+    # Every measurement decodes the images, so the elapsed times are comparable
+    image_cache.resize(0)
+    pairs = get_same_size_pairs(IMAGES_FOLDER)
+    headers = ["category", "image1", "image2", "distance", "full"] + \
+              [f"{column}_{max_side}" for max_side in max_sides for column in ("max_side", "delta")] + \
+              ["elapsed_full"] + [f"elapsed_{max_side}" for max_side in max_sides]
+    deltas = defaultdict(list)
+    elapsed = defaultdict(float)
+    with open(OUTPUT_FILE, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(headers)
+        for (category, image1, image2), distance in itertools.product(pairs, DISTANCES):
+            full = calculate(distance, image1, image2, None)
+            row = [category, os.path.basename(image1), os.path.basename(image2), distance, full.similarity]
+            times = [full.elapsed]
+            elapsed[(distance, None)] += full.elapsed
+            for max_side in max_sides:
+                downscaled = calculate(distance, image1, image2, max_side)
+                delta = round(downscaled.similarity - full.similarity, 3)
+                row += [downscaled.similarity, delta]
+                times.append(downscaled.elapsed)
+                deltas[(distance, max_side)].append(abs(delta))
+                elapsed[(distance, max_side)] += downscaled.elapsed
+            writer.writerow(row + [f"{elapsed_time:.5f}" for elapsed_time in times])
+    similarity.set_max_side(None)
+
+    print(f"{len(pairs)} pairs, results are written to {OUTPUT_FILE}")
+    print(f"{'distance':<10}{'max_side':>10}{'mean |delta|':>14}{'max |delta|':>13}{'speedup':>10}")
+    for distance, max_side in itertools.product(DISTANCES, max_sides):
+        values = deltas[(distance, max_side)]
+        speedup = elapsed[(distance, None)] / max(elapsed[(distance, max_side)], 1e-9)
+        print(f"{distance:<10}{max_side:>10}{sum(values) / len(values):>14.4f}{max(values):>13.3f}{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_MAX_SIDES)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Measures the startup time of the command line tools
+
+The import of image_compare.cli is measured with `python -X importtime` in a fresh process, the self time of every
+imported module is summed by top level package to show where the import time goes. Then the wall time of
+`image_compare --help` and of a run comparing a single pair are measured. The median of `--repeat` runs is reported.
+
+Usage:
+    python benchmarks/startup_time.py [--repeat 5] [--distance dhash]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from collections import defaultdict
+
+
+MODULE = "image_compare.cli"
+SAMPLE_PAIR = ("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png")
+TOP_PACKAGES = 10
+
+
+def parse_importtime(output):
+    """Returns the self time of every module of an `-X importtime` output in seconds
+
+    :param output: stderr of `python -X importtime`
+    :return: dictionary of module name -> (self time, cumulative time)
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_time) / 1e6, int(cumulative_time) / 1e6)
+    return times
+
+
+def measure_import(module):
+    """Imports the module in a new process
+
+    :return: (cumulative import time of the module in seconds, dictionary of top level package -> self time)
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = parse_importtime(result.stderr)
+    packages = defaultdict(float)
+    for name, (self_time, _) in times.items():
+        packages[name.split(".")[0]] += self_time
+    return times[module][1], packages
+
+
+def measure_wall_time(args):
+    """Returns the wall time of the command in seconds"""
+    start = time.perf_counter()
+    subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs per measurement, the median is reported")
+    parser.add_argument("--distance", default="dhash", help="method of the single pair run")
+    args = parser.parse_args(argv)
+
+    imports = [measure_import(MODULE) for _ in range(args.repeat)]
+    import_time = statistics.median(cumulative for cumulative, _ in imports)
+    packages = {package: statistics.median(run[1].get(package, 0.0) for run in imports)
+                for package in set(package for _, run in imports for package in run)}
+    print(f"import {MODULE}: {import_time * 1000:.1f} ms")
+    print(f"{'package':<24}{'self ms':>10}")
+    for package, self_time in sorted(packages.items(), key=lambda item: -item[1])[:TOP_PACKAGES]:
+        print(f"{package:<24}{self_time * 1000:>10.1f}")
+
+    help_time = statistics.median(measure_wall_time([sys.executable, "-m", MODULE, "--help"])
+                                  for _ in range(args.repeat))
+    with tempfile.TemporaryDirectory() as folder:
+        input_file = os.path.join(folder, "input.csv")
+        with open(input_file, "w") as f:
+            f.write("image1,image2\n" + ",".join(SAMPLE_PAIR) + "\n")
+        run = [sys.executable, "-m", MODULE, f"--distance={args.distance}", "--workers=1", "--quiet",
+               "--overwrite-output", f"--log-filename={os.path.join(folder, 'image_compare.log')}", input_file,
+               os.path.join(folder, "output.csv")]
+        run_time = statistics.median(measure_wall_time(run) for _ in range(args.repeat))
+    print(f"image_compare --help: {help_time * 1000:.1f} ms")
+    print(f"image_compare --distance={args.distance} with a single pair: {run_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Compares the decisions of the threshold mode with the decisions of the full calculations
+
+Every pair of same size images in files/images, including the pairs of different categories, is compared by every
+method at full cost and at low resolution. The similarities and their differences are written to
+files/evaluation/threshold_accuracy.csv. Then every method runs in threshold mode for each threshold and a summary
+of the early exits, the wrong decisions and the speedup is printed. The largest difference of a method should stay
+below its margin in `similarity.THRESHOLD_MARGINS`.
+
+Usage:
+    python benchmarks/threshold_accuracy.py [THRESHOLD ...]
+"""
+
+import os
+import sys
+import csv
+import itertools
+from collections import defaultdict
+
+from PIL import Image
+
+from image_compare import similarity
+from image_compare.cache import image_cache
+from image_compare.models import FilePair
+
+
+IMAGES_FOLDER = "files/images"
+OUTPUT_FILE = "files/evaluation/threshold_accuracy.csv"
+DISTANCES = ["ssim", "nrmse", "dhash", "avghash", "phash", "whash"]
+DEFAULT_THRESHOLDS = [0.05, 0.1, 0.2]
+
+
+def get_same_size_pairs(folder):
+    """Returns every pair of images in the folder with the same size"""
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    sizes = {}
+    for path in paths:
+        with Image.open(path) as image:
+            sizes[path] = image.size
+    return [(image1, image2) for image1, image2 in itertools.combinations(paths, 2) if sizes[image1] == sizes[image2]]
+
+
+def calculate(distance, image1, image2, threshold):
+    similarity.set_threshold(threshold)
+    pair = FilePair(image1, image2)
+    similarity.get_similarity_measurement(distance)(pair)
+    return pair
+
+
+def main(thresholds):
+    # Every measurement decodes the images, so the elapsed times are comparable
+    image_cache.resize(0)
+    pairs = get_same_size_pairs(IMAGES_FOLDER)
+    deltas = defaultdict(list)
+    full_results = {}
+    with open(OUTPUT_FILE, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(["image1", "image2", "distance", "full", "low_resolution", "delta", "elapsed_full",
+                         "elapsed_low_resolution"])
+        for (image1, image2), distance in itertools.product(pairs, DISTANCES):
+            full = calculate(distance, image1, image2, None)
+            # A threshold below every similarity decides every pair at low resolution
+            low = calculate(distance, image1, image2, -1.0)
+            delta = round(low.similarity - full.similarity, 3)
+            deltas[distance].append(abs(delta))
+            full_results[(distance, image1, image2)] = full
+            writer.writerow([os.path.basename(image1), os.path.basename(image2), distance, full.similarity,
+                             low.similarity, delta, f"{full.elapsed:.5f}", f"{low.elapsed:.5f}"])
+
+    print(f"{len(pairs)} pairs, results are written to {OUTPUT_FILE}")
+    print(f"{'distance':<10}{'max |delta|':>12}{'margin':>8}{'threshold':>11}{'matches':>9}{'early exits':>13}"
+          f"{'wrong':>7}{'speedup':>9}")
+    for distance, threshold in itertools.product(DISTANCES, thresholds):
+        matches = early_exits = wrong = 0
+        elapsed_full = elapsed_threshold = 0.0
+        for image1, image2 in pairs:
+            full = full_results[(distance, image1, image2)]
+            pair = calculate(distance, image1, image2, threshold)
+            early_exits += similarity.threshold_stats["early_exits"]
+            matches += pair.match
+            wrong += pair.match != (full.similarity <= threshold)
+            elapsed_full += full.elapsed
+            elapsed_threshold += pair.elapsed
+        print(f"{distance:<10}{max(deltas[distance]):>12.3f}{similarity.THRESHOLD_MARGINS[distance]:>8.3f}"
+              f"{threshold:>11.2f}{matches:>9}{early_exits:>13}{wrong:>7}"
+              f"{elapsed_full / max(elapsed_threshold, 1e-9):>8.1f}x")
+    similarity.set_threshold(None)
+
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] or DEFAULT_THRESHOLDS)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""This module contains the BK-tree used to search hashes within a Hamming distance"""
+
+
+def hamming_distance(value1, value2):
+    """Returns the number of different bits between two integers"""
+    return bin(value1 ^ value2).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with the Hamming distance as metric.
+
+    Every node keeps its children by their distance to the node, a search within radius r only visits the children
+    whose distance d satisfies |d - distance(query, node)| <= r (triangle inequality).
+    Nodes are stored as [value, key, children] lists and traversed iteratively, so deep trees do not hit the
+    recursion limit.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, key):
+        """Adds a hash to the tree
+
+        :param value: hash as an integer
+        :param key: identifier returned by `find` e.g. image path
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = [value, key, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, key, {}]
+                return
+            node = child
+
+    def find(self, value, radius):
+        """Returns every hash within the radius of the given hash
+
+        :param value: hash as an integer
+        :param radius: maximum Hamming distance, inclusive
+        :return: list of (distance, key) tuples
+        """
+        matches = []
+        if self.root is None:
+            return matches
+
+        candidates = [self.root]
+        while candidates:
+            node = candidates.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                matches.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    candidates.append(child)
+        return matches
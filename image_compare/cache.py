@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""This module contains the in-process cache for decoded images"""
+
+import io
+import os
+import functools
+from collections import OrderedDict
+
+
+# Default memory budget of the decoded image cache, in bytes
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def get_image_nbytes(image):
+    """Returns the approximate memory usage of a decoded image
+
+    :param image: ndarray or PIL image
+    :return: size in bytes
+    """
+    nbytes = getattr(image, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    # PIL images, at least one byte per band
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+def get_reader_key(read_func):
+    """Returns a hashable identifier of an image reader function
+
+    :param read_func: function or `functools.partial` object with hashable arguments
+    :return: tuple
+    """
+    if isinstance(read_func, functools.partial):
+        return get_reader_key(read_func.func) + (read_func.args, tuple(sorted(read_func.keywords.items())))
+    return read_func.__module__, read_func.__qualname__
+
+
+def sum_stats(stats_list):
+    """Sums the given cache counters
+
+    :param stats_list: iterable of counter dictionaries e.g. returned by `ImageCache.stats`
+    :return: dictionary with the summed counters
+    """
+    total = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+class ImageCache:
+    """Least recently used cache of decoded images with a memory budget.
+
+    Entries are keyed by path, modification time and size of the file as well as the reader function and its
+    arguments, so a file changed on disk is decoded again. Cached ndarrays are marked as read-only.
+    File contents read ahead of time e.g. by `prefetch.prefetch_pairs` can be given with `set_sources`,
+    they are decoded instead of reading the files again.
+
+    :param max_bytes: memory budget of the cache, zero disables caching
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sources = {}
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, path, read_func):
+        """Returns the decoded image, calls read_func only if the image is not in the cache
+
+        :param path: image path
+        :param read_func: function to decode the image, called with the path or with a file object
+            of the content given by `set_sources`
+        :return: decoded image
+        :raises:
+            FileNotFoundError: if the path does not exist
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size) + get_reader_key(read_func)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        source = self.sources.get(path)
+        image = read_func(io.BytesIO(source) if source is not None else path)
+        self.put(key, image)
+        return image
+
+    def set_sources(self, sources):
+        """Sets the file contents to decode instead of reading the files
+
+        :param sources: dictionary of path -> file content, None clears the contents
+        """
+        self.sources = sources or {}
+
+    def put(self, key, image):
+        """Adds the image to the cache, evicting the least recently used entries to stay in the budget"""
+        nbytes = get_image_nbytes(image)
+        if nbytes > self.max_bytes:
+            return
+
+        if hasattr(image, "flags"):
+            image.flags.writeable = False
+
+        self._entries[key] = (image, nbytes)
+        self.current_bytes += nbytes
+        self._evict()
+
+    def resize(self, max_bytes):
+        """Changes the memory budget, evicting entries if needed"""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        while self._entries and self.current_bytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+# Cache shared by the similarity methods of this process
+image_cache = ImageCache()
@@ -4,8 +4,31 @@
 import sys
 import click
 from image_compare import image_compare
-from image_compare.models import Config
-from image_compare.similarity import get_supported_similarity_methods
+from image_compare.models import Config, DedupeConfig, PackConfig, ServeConfig, DEFAULT_HOST, DEFAULT_PORT
+from image_compare.distances import get_distance_names, split_distances, DEFAULT_HASH_SIZE
+from image_compare.exceptions import ArgumentError
+from image_compare.util import get_default_worker_count
+from image_compare.cache import DEFAULT_CACHE_SIZE
+
+
+def validate_distances(ctx, param, value):
+    """Checks every method of a comma separated distance, with the message of a click choice"""
+    try:
+        split_distances(value)
+    except ArgumentError:
+        invalid = [name.strip() for name in value.split(",") if name.strip() not in get_distance_names()]
+        if invalid:
+            raise click.BadParameter(f"invalid choice: {invalid[0]}. "
+                                     f"(choose from {', '.join(get_distance_names())})")
+        raise click.BadParameter(f"every method can be given once: {value}")
+    return value
+
+
+def validate_hash_size(ctx, param, value):
+    """Checks the hash size of the hash method, whash needs a power of 2"""
+    if ctx.params.get("distance") == "whash" and value & (value - 1):
+        raise click.BadParameter(f"whash needs a power of 2, not {value}")
+    return value
 
 
 @click.command()
@@ -15,15 +38,58 @@ from image_compare.similarity import get_supported_similarity_methods
               help="Overwrite the output if already exists")
 @click.option("--quiet", is_flag=True, default=False, show_default=True,
               help="Suppress console output")
-@click.option("--distance", type=click.Choice(get_supported_similarity_methods()), default="dhash", show_default=True,
-              help="Similarity method to compare image pairs")
+@click.option("--distance", default="dhash", show_default=True, callback=validate_distances,
+              metavar=f"[{'|'.join(get_distance_names())}][,...]",
+              help="Similarity method to compare image pairs, every method of a comma separated list is calculated "
+                   "from a single decode of the images and adds a <method>_similarity column")
 @click.option("--log-level", type=click.Choice(image_compare.log_levels.keys()), default="INFO", show_default=True,
               help="Log level to control the output volume")
 @click.option("--log-filename", default="image_compare.log", show_default=True,
               help="Log file path")
-def main(input_file, output_file, overwrite_output, quiet, distance, log_level, log_filename):
+@click.option("--workers", type=click.IntRange(min=1), default=get_default_worker_count(), show_default=True,
+              help="Number of processes used to calculate similarities")
+@click.option("--cache-size", type=click.IntRange(min=0), default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+              show_default=True, help="Memory budget of the decoded image cache of each process in MB, 0 disables it")
+@click.option("--hash-cache", default=None,
+              help="Path of the persistent hash store, hash based distances reuse the hashes of unchanged images")
+@click.option("--two-phase", is_flag=True, default=False, show_default=True,
+              help="Hash based distances only: hash every unique image once, then compare all pairs at once")
+@click.option("--resume", is_flag=True, default=False, show_default=True,
+              help="Continue an interrupted run, pairs already in the output file are not calculated again")
+@click.option("--max-side", type=click.IntRange(min=1), default=None,
+              help="ssim and nrmse only: downscale images to fit this side length in pixels before comparing, "
+                   "faster but slightly less accurate than the full resolution")
+@click.option("--stage-timings", is_flag=True, default=False, show_default=True,
+              help="Add the wall and CPU time of the decode, preprocess and compute stages of every pair to the output")
+@click.option("--prefetch", type=click.IntRange(min=0), default=0, show_default=True,
+              help="Number of pairs whose image files are read ahead in background threads while calculating, "
+                   "useful for network storage, 0 disables it")
+@click.option("--pixel-pack", default=None,
+              help="Path of a pixel pack created by image_compare_pack, ssim and nrmse use the packed images "
+                   "instead of decoding them")
+@click.option("--threshold", type=click.FloatRange(min=0), default=None,
+              help="Maximum similarity of a matching pair, adds a match column. Pairs are compared at a low "
+                   "resolution first and only the ones close to the threshold are calculated at full cost, the "
+                   "early_exit column marks the pairs decided at low resolution")
+@click.option("--cascade-threshold", type=click.FloatRange(min=0), default=None,
+              help="Multiple distances only: run the methods as a cascade in the given order, list the cheapest "
+                   "first. A pair is compared by the next method only if its similarity is within this threshold")
+@click.option("--schedule", is_flag=True, default=False, show_default=True,
+              help="Calculate the pairs sharing an image one after the other, so the image is decoded once. "
+                   "All pairs are read into memory first, the output keeps the input order")
+@click.option("--pair-with", default=None, metavar="FOLDER",
+              help="INPUT_FILE is a folder or glob pattern of images, pair every image with the file at the same "
+                   "relative path in FOLDER")
+@click.option("--reference", default=None, metavar="IMAGE",
+              help="INPUT_FILE is a folder or glob pattern of images, pair IMAGE with every image")
+def main(input_file, output_file, overwrite_output, quiet, distance, log_level, log_filename, workers, cache_size,
+         hash_cache, two_phase, resume, max_side, stage_timings, prefetch, pixel_pack, threshold, cascade_threshold,
+         schedule, pair_with, reference):
     """A tool to compare given image pairs
 
+        INPUT_FILE is a CSV, JSON Lines or Parquet file of image pairs. With --pair-with or --reference it is a
+        folder, searched recursively, or a quoted glob pattern, the pairs are built while the images are listed.
+
         Sample Commands:
 
         # use default options
@@ -43,10 +109,203 @@ def main(input_file, output_file, overwrite_output, quiet, distance, log_level,
         image_compare --distance=ssim --log-filename="my_log_file.log" --quiet \
             files/product-cat-photos.csv files/product-cat-photos.csv
 
+        # use ssim on 8 processes
+
+        image_compare --distance=ssim --workers=8 files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use phash and reuse the hashes of the previous runs
+
+        image_compare --distance=phash --hash-cache=hashes.db files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use dhash, hashing every image only once
+
+        image_compare --distance=dhash --two-phase files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # continue an interrupted ssim run
+
+        image_compare --distance=ssim --resume files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use ssim on images downscaled to at most 512x512
+
+        image_compare --distance=ssim --max-side=512 files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use ssim and write the decode, preprocess and compute times of every pair
+
+        image_compare --distance=ssim --stage-timings files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use ssim and read the images of the next 16 pairs while calculating
+
+        image_compare --distance=ssim --prefetch=16 files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use ssim with the images decoded by image_compare_pack
+
+        image_compare --distance=ssim --pixel-pack=images.pack \
+            files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # only check if the pairs are within 0.05 with ssim, clearly different pairs are decided at low resolution
+
+        image_compare --distance=ssim --threshold=0.05 files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use every hash based method, each image is decoded once
+
+        image_compare --distance=dhash,avghash,phash,whash files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # filter the pairs with dhash, only the ones within 0.2 are compared by ssim
+
+        image_compare --distance=dhash,ssim --cascade-threshold=0.2 \
+            files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # use ssim and calculate the pairs sharing an image together, with a 64 MB cache
+
+        image_compare --distance=ssim --schedule --cache-size=64 \
+            files/product-cat-photos.csv files/product-cat-photos.csv
+
+        # compare every image of originals/ with the image of the same name in edited/
+
+        image_compare --distance=ssim --pair-with=edited/ originals/ output.csv
+
+        # compare a reference image with every PNG image under files/images
+
+        image_compare --distance=phash --reference=files/images/cat.png "files/images/**/*.png" output.csv
+
     """
-    config = Config(input_file, output_file, overwrite_output, quiet, distance, log_level, log_filename)
+    config = Config(input_file, output_file, overwrite_output, quiet, distance, log_level, log_filename, workers,
+                    cache_size * 1024 * 1024, hash_cache, two_phase, resume, max_side, stage_timings, prefetch,
+                    pixel_pack, threshold, cascade_threshold, schedule, pair_with, reference)
     return image_compare.main(config)
 
 
+@click.command()
+@click.argument("source")
+@click.argument("output_file")
+@click.option("--overwrite-output", is_flag=True, default=False, show_default=True,
+              help="Overwrite the output if already exists")
+@click.option("--quiet", is_flag=True, default=False, show_default=True,
+              help="Suppress console output")
+@click.option("--distance", type=click.Choice(get_distance_names("hash")), default="phash", show_default=True,
+              is_eager=True, help="Hash method to compare images")
+@click.option("--threshold", type=click.FloatRange(min=0, max=1), default=0.1, show_default=True,
+              help="Maximum similarity of a matching pair, as the ratio of different hash bits")
+@click.option("--hash-size", type=click.IntRange(min=2), default=DEFAULT_HASH_SIZE, show_default=True,
+              callback=validate_hash_size, help="Hash size, a hash has hash_size * hash_size bits, "
+                                                "a power of 2 for whash")
+@click.option("--log-level", type=click.Choice(image_compare.log_levels.keys()), default="INFO", show_default=True,
+              help="Log level to control the output volume")
+@click.option("--log-filename", default="image_compare.log", show_default=True,
+              help="Log file path")
+@click.option("--workers", type=click.IntRange(min=1), default=get_default_worker_count(), show_default=True,
+              help="Number of processes used to calculate hashes")
+@click.option("--hash-cache", default=None,
+              help="Path of the persistent hash store, hashes of unchanged images are reused")
+def dedupe(source, output_file, overwrite_output, quiet, distance, threshold, hash_size, log_level, log_filename,
+           workers, hash_cache):
+    """A tool to find near-duplicate images
+
+        SOURCE is a folder, searched recursively, or a file with an image path per line.
+        Every pair of images within the threshold is written to OUTPUT_FILE.
+
+        Sample Commands:
+
+        # find the duplicates in files/images with default options
+
+        image_compare_dedupe files/images duplicates.csv
+
+        # use dhash and report only the pairs with at most 5% different bits
+
+        image_compare_dedupe --distance=dhash --threshold=0.05 files/images duplicates.csv
+
+    """
+    config = DedupeConfig(source, output_file, overwrite_output, quiet, distance, log_level, log_filename, workers,
+                          hash_cache, threshold, hash_size)
+    return image_compare.dedupe(config)
+
+
+@click.command()
+@click.argument("source")
+@click.argument("pack_file")
+@click.option("--overwrite-output", is_flag=True, default=False, show_default=True,
+              help="Overwrite the pack if already exists")
+@click.option("--quiet", is_flag=True, default=False, show_default=True,
+              help="Suppress console output")
+@click.option("--log-level", type=click.Choice(image_compare.log_levels.keys()), default="INFO", show_default=True,
+              help="Log level to control the output volume")
+@click.option("--log-filename", default="image_compare.log", show_default=True,
+              help="Log file path")
+@click.option("--workers", type=click.IntRange(min=1), default=get_default_worker_count(), show_default=True,
+              help="Number of processes used to decode images")
+def pack(source, pack_file, overwrite_output, quiet, log_level, log_filename, workers):
+    """A tool to decode images once into a pixel pack
+
+        SOURCE is an input CSV, JSONL or Parquet file of image pairs, a folder, searched recursively, or a file with
+        an image path per line. Every image is decoded and written to PACK_FILE, its index is written to
+        PACK_FILE.json.
+        Use the pack with the --pixel-pack option of image_compare.
+
+        Sample Commands:
+
+        # pack the images of the pairs
+
+        image_compare_pack files/product-cat-photos.csv images.pack
+
+        # pack the images of a folder
+
+        image_compare_pack files/images images.pack
+
+    """
+    config = PackConfig(source, pack_file, overwrite_output, quiet, log_level, log_filename, workers)
+    return image_compare.pack(config)
+
+
+@click.command()
+@click.option("--host", default=DEFAULT_HOST, show_default=True,
+              help="Host name or address to listen on")
+@click.option("--port", type=click.IntRange(min=0, max=65535), default=DEFAULT_PORT, show_default=True,
+              help="Port to listen on, 0 picks a free port")
+@click.option("--socket", "socket_path", default=None,
+              help="Path of a Unix socket to listen on instead of the host and port")
+@click.option("--quiet", is_flag=True, default=False, show_default=True,
+              help="Suppress console output")
+@click.option("--log-level", type=click.Choice(image_compare.log_levels.keys()), default="INFO", show_default=True,
+              help="Log level to control the output volume")
+@click.option("--log-filename", default="image_compare.log", show_default=True,
+              help="Log file path")
+@click.option("--workers", type=click.IntRange(min=1), default=get_default_worker_count(), show_default=True,
+              help="Number of processes used to calculate similarities")
+@click.option("--cache-size", type=click.IntRange(min=0), default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+              show_default=True, help="Memory budget of the decoded image cache of each process in MB, 0 disables it")
+@click.option("--hash-cache", default=None,
+              help="Path of the persistent hash store, hash based distances reuse the hashes of unchanged images")
+@click.option("--max-side", type=click.IntRange(min=1), default=None,
+              help="ssim and nrmse only: downscale images to fit this side length in pixels before comparing")
+@click.option("--pixel-pack", default=None,
+              help="Path of a pixel pack created by image_compare_pack, ssim and nrmse use the packed images")
+@click.option("--threshold", type=click.FloatRange(min=0), default=None,
+              help="Maximum similarity of a matching pair, adds the match and early_exit fields to the "
+                   "compared pairs")
+def serve(host, port, socket_path, quiet, log_level, log_filename, workers, cache_size, hash_cache, max_side,
+          pixel_pack, threshold):
+    """A service comparing image pairs over HTTP, with caches kept warm between the requests
+
+        GET /distances lists the similarity methods, GET /stats returns the cache counters.
+        POST /compare compares a pair, e.g. {"image1": "a.png", "image2": "b.png", "distance": "ssim"}.
+        POST /compare/batch compares a list of pairs on the workers, e.g. {"pairs": [{"image1": "a.png",
+        "image2": "b.png"}], "distance": "dhash,ssim", "cascade_threshold": 0.2}.
+
+        Sample Commands:
+
+        # serve on http://127.0.0.1:8765 with 4 processes
+
+        image_compare_serve --workers=4
+
+        # serve on a Unix socket and reuse the stored hashes
+
+        image_compare_serve --socket=/tmp/image_compare.sock --hash-cache=hashes.db
+
+    """
+    config = ServeConfig(host, port, socket_path, quiet, log_level, log_filename, workers, cache_size * 1024 * 1024,
+                         hash_cache, max_side, pixel_pack, threshold)
+    return image_compare.serve(config)
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""This module contains the near-duplicate search over a set of images"""
+
+import os
+import logging
+
+from image_compare import hashing
+from image_compare.bktree import BKTree
+from image_compare.models import FilePair
+from image_compare.util import clean_string
+from image_compare.exceptions import FileError
+from image_compare.file_handlers import scan_images
+
+
+def list_images(source):
+    """Yields the image paths of a folder, recursively with `file_handlers.scan_images`, or of a list file with one
+    path per line
+
+    :param source: folder or list file path
+    :return: generator of image paths
+    :raises:
+        FileError: if the source does not exist
+    """
+    if os.path.isdir(source):
+        for _, path in scan_images(source):
+            yield path
+    elif os.path.isfile(source):
+        with open(source, 'r') as list_file:
+            for line in list_file:
+                path = clean_string(line)
+                if path:
+                    yield path
+    else:
+        raise FileError(source, "No such file or folder exists")
+
+
+def get_max_distance(threshold, hash_size=hashing.DEFAULT_HASH_SIZE):
+    """Converts a similarity threshold into the maximum number of different hash bits"""
+    # Tolerate floating point errors e.g. 0.3 * 256 = 76.79999999999998
+    return int(threshold * hash_size * hash_size + 1e-9)
+
+
+def find_duplicates(paths, method, threshold, hash_size=hashing.DEFAULT_HASH_SIZE, workers=1):
+    """Finds every pair of images whose hash similarity is less than or equal to the threshold
+
+    Every image is hashed once with the given hash method, then each hash is searched in a BK-tree of the
+    previous hashes, so each matching pair is reported once. Unlike the pair methods, image sizes are not compared,
+    resized copies are duplicates too.
+
+    :param paths: iterable of image paths
+    :param method: hash method name e.g. phash
+    :param threshold: maximum similarity (normalized Hamming distance) of a matching pair
+    :param hash_size: hash size, a hash has hash_size * hash_size bits
+    :param workers: number of processes used to calculate the hashes
+    :return: generator of matching `FilePair` objects, numbered by line_num
+    """
+    hashes = hashing.hash_unique_images(paths, method, hash_size=hash_size, workers=workers)
+    logging.info(f"Hashed {len(hashes)} unique image(s)")
+
+    max_distance = get_max_distance(threshold, hash_size)
+    tree = BKTree()
+    indexed_paths = []
+    line_num = 0
+    for path, entry in hashes.items():
+        if entry is None:
+            logging.warning(f"Skipping image, File Not Found: {path}")
+            continue
+
+        value = int.from_bytes(entry[0], "big")
+        for distance, index in sorted(tree.find(value, max_distance), key=lambda match: match[1]):
+            line_num += 1
+            yield FilePair(indexed_paths[index], path, similarity=round(float(distance) / (hash_size * hash_size), 3),
+                           line_num=line_num)
+        tree.add(value, len(indexed_paths))
+        indexed_paths.append(path)
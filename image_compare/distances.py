@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""This module contains the registry of the similarity methods
+
+The registry holds lightweight descriptors, so listing and validating the methods does not import numpy, PIL or the
+scientific libraries. It is the only list of the methods, `similarity` registers a function for every one of them
+and checks it when it is imported, the first time a method runs.
+"""
+
+from image_compare.exceptions import ArgumentError
+
+
+# Hash size used by the hash based similarity methods, a hash has hash_size * hash_size bits
+DEFAULT_HASH_SIZE = 16
+
+
+class Distance:
+    """Descriptor of a similarity method
+
+    :param name: name of the method e.g. ssim
+    :param kind: "pixel" for the methods comparing the pixels, "hash" for the hash based methods
+    """
+    __slots__ = ("name", "kind")
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+
+    def __repr__(self):
+        return f"Distance [name:{self.name}, kind:{self.kind}]"
+
+
+# Similarity methods by name, in the order they are listed to the user
+DISTANCES = {distance.name: distance for distance in [
+    Distance("ssim", "pixel"),
+    Distance("nrmse", "pixel"),
+    Distance("dhash", "hash"),
+    Distance("avghash", "hash"),
+    Distance("phash", "hash"),
+    Distance("whash", "hash"),
+]}
+
+
+def get_distance_names(kind=None):
+    """Returns the names of the supported similarity methods
+
+    :param kind: "pixel" or "hash" to list only the methods of that kind, every method if None
+    :return: list of method names
+    """
+    return [name for name, distance in DISTANCES.items() if kind is None or distance.kind == kind]
+
+
+def get_distance(name):
+    """Returns the descriptor of a similarity method
+
+    :param name: name of the method e.g. ssim
+    :return: `Distance` object
+    :raises:
+        ArgumentError: if name is a not a supported method
+    """
+    distance = DISTANCES.get(name)
+    if distance is None:
+        raise ArgumentError(f"{name} is a not a supported similarity method")
+    return distance
+
+
+def split_distances(distance):
+    """Returns the method names of a distance, a single method or a comma separated list of methods e.g. dhash,ssim
+
+    :param distance: distance string
+    :return: list of method names in the given order
+    :raises:
+        ArgumentError: if a method is not supported or given more than once
+    """
+    methods = [name.strip() for name in distance.split(",")]
+    for method in methods:
+        get_distance(method)
+    if len(set(methods)) != len(methods):
+        raise ArgumentError(f"Every similarity method should be given once, not {distance}")
+    return methods
@@ -1,20 +1,50 @@
 # -*- coding: utf-8 -*-
 """ This module contains the file handler classes.
-    Currently supports only CSV format
+    Supports CSV, JSON Lines and Parquet input and CSV, Parquet and Arrow IPC output files,
+    and pairs built from the images of a folder or glob pattern
 """
+import os
+import re
 import csv
+import json
+import fnmatch
 import pathlib
+import itertools
 import os.path
 from collections import defaultdict
-from image_compare.models import FilePair
+from image_compare.models import FilePair, PairTable
 from image_compare.util import clean_string
 from image_compare.exceptions import FileError
 
 
+# Number of pairs written at once by `CSVOutputHandler.write_table`
+TABLE_CHUNK_SIZE = 10000
+
+# Number of rows read at once by `ParquetInputHandler`
+READ_CHUNK_SIZE = 65536
+
+# Number of pairs in a row group (record batch) of the Parquet and Arrow output files
+ROW_GROUP_SIZE = 65536
+
+# Arrow types of the output fields, the other fields e.g. similarity and the stage timings are float64
+FIELD_TYPES = {"image1": "string", "image2": "string", "line_num": "int64", "skipped": "bool", "match": "bool",
+               "early_exit": "bool"}
+
+# Extensions of the files listed as images when a folder is scanned
+IMAGE_EXTENSIONS = {".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"}
+
+# Characters of a glob pattern
+GLOB_CHARACTERS = re.compile(r"[*?[]")
+
+
 class FileHandlerFactory:
     def __init__(self):
-        self.input_handlers = defaultdict(None, {".csv": CSVInputHandler})
-        self.output_handlers = defaultdict(None, {".csv": CSVOutputHandler})
+        self.input_handlers = defaultdict(None, {".csv": CSVInputHandler,
+                                                 ".jsonl": JSONLInputHandler,
+                                                 ".parquet": ParquetInputHandler})
+        self.output_handlers = defaultdict(None, {".csv": CSVOutputHandler,
+                                                  ".parquet": ParquetOutputHandler,
+                                                  ".arrow": ArrowOutputHandler})
 
     def getInputHandler(self, filename, *args, **kwargs):
         return self.__getFileHandler(self.input_handlers, filename, *args, **kwargs)
@@ -32,61 +62,697 @@ class FileHandlerFactory:
             raise FileError(filename, f"{extension} is not a supported type")
 
 
-class CSVInputHandler:
-    def __init__(self, filename, delimiter=',', quotechar='"', default_filename="<NO_FILE_GIVEN>"):
+def check_output_file(filename, overwrite):
+    """Checks if the output file can be created
+
+    :raises:
+        FileError: if the output is a folder or already exists and overwrite is False
+    """
+    if os.path.exists(filename):
+        # Can be a folder, report and stop execution
+        if os.path.isdir(filename):
+            raise FileError(filename, "Can not use a folder as output file.")
+
+        if os.path.isfile(filename) and overwrite is False:
+            raise FileError(filename, "File already exists. Use overwrite=True if you want to replace it.")
+
+
+def import_pyarrow(filename):
+    """Imports pyarrow, which is only required for the Parquet and Arrow files
+
+    :param filename: file to report if pyarrow is not installed
+    :return: pyarrow module
+    :raises:
+        FileError: if pyarrow is not installed
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise FileError(filename, "pyarrow is required for this file type, install it with `pip install pyarrow`")
+    return pyarrow
+
+
+class InputHandler:
+    """Base class of the handlers reading `FilePair` objects from files with image1 and image2 fields.
+
+    `read` loads every record into `records`, while iterating over the handler yields the records lazily
+    and can be repeated, which keeps the memory usage flat for big files. Records with a line number less than
+    `start_line` are not returned, `count` still counts them. Empty or missing image fields are replaced with
+    `default_filename` and the pair is marked as skipped.
+
+    Subclasses yield the raw image fields of the records in `_iter_rows` and count them in `_count_rows`.
+    """
+    def __init__(self, filename, default_filename="<NO_FILE_GIVEN>", start_line=1):
         self.filename = filename
-        self.delimiter = delimiter
-        self.quotechar = quotechar
         self.default_filename = default_filename
+        self.start_line = start_line
         self.records = []
 
     def read(self):
-        if os.path.isfile(self.filename):
-            self.__process_file()
-        else:
-            raise FileError(self.filename, "No such file exists")
-
+        self.records = list(self.iter_records())
         return self.records
 
+    def read_table(self):
+        """Reads every record into a `models.PairTable`, which takes much less memory than a list of pairs"""
+        return PairTable.from_pairs(self.iter_records())
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def iter_records(self):
+        """Yields the records of the file one by one
+
+        :raises:
+            FileError: if the file does not exist
+        """
+        self._check_file()
+        return self.__process_file()
+
+    def count(self):
+        """Returns the number of records without creating them"""
+        self._check_file()
+        return self._count_rows()
+
+    def check_file(self):
+        """Checks the input exists without reading it
+
+        :raises:
+            FileError: if the file does not exist
+        """
+        self._check_file()
+
+    def _check_file(self):
+        if not os.path.isfile(self.filename):
+            raise FileError(self.filename, "No such file exists")
+
     def __process_file(self):
-        self.records = []
+        skip = max(0, self.start_line - 1)
+        for line_num, (image1, image2) in enumerate(self._iter_rows(skip), start=skip + 1):
+            image1 = clean_string(image1, default=self.default_filename)
+            image2 = clean_string(image2, default=self.default_filename)
+            # If the input is missing just skip the file and log it as warning
+            skip_pair = (image1 == self.default_filename) | (image2 == self.default_filename)
+            yield FilePair(image1=image1, image2=image2, line_num=line_num, skipped=skip_pair)
+
+    def _iter_rows(self, skip):
+        """Yields the (image1, image2) values of the records after the first `skip` ones"""
+        raise NotImplementedError
+
+    def _count_rows(self):
+        raise NotImplementedError
+
+
+class CSVInputHandler(InputHandler):
+    """Reads `FilePair` objects from a CSV file with image1 and image2 columns."""
+    def __init__(self, filename, delimiter=',', quotechar='"', default_filename="<NO_FILE_GIVEN>", start_line=1):
+        super().__init__(filename, default_filename=default_filename, start_line=start_line)
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+
+    def _count_rows(self):
+        with open(self.filename, 'r') as csv_file:
+            return sum(1 for _ in csv.DictReader(csv_file, delimiter=self.delimiter, quotechar=self.quotechar))
+
+    def _iter_rows(self, skip):
         with open(self.filename, 'r') as csv_file:
             file_pair_reader = csv.DictReader(csv_file, delimiter=self.delimiter, quotechar=self.quotechar)
-            for line_num, row in enumerate(file_pair_reader):
-                image1 = clean_string(row["image1"], default=self.default_filename)
-                image2 = clean_string(row["image2"], default=self.default_filename)
-                # If the input is missing just skip the file and log it as warning
-                skip = (image1 == self.default_filename) | (image2 == self.default_filename)
-                self.records.append(FilePair(image1=image1, image2=image2, line_num=line_num + 1, skipped=skip))
+            for row in itertools.islice(file_pair_reader, skip, None):
+                yield row["image1"], row["image2"]
+
+
+class JSONLInputHandler(InputHandler):
+    """Reads `FilePair` objects from a JSON Lines file, one object with image1 and image2 keys per line.
+
+    The file is read line by line, blank lines are ignored. A missing key is handled like an empty field.
+    """
+    def _count_rows(self):
+        with open(self.filename, 'r') as jsonl_file:
+            return sum(1 for line in jsonl_file if line.strip())
+
+    def _iter_rows(self, skip):
+        with open(self.filename, 'r') as jsonl_file:
+            lines = (line for line in jsonl_file if line.strip())
+            # Skipped records are not parsed
+            for line_num, line in enumerate(itertools.islice(lines, skip, None), start=skip + 1):
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    raise FileError(self.filename, f"Invalid JSON in record {line_num}")
+                if not isinstance(row, dict):
+                    raise FileError(self.filename, f"Record {line_num} is not a JSON object")
+                yield row.get("image1"), row.get("image2")
+
+
+class ParquetInputHandler(InputHandler):
+    """Reads `FilePair` objects from a Parquet file with image1 and image2 columns.
+
+    Only the image columns are read, in batches of `chunk_size` rows. Row groups before `start_line` are not
+    decoded and `count` reads the row count from the file metadata.
+    """
+    def __init__(self, filename, default_filename="<NO_FILE_GIVEN>", start_line=1, chunk_size=READ_CHUNK_SIZE):
+        super().__init__(filename, default_filename=default_filename, start_line=start_line)
+        self.chunk_size = chunk_size
+
+    def __open(self):
+        import_pyarrow(self.filename)
+        import pyarrow.parquet
+        try:
+            parquet_file = pyarrow.parquet.ParquetFile(self.filename)
+        except (OSError, ValueError) as e:
+            raise FileError(self.filename, f"Can not read Parquet file ({e})")
+        missing = {"image1", "image2"} - set(parquet_file.schema_arrow.names)
+        if missing:
+            raise FileError(self.filename, f"Missing column(s) {sorted(missing)}")
+        return parquet_file
+
+    def _count_rows(self):
+        return self.__open().metadata.num_rows
+
+    def _iter_rows(self, skip):
+        parquet_file = self.__open()
+        metadata = parquet_file.metadata
+        row_groups = []
+        for row_group in range(metadata.num_row_groups):
+            num_rows = metadata.row_group(row_group).num_rows
+            if not row_groups and skip >= num_rows:
+                skip -= num_rows
+            else:
+                row_groups.append(row_group)
+        if not row_groups:
+            return
+
+        for batch in parquet_file.iter_batches(batch_size=self.chunk_size, row_groups=row_groups,
+                                               columns=["image1", "image2"]):
+            if skip >= batch.num_rows:
+                skip -= batch.num_rows
+                continue
+            batch = batch.slice(skip)
+            skip = 0
+            yield from zip(batch.column(0).to_pylist(), batch.column(1).to_pylist())
 
 
 class CSVOutputHandler:
-    def __init__(self, filename, headers, delimiter=',', quotechar='"'):
+    """Writes `FilePair` objects to a CSV file.
+
+    `write` writes all pairs at once. For incremental writing, `open` the handler, call `write_pair` for every pair
+    and `close` it, or use `with handler.open(): ...`; rows are flushed to disk every `flush_every` pairs, so the
+    results written so far survive a crash.
+
+    With `checkpoint=True` every flush is synced to disk and recorded in a sidecar file (filename + ".ckpt") as the
+    line number of the last written pair and the size of the output. `resume` uses it to drop a partially written row
+    and continue after the last recorded pair. Pairs must be written in line number order.
+    """
+    def __init__(self, filename, headers, delimiter=',', quotechar='"', flush_every=100, checkpoint=False):
         self.filename = filename
         self.delimiter = delimiter
         self.quotechar = quotechar
         self.headers = headers
+        self.flush_every = flush_every
+        self.checkpoint = checkpoint
+        self.checkpoint_filename = f"{filename}.ckpt"
+        self.last_line_num = 0
+        self._csv_file = None
+        self._writer = None
+        self._unflushed = 0
 
     def write(self, pairs, overwrite=False):
-        # Check headers if they are missing get the field info from private obj.__dict__
+        self.open(overwrite)
+        try:
+            for pair in pairs:
+                self.write_pair(pair)
+        finally:
+            self.close()
+
+    def open(self, overwrite=False):
+        """Opens the output file for incremental writing
+
+        :param overwrite: replace the file if it already exists
+        :return: self
+        :raises:
+            FileError: if the output is a folder or already exists and overwrite is False
+        """
+        check_output_file(self.filename, overwrite)
+        self.remove_checkpoint()
+        self.__open_writer('w', write_headers=True)
+        return self
+
+    def resume(self):
+        """Opens an existing output file to append the remaining pairs
+
+        The file is truncated to the size recorded by the last checkpoint. Without a checkpoint, the complete rows
+        of the file are kept and they are assumed to be the pairs with line numbers starting from 1.
+        If the file does not exist, it is created like `open` does. The header of the file must be the headers of
+        the handler, rows of different fields can not be appended to it.
+
+        :return: line number of the last pair kept in the file, 0 if there is nothing to resume
+        :raises:
+            FileError: if the output is a folder or its header is different
+        """
+        if os.path.isdir(self.filename):
+            raise FileError(self.filename, "Can not use a folder as output file.")
+        if not os.path.isfile(self.filename):
+            self.open()
+            return 0
+
+        line_num, size = self.__read_checkpoint()
+        if size is None:
+            line_num, size = self.__count_complete_rows()
+        if size > 0:
+            self.__check_headers()
+
+        with open(self.filename, 'r+b') as output_file:
+            output_file.truncate(size)
+        self.__open_writer('a', write_headers=size == 0)
+        self.last_line_num = line_num
+        return line_num
+
+    def __open_writer(self, mode, write_headers):
+        self._csv_file = open(self.filename, mode, newline='')
+        self._writer = csv.writer(self._csv_file, delimiter=self.delimiter,
+                                  quotechar=self.quotechar, quoting=csv.QUOTE_NONNUMERIC)
+        self._unflushed = 0
+        self._headers_written = not write_headers
+        if write_headers and self.headers:
+            self._writer.writerow(self.headers)
+            self._headers_written = True
+
+    def __check_headers(self):
+        """Checks the header of the existing file against the headers, the handler takes it if it has none"""
+        with open(self.filename, 'r', newline='') as output_file:
+            headers = next(csv.reader(output_file, delimiter=self.delimiter, quotechar=self.quotechar), [])
+        if not self.headers:
+            self.headers = headers
+        elif headers != list(self.headers):
+            raise FileError(self.filename, f"Can not resume, the output has the columns {headers} instead of "
+                                           f"{list(self.headers)}. Use the same options or --overwrite-output")
+
+    def __read_checkpoint(self):
+        """Returns the last (line_num, size) record of the checkpoint file, (0, None) if there is no valid one"""
+        if not os.path.isfile(self.checkpoint_filename):
+            return 0, None
+        with open(self.checkpoint_filename, 'r') as checkpoint_file:
+            # A record is complete only if its line is terminated
+            records = [line.split(",") for line in checkpoint_file if line.endswith("\n")]
+        for record in reversed(records):
+            try:
+                line_num, size = int(record[0]), int(record[1])
+            except (ValueError, IndexError):
+                continue
+            if size <= os.path.getsize(self.filename):
+                return line_num, size
+        return 0, None
+
+    def __count_complete_rows(self):
+        """Returns the number of complete data rows and the size of the file up to the end of the last one"""
+        with open(self.filename, 'rb') as output_file:
+            content = output_file.read()
+        size = content.rfind(b"\n") + 1
+        rows = csv.reader(content[:size].decode().splitlines(), delimiter=self.delimiter, quotechar=self.quotechar)
+        return max(0, sum(1 for _ in rows) - 1), size
+
+    def write_table(self, table, overwrite=False):
+        """Writes the pairs of a `models.PairTable` in bulk, column by column
+
+        Rows are written in chunks of `TABLE_CHUNK_SIZE` pairs, the file is flushed after every chunk.
+
+        :param table: `models.PairTable` object
+        :param overwrite: replace the file if it already exists
+        """
+        self.open(overwrite)
+        try:
+            if self.headers is None or len(self.headers) == 0:
+                self.headers = ["image1", "image2"] + list(PairTable.COLUMNS)
+                self._writer.writerow(self.headers)
+                self._headers_written = True
+            for start in range(0, len(table), TABLE_CHUNK_SIZE):
+                stop = min(start + TABLE_CHUNK_SIZE, len(table))
+                self._writer.writerows(zip(*[table.column(field, start, stop) for field in self.headers]))
+                self.last_line_num = int(table.line_num[stop - 1])
+                self.flush()
+        finally:
+            self.close()
+
+    def write_pair(self, pair):
+        # Check headers if they are missing get the field info from the pair
         if self.headers is None or len(self.headers) == 0:
-            pair = pairs[0]
-            self.headers = pair.__dict__.keys()
+            self.headers = list(pair.to_dict().keys())
+        pair_dict = pair.to_dict(self.headers)
+        if not self._headers_written:
+            self._writer.writerow(self.headers)
+            self._headers_written = True
 
-        # Check if file exists
-        if os.path.exists(self.filename):
-            # Can be a folder, report and stop execution
-            if os.path.isdir(self.filename):
-                raise FileError(self.filename, "Can not use a folder as output file.")
+        self._writer.writerow(self.to_list(pair_dict))
+        self.last_line_num = pair.line_num
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._csv_file.flush()
+        self._unflushed = 0
+        if self.checkpoint:
+            # Rows must be on disk before the checkpoint refers to them
+            os.fsync(self._csv_file.fileno())
+            size = os.fstat(self._csv_file.fileno()).st_size
+            with open(self.checkpoint_filename, 'a') as checkpoint_file:
+                checkpoint_file.write(f"{self.last_line_num},{size}\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
 
-            if os.path.isfile(self.filename) and overwrite is False:
-                raise FileError(self.filename, "File already exists. Use overwrite=True if you want to replace it.")
+    def remove_checkpoint(self):
+        if os.path.isfile(self.checkpoint_filename):
+            os.remove(self.checkpoint_filename)
 
-        with open(self.filename, 'w', newline='') as csv_file:
-            writer = csv.writer(csv_file, delimiter=self.delimiter,
-                                quotechar=self.quotechar, quoting=csv.QUOTE_NONNUMERIC)
-            writer.writerow(self.headers)
-            writer.writerows([self.to_list(pair.__dict__) for pair in pairs])
+    def close(self):
+        if self._csv_file is not None:
+            if self._unflushed:
+                self.flush()
+            self._csv_file.close()
+            self._csv_file = None
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def to_list(self, pair_dict):
         return [pair_dict[fieldname] for fieldname in self.headers]
+
+
+class ColumnarOutputHandler:
+    """Base class of the handlers writing `FilePair` objects to columnar files with typed columns.
+
+    The handler is used like `CSVOutputHandler`. Pairs are buffered column by column and written as a row group
+    (record batch) of `row_group_size` pairs, `write_table` writes a `models.PairTable` without creating the pairs.
+    A columnar file can only be read after it is closed, so there are no checkpoints and only a missing output can
+    be resumed; `checkpoint` is accepted to keep the interface of `CSVOutputHandler`.
+
+    Subclasses create the pyarrow writer of their file format in `_create_writer`.
+    """
+    def __init__(self, filename, headers, row_group_size=ROW_GROUP_SIZE, checkpoint=False):
+        self.filename = filename
+        self.headers = headers
+        self.row_group_size = row_group_size
+        self.checkpoint = checkpoint
+        self.last_line_num = 0
+        self._pa = None
+        self._writer = None
+        self._schema = None
+        self._columns = None
+
+    def write(self, pairs, overwrite=False):
+        self.open(overwrite)
+        try:
+            for pair in pairs:
+                self.write_pair(pair)
+        finally:
+            self.close()
+
+    def open(self, overwrite=False):
+        """Opens the output file for incremental writing
+
+        :param overwrite: replace the file if it already exists
+        :return: self
+        :raises:
+            FileError: if the output is a folder or already exists and overwrite is False, or pyarrow is missing
+        """
+        check_output_file(self.filename, overwrite)
+        self._pa = import_pyarrow(self.filename)
+        self._writer = None
+        self._columns = {}
+        if self.headers:
+            self.__open_writer()
+        return self
+
+    def resume(self):
+        """Creates the output file if it does not exist, existing columnar files can not be appended to
+
+        :return: 0, as there is nothing to resume
+        :raises:
+            FileError: if the output already exists
+        """
+        if os.path.exists(self.filename):
+            raise FileError(self.filename, "Only CSV output files can be resumed")
+        self.open()
+        return 0
+
+    def __open_writer(self):
+        pa = self._pa
+        self._schema = pa.schema([(field, pa.type_for_alias(FIELD_TYPES.get(field, "float64")))
+                                  for field in self.headers])
+        self._writer = self._create_writer(pa, self._schema)
+        self._columns = {field: [] for field in self.headers}
+
+    def _create_writer(self, pa, schema):
+        raise NotImplementedError
+
+    def write_pair(self, pair):
+        # Check headers if they are missing get the field info from the pair
+        if self._writer is None:
+            self.headers = list(pair.to_dict().keys())
+            self.__open_writer()
+        pair_dict = pair.to_dict(self.headers)
+
+        for field, values in self._columns.items():
+            values.append(pair_dict[field])
+        self.last_line_num = pair.line_num
+        if len(self._columns[self.headers[0]]) >= self.row_group_size:
+            self.flush()
+
+    def write_table(self, table, overwrite=False):
+        """Writes the pairs of a `models.PairTable` in bulk, a row group at a time
+
+        :param table: `models.PairTable` object
+        :param overwrite: replace the file if it already exists
+        """
+        self.open(overwrite)
+        try:
+            if self._writer is None:
+                self.headers = ["image1", "image2"] + list(PairTable.COLUMNS)
+                self.__open_writer()
+            pa = self._pa
+            paths = pa.array(table.paths, type=pa.string())
+            for start in range(0, len(table), self.row_group_size):
+                stop = min(start + self.row_group_size, len(table))
+                columns = []
+                for field in self.headers:
+                    if field in ("image1", "image2"):
+                        columns.append(paths.take(pa.array(getattr(table, field)[start:stop])))
+                    elif field in PairTable.COLUMNS:
+                        columns.append(pa.array(getattr(table, field)[start:stop]))
+                    else:
+                        columns.append(pa.array(table.column(field, start, stop), type=pa.float64()))
+                self.__write_batch(columns)
+                self.last_line_num = int(table.line_num[stop - 1])
+        finally:
+            self.close()
+
+    def __write_batch(self, columns):
+        pa = self._pa
+        batch = pa.RecordBatch.from_arrays(columns, schema=self._schema)
+        self._writer.write_table(pa.Table.from_batches([batch]))
+
+    def flush(self):
+        """Writes the buffered pairs as a row group"""
+        if self._writer is None or not self._columns[self.headers[0]]:
+            return
+        self.__write_batch([self._pa.array(self._columns[field], type=self._schema.field(field).type)
+                            for field in self.headers])
+        self._columns = {field: [] for field in self.headers}
+
+    def remove_checkpoint(self):
+        pass
+
+    def close(self):
+        if self._pa is None:
+            return
+        if self._writer is None:
+            # Nothing was written, the file still gets the default fields
+            self.headers = ["image1", "image2"] + list(PairTable.COLUMNS)
+            self.__open_writer()
+        self.flush()
+        self._writer.close()
+        self._writer = None
+        self._pa = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParquetOutputHandler(ColumnarOutputHandler):
+    """Writes `FilePair` objects to a Parquet file, every batch of `row_group_size` pairs is a row group"""
+
+    def _create_writer(self, pa, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.filename, schema)
+
+
+class ArrowOutputHandler(ColumnarOutputHandler):
+    """Writes `FilePair` objects to an Arrow IPC file, every batch of `row_group_size` pairs is a record batch"""
+
+    def _create_writer(self, pa, schema):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(self.filename, schema)
+
+
+def split_glob(source):
+    """Splits a glob pattern into the folder to scan and the pattern of the relative paths
+
+    :param source: folder or glob pattern e.g. photos/**/*.jpg
+    :return: (folder, pattern) e.g. ("photos", "**/*.jpg"), pattern is None if the source is not a glob pattern,
+        folder is "" if the pattern is relative to the current folder
+    """
+    if not GLOB_CHARACTERS.search(source):
+        return source, None
+    parts = source.replace(os.sep, "/").split("/")
+    first_glob = next(i for i, part in enumerate(parts) if GLOB_CHARACTERS.search(part))
+    # An empty first part is the root of an absolute pattern e.g. /*.png
+    return "/".join(parts[:first_glob]) or ("/" if first_glob else ""), "/".join(parts[first_glob:])
+
+
+def match_glob(relative_path, pattern):
+    """Returns whether a relative path matches a glob pattern of relative paths
+
+    The components are matched one by one with `fnmatch.fnmatchcase`, so `*`, `?` and `[...]` match within
+    a component, and a `**` component matches any number of folders.
+
+    :param relative_path: path relative to the folder of the pattern, with /
+    :param pattern: glob pattern e.g. **/*.jpg
+    :return: bool
+    """
+    return __match_components(relative_path.split("/"), pattern.split("/"))
+
+
+def __match_components(components, patterns):
+    if not patterns:
+        return not components
+    if patterns[0] == "**":
+        return any(__match_components(components[skip:], patterns[1:]) for skip in range(len(components) + 1))
+    return bool(components) and fnmatch.fnmatchcase(components[0], patterns[0]) and \
+        __match_components(components[1:], patterns[1:])
+
+
+def scan_images(source):
+    """Yields the images of a folder, recursively, or the files matching a glob pattern
+
+    Folders are read with `os.scandir`, the names of a folder are sorted so the images are always yielded in the same
+    order, and only the folders being read are kept in memory. Without a pattern the files with one of the
+    `IMAGE_EXTENSIONS` are images, a pattern is matched with `match_glob` and a pattern without `**` is not matched
+    below its depth. An existing folder is scanned as a folder, even if its name has glob characters.
+
+    :param source: folder or glob pattern e.g. photos/**/*.jpg
+    :return: generator of (relative path, path), the relative path is relative to the folder of the source, with /
+    :raises:
+        FileError: if the folder does not exist
+    """
+    folder, pattern = (source, None) if os.path.isdir(source) else split_glob(source)
+    if not os.path.isdir(folder or "."):
+        raise FileError(folder, "No such folder exists")
+    max_depth = pattern.count("/") if pattern is not None and "**" not in pattern.split("/") else None
+
+    stack = [("", iter(__read_folder(folder or ".")))]
+    while stack:
+        prefix, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        name, is_dir = entry
+        relative_path = prefix + name
+        if is_dir:
+            if max_depth is None or len(stack) <= max_depth:
+                stack.append((relative_path + "/", iter(__read_folder(os.path.join(folder, relative_path)))))
+        elif match_glob(relative_path, pattern) if pattern is not None else \
+                os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            yield relative_path, os.path.join(folder, relative_path)
+
+
+def __read_folder(folder):
+    """Returns the sorted (name, is folder) of the entries of a folder, an empty list if it can not be read"""
+    try:
+        with os.scandir(folder) as entries:
+            return sorted((entry.name, entry.is_dir()) for entry in entries)
+    except OSError:
+        return []
+
+
+class ImageSourceInputHandler(InputHandler):
+    """Base class of the handlers building `FilePair` objects from the images of a folder or glob pattern.
+
+    The pairs are built while the images are scanned with `scan_images`, nothing is stored, so millions of images
+    are streamed into the calculation without a pair file. Every iteration and `count` scans the source again, so
+    `count` is as slow as a scan, line numbers are the position of the pair in the scan order.
+
+    Subclasses yield the image paths of the pair of each scanned image in `_pair_image`, and can leave images out
+    of the scan in `_scan`.
+    """
+    def __init__(self, source, default_filename="<NO_FILE_GIVEN>", start_line=1):
+        super().__init__(source, default_filename=default_filename, start_line=start_line)
+
+    def _check_file(self):
+        folder = self.filename if os.path.isdir(self.filename) else split_glob(self.filename)[0]
+        if not os.path.isdir(folder or "."):
+            raise FileError(folder, "No such folder exists")
+
+    def _count_rows(self):
+        return sum(1 for _ in self._scan())
+
+    def _iter_rows(self, skip):
+        for relative_path, path in itertools.islice(self._scan(), skip, None):
+            yield self._pair_image(relative_path, path)
+
+    def _scan(self):
+        """Yields the (relative path, path) of the images to pair, see `scan_images`"""
+        return scan_images(self.filename)
+
+    def _pair_image(self, relative_path, path):
+        """Returns the (image1, image2) paths of the pair of a scanned image"""
+        raise NotImplementedError
+
+
+class SamePathInputHandler(ImageSourceInputHandler):
+    """Pairs every image of a folder or glob pattern with the file at the same relative path in another folder.
+
+    e.g. source A/ and other folder B/ pair A/x/1.png with B/x/1.png. The other folder is not scanned, an image
+    which does not have a namesake is skipped as a missing file while calculating.
+
+    :param source: folder or glob pattern of the first images
+    :param other_folder: folder of the second images
+    """
+    def __init__(self, source, other_folder, default_filename="<NO_FILE_GIVEN>", start_line=1):
+        super().__init__(source, default_filename=default_filename, start_line=start_line)
+        self.other_folder = other_folder
+
+    def _check_file(self):
+        super()._check_file()
+        if not os.path.isdir(self.other_folder):
+            raise FileError(self.other_folder, "No such folder exists")
+
+    def _pair_image(self, relative_path, path):
+        return path, os.path.join(self.other_folder, relative_path)
+
+
+class ReferenceInputHandler(ImageSourceInputHandler):
+    """Pairs a reference image with every image of a folder or glob pattern.
+
+    The reference image is not paired with itself when it is one of the scanned images.
+
+    :param source: folder or glob pattern of the images
+    :param reference: path of the reference image, the first image of every pair
+    """
+    def __init__(self, source, reference, default_filename="<NO_FILE_GIVEN>", start_line=1):
+        super().__init__(source, default_filename=default_filename, start_line=start_line)
+        self.reference = reference
+
+    def _scan(self):
+        reference = os.path.abspath(self.reference)
+        return ((relative_path, path) for relative_path, path in super()._scan()
+                if os.path.abspath(path) != reference)
+
+    def _pair_image(self, relative_path, path):
+        return self.reference, path
@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""This module contains the perceptual hash functions, the packed hash helpers and the persistent hash store"""
+
+import os
+import time
+import logging
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_compare.util import format_progress
+from image_compare.distances import DEFAULT_HASH_SIZE
+
+
+# Hash methods with a vectorized implementation, see `hash_batch`
+BATCH_HASH_METHODS = ("dhash", "avghash", "phash")
+
+# Ratio of the image size to the hash size of phash, as in imagehash
+PHASH_HIGHFREQ_FACTOR = 4
+
+# Number of images resized and hashed at once by `hash_images_batch`, bounds the memory of the resized pixels
+BATCH_CHUNK_SIZE = 1024
+
+# Number of bits of a packed hash word, a hash of hash_size 8 is 1 word and of hash_size 16 is 4 words
+WORD_BITS = 64
+
+# Number of set bits of every byte value, used when NumPy does not have `bitwise_count` (before NumPy 2)
+POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+HAS_BITWISE_COUNT = hasattr(np, "bitwise_count")
+
+# Store used by the hash based similarity methods of this process, see `open_hash_store`
+hash_store = None
+
+
+def __resize_pixels(image, size):
+    """Returns the grayscale pixels of the PIL image resized to (width, height), as imagehash resizes them"""
+    return np.asarray(image.convert("L").resize(size, Image.LANCZOS))
+
+
+def dhash(image, hash_size=DEFAULT_HASH_SIZE):
+    """Returns the difference hash bits of a PIL image, bit by bit identical to `imagehash.dhash`
+
+    :return: (hash_size, hash_size) bool ndarray
+    """
+    return hash_bits(__resize_pixels(image, get_hash_input_size("dhash", hash_size))[np.newaxis], "dhash",
+                     hash_size)[0]
+
+
+def average_hash(image, hash_size=DEFAULT_HASH_SIZE):
+    """Returns the average hash bits of a PIL image, bit by bit identical to `imagehash.average_hash`
+
+    :return: (hash_size, hash_size) bool ndarray
+    """
+    return hash_bits(__resize_pixels(image, get_hash_input_size("avghash", hash_size))[np.newaxis], "avghash",
+                     hash_size)[0]
+
+
+def phash(image, hash_size=DEFAULT_HASH_SIZE):
+    """Returns the perceptual hash bits of a PIL image, bit by bit identical to `imagehash.phash`
+
+    :return: (hash_size, hash_size) bool ndarray
+    """
+    return hash_bits(__resize_pixels(image, get_hash_input_size("phash", hash_size))[np.newaxis], "phash",
+                     hash_size)[0]
+
+
+def whash(image, hash_size=DEFAULT_HASH_SIZE):
+    """Returns the Haar wavelet hash bits of a PIL image, bit by bit identical to `imagehash.whash`
+
+    The image is resized to the largest power of 2 not larger than its shorter side, its lowest frequency is removed
+    and the low frequency band of hash_size * hash_size coefficients is compared to its median.
+
+    :param hash_size: hash size, a power of 2
+    :return: (hash_size, hash_size) bool ndarray
+    """
+    import pywt
+    if hash_size & (hash_size - 1):
+        raise ValueError(f"hash_size of whash should be a power of 2, not {hash_size}")
+    image_scale = max(2 ** int(np.log2(min(image.size))), hash_size)
+    ll_max_level = int(np.log2(image_scale))
+    pixels = __resize_pixels(image, (image_scale, image_scale)) / 255.
+    coeffs = pywt.wavedec2(pixels, "haar", level=ll_max_level)
+    coeffs[0] *= 0
+    pixels = pywt.waverec2(coeffs, "haar")
+    dwt_low = pywt.wavedec2(pixels, "haar", level=ll_max_level - int(np.log2(hash_size)))[0]
+    return dwt_low > np.median(dwt_low)
+
+
+# Hash functions by similarity method name, taking a PIL image and the hash_size and returning the hash bits
+HASH_FUNCTIONS = {
+    "dhash": dhash,
+    "avghash": average_hash,
+    "phash": phash,
+    "whash": whash,
+}
+
+
+def get_hash_function(method):
+    """Returns the hash function of a hash method
+
+    :param method: hash method name e.g. dhash
+    :return: function taking a PIL image and the hash_size, returning a (hash_size, hash_size) bool ndarray
+    """
+    return HASH_FUNCTIONS[method]
+
+
+def get_hash_words(hash_size):
+    """Returns the number of uint64 words of a packed hash"""
+    return (hash_size * hash_size + WORD_BITS - 1) // WORD_BITS
+
+
+def pack_words(bits):
+    """Packs rows of hash bits into uint64 words
+
+    The bytes of the words are the bits packed by `np.packbits`, padded with zero bytes to a whole word, so the
+    Hamming distance of two hashes is the popcount of the XOR of their words.
+
+    :param bits: (N, nbits) bool ndarray, the flattened bits of a hash per row
+    :return: (N, words) uint64 ndarray
+    """
+    packed = np.packbits(bits, axis=1)
+    padding = -packed.shape[1] % (WORD_BITS // 8)
+    if padding:
+        packed = np.pad(packed, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def pack_hash(bits):
+    """Packs the bits of a hash into bytes
+
+    :param bits: hash bits of any shape, e.g. returned by the `HASH_FUNCTIONS`
+    :return: bytes of the uint64 words returned by `pack_words`, 8 bits of the hash per byte
+    """
+    return pack_words(np.asarray(bits).reshape(1, -1)).tobytes()
+
+
+def unpack_words(packed_hashes, hash_size):
+    """Returns packed hashes as uint64 words
+
+    :param packed_hashes: list of bytes returned by `pack_hash`, shorter ones are padded with zero bytes
+    :param hash_size: hash size of the hashes
+    :return: (N, words) uint64 ndarray, a hash per row
+    """
+    words = get_hash_words(hash_size)
+    data = b"".join(bits.ljust(words * WORD_BITS // 8, b"\0") for bits in packed_hashes)
+    return np.frombuffer(data, dtype=np.uint64).reshape(len(packed_hashes), words)
+
+
+def hamming_distance(words1, words2):
+    """Returns the number of different bits between two packed hashes
+
+    :param words1: uint64 ndarray returned by `pack_words`
+    :param words2: uint64 ndarray returned by `pack_words`
+    :return: int
+    """
+    return int(hamming_distances(words1.reshape(1, -1), words2.reshape(1, -1))[0])
+
+
+def hamming_distances(words1, words2):
+    """Vectorized `hamming_distance` over rows of packed hashes
+
+    The bits of the XOR of the words are counted by `np.bitwise_count` of NumPy 2, older versions look up the bytes
+    of the words in `POPCOUNT_TABLE`.
+
+    :param words1: (N, words) uint64 ndarray, a packed hash per row
+    :param words2: (N, words) uint64 ndarray, a packed hash per row
+    :return: (N,) ndarray of the number of different bits per row
+    """
+    different = np.bitwise_xor(words1, words2)
+    if HAS_BITWISE_COUNT:
+        return np.bitwise_count(different).sum(axis=1, dtype=np.int64)
+    return POPCOUNT_TABLE[different.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+def hash_image(path, method, hash_size=DEFAULT_HASH_SIZE):
+    """Calculates the packed hash of a single image
+
+    :param path: image path
+    :param method: hash method name e.g. dhash
+    :param hash_size: hash size
+    :return: (bits, (width, height), elapsed) or None if the file does not exist,
+        elapsed is the processing time spent for the image
+    """
+    ts = time.process_time()
+    try:
+        with Image.open(path) as image:
+            bits = pack_hash(get_hash_function(method)(image, hash_size=hash_size))
+            size = image.size
+    except FileNotFoundError:
+        return None
+    return bits, size, time.process_time() - ts
+
+
+def get_hash_input_size(method, hash_size):
+    """Returns the (width, height) an image is resized to before it is hashed with a batch hash method"""
+    if method == "dhash":
+        return hash_size + 1, hash_size
+    if method == "phash":
+        return hash_size * PHASH_HIGHFREQ_FACTOR, hash_size * PHASH_HIGHFREQ_FACTOR
+    return hash_size, hash_size
+
+
+def hash_bits(pixels, method, hash_size=DEFAULT_HASH_SIZE):
+    """Calculates the hash bits of a batch of images at once, bit by bit identical to the imagehash functions
+
+    :param pixels: (N, height, width) uint8 ndarray of grayscale images resized to `get_hash_input_size`
+    :param method: one of `BATCH_HASH_METHODS`
+    :param hash_size: hash size
+    :return: (N, hash_size, hash_size) bool ndarray
+    """
+    count = len(pixels)
+    if method == "dhash":
+        # Differences between the columns
+        bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    elif method == "avghash":
+        bits = pixels > pixels.reshape(count, -1).mean(axis=1).reshape(count, 1, 1)
+    elif method == "phash":
+        import scipy.fftpack
+        dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+        low_frequencies = dct[:, :hash_size, :hash_size]
+        bits = low_frequencies > np.median(low_frequencies.reshape(count, -1), axis=1).reshape(count, 1, 1)
+    else:
+        raise ValueError(f"{method} does not have a batch implementation")
+    return bits
+
+
+def hash_batch(pixels, method, hash_size=DEFAULT_HASH_SIZE):
+    """Calculates the packed hashes of a batch of images at once, see `hash_bits`
+
+    :return: (N, words) uint64 ndarray, a packed hash per row like `pack_words` returns
+    """
+    return pack_words(hash_bits(pixels, method, hash_size).reshape(len(pixels), -1))
+
+
+def hash_images_batch(paths, method, hash_size=DEFAULT_HASH_SIZE, chunk_size=BATCH_CHUNK_SIZE):
+    """Calculates the packed hashes of the given images with a batch hash method
+
+    The images are processed in chunks of chunk_size images: every image of a chunk is converted to grayscale and
+    resized one by one, then all of them are hashed at once.
+
+    :param paths: list of image paths
+    :param method: one of `BATCH_HASH_METHODS`
+    :param hash_size: hash size
+    :param chunk_size: number of images hashed at once
+    :return: dictionary of path -> (bits, (width, height)) or None if the file does not exist
+    """
+    input_size = get_hash_input_size(method, hash_size)
+    pixels = np.empty((min(chunk_size, len(paths)), input_size[1], input_size[0]), dtype=np.uint8)
+    hashes = dict.fromkeys(paths)
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        found = []
+        sizes = {}
+        for i, path in enumerate(chunk):
+            try:
+                with Image.open(path) as image:
+                    sizes[path] = image.size
+                    pixels[i] = np.asarray(image.convert("L").resize(input_size, Image.LANCZOS))
+                    found.append(i)
+            except FileNotFoundError:
+                pass
+        if found:
+            for i, bits in zip(found, hash_batch(pixels[found], method, hash_size)):
+                hashes[chunk[i]] = bits.tobytes(), sizes[chunk[i]]
+    return hashes
+
+
+def hash_unique_images(paths, method, hash_size=DEFAULT_HASH_SIZE, workers=1):
+    """Calculates the packed hash of every given image once
+
+    Hashes found in the `hash_store` of this process are reused, the calculated ones are added to it.
+
+    :param paths: iterable of image paths, duplicates are hashed once
+    :param method: hash method name e.g. dhash
+    :param hash_size: hash size
+    :param workers: number of processes used to calculate the hashes
+    :return: dictionary of path -> `hash_image` result
+    """
+    hashes = {}
+    missing = []
+    for path in dict.fromkeys(paths):
+        try:
+            entry = hash_store.lookup(path, method, hash_size) if hash_store is not None else None
+        except FileNotFoundError:
+            hashes[path] = None
+            continue
+        if entry is None:
+            missing.append(path)
+        else:
+            hashes[path] = entry + (0.0,)
+
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            chunksize = max(1, len(missing) // (workers * 4))
+            results = executor.map(hash_image, missing, [method] * len(missing), [hash_size] * len(missing),
+                                   chunksize=chunksize)
+            hashes.update(zip(missing, results))
+    else:
+        hashes.update((path, hash_image(path, method, hash_size)) for path in missing)
+
+    if hash_store is not None:
+        hash_store.store_many((path, method, hash_size) + hashes[path][:2]
+                              for path in missing if hashes[path] is not None)
+
+    return hashes
+
+
+def score_pairs_by_hash(pairs, method, hash_size=DEFAULT_HASH_SIZE, workers=1, num_of_pairs=0, chunk_size=10000):
+    """Calculates the similarity of the given pairs with a hash method in two phases
+
+    First every unique image is hashed once, then the similarities are calculated with a vectorized
+    XOR and popcount over the packed hashes, chunk by chunk. Pairs with a missing image or with different image
+    sizes are marked as skipped, like the per pair methods do. The elapsed time of a pair is its share of the hashing
+    time of its images plus its share of the comparison time.
+
+    Pairs are iterated twice, once to collect the images and once to score them, so they can be streamed from
+    a re-iterable source like `CSVInputHandler`; only the hashes of the unique images are kept in memory.
+
+    :param pairs: re-iterable of `FilePair` objects e.g. a list or an input handler
+    :param method: hash method name e.g. dhash
+    :param hash_size: hash size
+    :param workers: number of processes used to calculate the hashes
+    :param num_of_pairs: total number of pairs, used for progress logging, None if it is not known
+    :param chunk_size: number of pairs compared at once
+    :return: generator of updated `FilePair` objects, in the input order
+    """
+    uses = Counter(path for pair in pairs if pair.skipped is False for path in (pair.image1, pair.image2))
+    hashes = hash_unique_images(uses, method, hash_size=hash_size, workers=workers)
+    logging.info(f"Hashed {len(hashes)} unique image(s)")
+
+    index = {path: i for i, path in enumerate(path for path, entry in hashes.items() if entry is not None)}
+    bits = unpack_words([hashes[path][0] for path in index], hash_size)
+    # Share the hashing time of every image between the pairs using it
+    hash_times = np.array([hashes[path][2] / uses[path] for path in index])
+
+    chunk = []
+    for pair in pairs:
+        chunk.append(pair)
+        if len(chunk) >= chunk_size:
+            yield from __score_chunk(chunk, hashes, index, bits, hash_times, hash_size, num_of_pairs)
+            chunk = []
+    yield from __score_chunk(chunk, hashes, index, bits, hash_times, hash_size, num_of_pairs)
+
+
+def __score_chunk(chunk, hashes, index, bits, hash_times, hash_size, num_of_pairs):
+    ts = time.process_time()
+    valid = []
+    errors = [None] * len(chunk)
+    for position, pair in enumerate(chunk):
+        if pair.skipped:
+            continue
+        missing = [path for path in (pair.image1, pair.image2) if hashes[path] is None]
+        if missing:
+            pair.skipped = True
+            errors[position] = f"File Not Found: {missing[0]}"
+            continue
+        size1, size2 = hashes[pair.image1][1], hashes[pair.image2][1]
+        if size1 != size2:
+            pair.skipped = True
+            errors[position] = f"Images should be same size, " \
+                               f"[line:{pair.line_num}]:{pair.image1}[{size1}], {pair.image2}[{size2}]"
+            continue
+        valid.append(pair)
+
+    if valid:
+        index1 = np.fromiter((index[pair.image1] for pair in valid), dtype=np.int64, count=len(valid))
+        index2 = np.fromiter((index[pair.image2] for pair in valid), dtype=np.int64, count=len(valid))
+        distances = hamming_distances(bits[index1], bits[index2])
+        elapsed = hash_times[index1] + hash_times[index2] + (time.process_time() - ts) / len(valid)
+        for pair, distance, pair_elapsed in zip(valid, distances.tolist(), elapsed.tolist()):
+            pair.similarity = round(float(distance) / (hash_size * hash_size), 3)
+            pair.elapsed = pair_elapsed
+
+    for pair, error in zip(chunk, errors):
+        if error is not None:
+            logging.warning(f"Skipping line number:{pair.line_num}, "
+                            f"error occured while calculating similarity> {error}")
+        elif pair.skipped:
+            logging.warning(f"Skipping line number:{pair.line_num}")
+        else:
+            logging.info(f"Processed: {format_progress(pair.line_num, num_of_pairs)} - "
+                         f"similarity:{pair.similarity:.4f}\telapsed:{pair.elapsed:.5f}")
+        yield pair
+
+
+def open_hash_store(filename):
+    """Opens the persistent hash store used by the hash based similarity methods of this process
+
+    :param filename: path of the SQLite database, created if missing
+    :return: the opened `HashStore`
+    """
+    global hash_store
+    close_hash_store()
+    hash_store = HashStore(filename)
+    return hash_store
+
+
+def close_hash_store():
+    """Closes the hash store of this process, if there is one"""
+    global hash_store
+    if hash_store is not None:
+        hash_store.close()
+        hash_store = None
+
+
+class HashStore:
+    """Persistent store of packed perceptual hashes, backed by SQLite.
+
+    Hashes are stored per (path, method, hash_size) along with the modification time and size of the file,
+    an entry is only reused while both of them match the file on disk. The image size is stored too,
+    so the pair dimension check does not need to decode the image.
+
+    :param filename: path of the SQLite database, created if missing
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        # Worker processes share the database, wait for the writer instead of failing
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                                "path TEXT NOT NULL, method TEXT NOT NULL, hash_size INTEGER NOT NULL, "
+                                "mtime_ns INTEGER NOT NULL, file_size INTEGER NOT NULL, "
+                                "width INTEGER NOT NULL, height INTEGER NOT NULL, bits BLOB NOT NULL, "
+                                "PRIMARY KEY (path, method, hash_size))")
+        self.connection.commit()
+
+    def lookup(self, path, method, hash_size):
+        """Returns the stored hash of the file if it is still valid
+
+        :param path: image path
+        :param method: hash method name e.g. dhash
+        :param hash_size: hash size used to calculate the hash
+        :return: (bits, (width, height)) or None if the hash is missing or stale
+        :raises:
+            FileNotFoundError: if the path does not exist
+        """
+        stat = os.stat(path)
+        row = self.connection.execute("SELECT mtime_ns, file_size, width, height, bits FROM hashes "
+                                      "WHERE path=? AND method=? AND hash_size=?",
+                                      (path, method, hash_size)).fetchone()
+        if row is None or row[0] != stat.st_mtime_ns or row[1] != stat.st_size:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row[4], (row[2], row[3])
+
+    def store(self, path, method, hash_size, bits, image_size):
+        """Stores the packed hash of the file, replacing the previous one
+
+        :param path: image path
+        :param method: hash method name e.g. dhash
+        :param hash_size: hash size used to calculate the hash
+        :param bits: packed hash returned by `pack_hash`
+        :param image_size: (width, height) of the image
+        """
+        self.store_many([(path, method, hash_size, bits, image_size)])
+
+    def store_many(self, entries):
+        """Stores the packed hashes of many files in a single transaction, see `store`
+
+        :param entries: iterable of (path, method, hash_size, bits, image_size) tuples
+        """
+        rows = []
+        for path, method, hash_size, bits, image_size in entries:
+            stat = os.stat(path)
+            rows.append((path, method, hash_size, stat.st_mtime_ns, stat.st_size, image_size[0], image_size[1], bits))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.connection.close()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
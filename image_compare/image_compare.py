@@ -2,11 +2,17 @@
 
 """Main module."""
 
+import os
 import time
+import signal
 import logging
-from image_compare.similarity import get_similarity_measurement
-from image_compare.exceptions import ICError, FileError, ArgumentError
-from image_compare.file_handlers import FileHandlerFactory
+
+from image_compare.models import STAGES, STAGE_FIELDS, get_similarity_field
+from image_compare.distances import get_distance_names, split_distances
+from image_compare.exceptions import FileError, ArgumentError
+from image_compare.util import DurationHistogram
+from image_compare.file_handlers import FileHandlerFactory, ImageSourceInputHandler, SamePathInputHandler, \
+    ReferenceInputHandler
 
 
 log_levels = {
@@ -24,78 +30,268 @@ class ExitCodes:
     UNKNOWN_ERROR = 90
 
 
+def __format_hash_stats(hash_stats):
+    """Returns the summary line of the hash store counters, empty if there is no hash store"""
+    if hash_stats is None:
+        return ""
+    hash_lookups = max(1, hash_stats["hits"] + hash_stats["misses"])
+    return f"\n\tHash cache: reused:{hash_stats['hits']} calculated:{hash_stats['misses']} " \
+           f"reuse rate:{hash_stats['hits'] / hash_lookups:.1%}"
+
+
+def __format_pack_stats(pack_stats):
+    """Returns the summary line of the pixel pack counters, empty if there is no pixel pack"""
+    if pack_stats is None:
+        return ""
+    return f"\n\tPixel pack: hits:{pack_stats['hits']} misses:{pack_stats['misses']}"
+
+
+def __format_threshold_stats(threshold, num_of_matches, threshold_stats):
+    """Returns the summary line of the threshold mode, empty if there is no threshold"""
+    if threshold is None:
+        return ""
+    line = f"\n\tThreshold: {threshold} matches:{num_of_matches}"
+    if threshold_stats is not None:
+        calculated = max(1, threshold_stats["early_exits"] + threshold_stats["full"])
+        line += f" early exits:{threshold_stats['early_exits']} ({threshold_stats['early_exits'] / calculated:.1%})"
+    return line
+
+
+def __format_cascade_stats(cascade_threshold, methods, num_of_scored_pairs):
+    """Returns the summary line of the pairs scored and eliminated by every method of a cascade, empty without one"""
+    if cascade_threshold is None or len(methods) == 1:
+        return ""
+    line = "\n\tCascade:"
+    for method, next_method in zip(methods, methods[1:] + [None]):
+        scored = num_of_scored_pairs[method]
+        line += f" {method} scored:{scored}"
+        if next_method is not None:
+            line += f" eliminated:{scored - num_of_scored_pairs[next_method]},"
+    return line
+
+
+def __format_schedule_stats(schedule_stats, cache_stats, workers):
+    """Returns the summary line of the decodes of the scheduled order, empty if the pairs are not scheduled
+
+    The decodes are estimated for the cache of a single process, with multiple workers every worker has its own cache
+    and gets a part of the order, so only the actual decodes are reported.
+    """
+    if schedule_stats is None:
+        return ""
+    if workers > 1:
+        line = "\n\tScheduler: estimated decodes are only reported with a single worker"
+    else:
+        line = f"\n\tScheduler: estimated decodes input order:{schedule_stats['input']} " \
+               f"scheduled order:{schedule_stats['scheduled']}"
+    if "image" in cache_stats:
+        line += f" actual decodes:{cache_stats['image']['misses']}"
+    return line
+
+
+def __format_stage_stats(stage_times):
+    """Returns the summary lines of the approximate stage time percentiles, empty if no stage is measured"""
+    if stage_times is None or not any(histogram.count for histogram in stage_times.values()):
+        return ""
+    lines = "\n\tStage times in ms, p50/p95/p99:"
+    for stage in STAGES:
+        lines += f"\n\t\t{stage}:"
+        for clock in ("wall", "cpu"):
+            histogram = stage_times[f"{stage}_{clock}"]
+            p50, p95, p99 = (histogram.percentile(q) * 1000 for q in (50, 95, 99))
+            lines += f" {clock} {p50:.2f}/{p95:.2f}/{p99:.2f}"
+    return lines
+
+
 def __real_main(config):
+    # The scoring modules import numpy, PIL and the scientific libraries, only the commands which score load them
+    from image_compare.parallel import score_pairs
+    from image_compare import hashing
+    from image_compare.pixel_pack import get_index_filename
+    from image_compare.scheduler import schedule_pairs, restore_order
+
     time_start = time.process_time()
     time_end = 0
     try:
         input_handler = None
         output_handler = None
-        similarity = None
-        pairs = None
         num_of_pairs = 0
+        # Init similarity, every method of a comma separated distance is calculated, as a cascade with a threshold
+        try:
+            methods = split_distances(config.distance)
+            if len(methods) == 1 and config.cascade_threshold is not None:
+                logging.warning(f"--cascade-threshold is only used by multiple distances, {config.distance} ignores it")
+            if config.max_side is not None and not {"ssim", "nrmse"} & set(methods):
+                logging.warning(f"--max-side is only used by ssim and nrmse, {config.distance} ignores it")
+            if config.two_phase and config.schedule:
+                logging.warning("--schedule is ignored by two phase mode, it decodes every image once")
+            if config.two_phase and config.distance not in get_distance_names("hash"):
+                raise ArgumentError(f"Two phase mode is only supported by hash based methods "
+                                    f"{get_distance_names('hash')}, not {config.distance}")
+            if config.pair_with is not None and config.reference is not None:
+                raise ArgumentError("--pair-with and --reference can not be used together")
+        except ArgumentError as ae:
+            logging.error(ae.message)
+            return ExitCodes.ARGUMENT_ERROR
+
         headers = ["image1", "image2", "similarity", "elapsed"]
+        if len(methods) > 1:
+            headers += [get_similarity_field(method) for method in methods]
+        if config.threshold is not None:
+            headers += ["match", "early_exit"]
+        if config.stage_timings:
+            headers += STAGE_FIELDS
 
         # Init file handlers
         try:
-            input_handler = FileHandlerFactory().getInputHandler(filename=config.input_file)
-            output_handler = FileHandlerFactory().getOutputHandler(filename=config.output_file, headers=headers)
+            if config.pair_with is not None:
+                input_handler = SamePathInputHandler(config.input_file, config.pair_with)
+            elif config.reference is not None:
+                input_handler = ReferenceInputHandler(config.input_file, config.reference)
+            else:
+                input_handler = FileHandlerFactory().getInputHandler(filename=config.input_file)
+            output_handler = FileHandlerFactory().getOutputHandler(filename=config.output_file, headers=headers,
+                                                                   checkpoint=True)
         except FileError as fe:
             logging.error("Error occurred while creating file handlers: {fe}", fe)
             return ExitCodes.FILE_ERROR
 
-        # Init similarity
-        try:
-            similarity = get_similarity_measurement(config.distance)
-        except ArgumentError as ae:
-            logging.error(ae.message)
-            return ExitCodes.ARGUMENT_ERROR
+        if config.pixel_pack is not None and not (os.path.isfile(config.pixel_pack) and
+                                                  os.path.isfile(get_index_filename(config.pixel_pack))):
+            logging.error(f"Pixel pack {config.pixel_pack} or its index {get_index_filename(config.pixel_pack)} "
+                          f"does not exist, create it with image_compare_pack")
+            return ExitCodes.FILE_ERROR
 
-        # Parse input file
+        # Count the input records, pairs are streamed from the input file while calculating. Folders and glob
+        # patterns are not counted, a scan of the whole tree would delay the first pair, progress has no total
         try:
-            logging.info(f"Parsing file {config.input_file}")
-            input_handler.read()
-            pairs = input_handler.records
-            logging.info(f"Successfully parsed. {len(pairs)} pair(s)")
+            if isinstance(input_handler, ImageSourceInputHandler):
+                num_of_pairs = None
+                input_handler.check_file()
+                logging.info(f"Pairing the images of {config.input_file} while they are scanned")
+            else:
+                logging.info(f"Parsing file {config.input_file}")
+                num_of_pairs = input_handler.count()
+                logging.info(f"Successfully parsed. {num_of_pairs} pair(s)")
         except FileError as fe:
             logging.error(f"Error occured while parsing input file. {fe}")
             return ExitCodes.FILE_ERROR
 
-        # Calculate similarity between images and update pair object
-        num_of_pairs = len(pairs)
-        for pair in pairs:
-            if pair.skipped is False:
-                try:
-                    similarity(pair)
-                    logging.info(f"Processed: {pair.line_num:03d}/{num_of_pairs:03d} - "
-                                 f"similarity:{pair.similarity:.4f}\telapsed:{pair.elapsed:.5f}")
-                except ICError as e:
-                    logging.warning(f"Skipping line number:{pair.line_num}, "
-                                    f"error occured while calculating similarity> {e}")
+        # Open output file before calculating, so the results can be written as soon as they are ready
+        try:
+            if config.resume:
+                logging.info(f"Resuming {config.output_file}")
+                resumed_line_num = output_handler.resume()
+                input_handler.start_line = resumed_line_num + 1
+                logging.info(f"Skipping {resumed_line_num} already processed pair(s)")
             else:
-                logging.warning(f"Skipping line number:{pair.line_num}")
+                logging.info(f"Writing pairs to {config.output_file} with overwrite={config.overwrite_output}")
+                output_handler.open(config.overwrite_output)
+        except FileError as fe:
+            logging.error(f"Error occured while opening output file {fe}")
+            return ExitCodes.FILE_ERROR
 
-        # Write pairs to file
+        # Calculate similarity between images and write every pair object as soon as it is updated
+        workers = config.workers if num_of_pairs is None else \
+            max(1, min(config.workers, num_of_pairs - input_handler.start_line + 1))
+        logging.info(f"Calculating similarities with {workers} worker(s)")
+        cache_stats = {}
+        # Stage timings of the calculated pairs in fixed size histograms, for the percentiles of the summary
+        stage_times = {field: DurationHistogram() for field in STAGE_FIELDS} if config.stage_timings else None
+        num_of_processed_pairs = 0
+        num_of_skipped_pairs = 0
+        num_of_matches = 0
+        # Number of pairs scored by every method of a cascade
+        num_of_scored_pairs = {method: 0 for method in methods}
+        schedule_stats = None
+        write_error = None
         try:
-            logging.info(f"Writing pairs to {config.output_file} with overwrite={config.overwrite_output}")
-            output_handler.write(pairs, config.overwrite_output)
-            logging.info(f"Successfully saved {len(pairs)} pair(s).")
-        except FileError as fe:
-            # In case of an error write results to log file
-            logging.error(f"Error occured while writing to output file {fe}")
-            logging.error("To keep the results, pairs will be dumped here")
-            logging.error('\n'+'\n'.join([str(p) for p in pairs]))
+            if config.two_phase:
+                if config.hash_cache is not None:
+                    hashing.open_hash_store(config.hash_cache)
+                pairs = hashing.score_pairs_by_hash(input_handler, config.distance, workers=workers,
+                                                    num_of_pairs=num_of_pairs)
+            else:
+                pairs = iter(input_handler)
+                if config.schedule:
+                    # Pairs are kept in a table, calculated in the scheduled order and written in the input order
+                    table = input_handler.read_table()
+                    pairs, schedule_stats = schedule_pairs(table, config.cache_size)
+                    if workers > 1:
+                        logging.info(f"Scheduled {len(table)} pair(s), the decodes are estimated for a single "
+                                     f"cache, {workers} workers have a cache each")
+                    else:
+                        logging.info(f"Scheduled {len(table)} pair(s), estimated decodes input order:"
+                                     f"{schedule_stats['input']} scheduled order:{schedule_stats['scheduled']}")
+                distance = methods if len(methods) > 1 else config.distance
+                pairs = score_pairs(iter(pairs), distance, workers=workers, num_of_pairs=num_of_pairs,
+                                    cache_size=config.cache_size, hash_cache=config.hash_cache,
+                                    cache_stats=cache_stats, max_side=config.max_side,
+                                    prefetch=config.prefetch, pack_file=config.pixel_pack,
+                                    threshold=config.threshold, cascade_threshold=config.cascade_threshold)
+                if config.schedule:
+                    pairs = restore_order(pairs, table)
+
+            for pair in pairs:
+                num_of_processed_pairs += 1
+                num_of_skipped_pairs += pair.skipped
+                if config.threshold is not None and not pair.skipped:
+                    # Two phase mode compares every pair at full cost, it has no early exits
+                    if pair.match is None:
+                        pair.match = bool(pair.similarity <= config.threshold)
+                        pair.early_exit = False
+                    num_of_matches += pair.match
+                if pair.similarities is not None and not pair.skipped:
+                    for method, value in pair.similarities.items():
+                        num_of_scored_pairs[method] += value != -1.0
+                if stage_times is not None and not pair.skipped and pair.timings is not None:
+                    for stage, (wall, cpu) in pair.timings.items():
+                        stage_times[f"{stage}_wall"].add(wall)
+                        stage_times[f"{stage}_cpu"].add(cpu)
+                if write_error is None:
+                    try:
+                        output_handler.write_pair(pair)
+                    except OSError as e:
+                        # In case of an error write the remaining results to log file
+                        write_error = e
+                        logging.error(f"Error occured while writing to output file {e}")
+                        logging.error("To keep the results, pairs will be dumped here")
+                if write_error is not None:
+                    logging.error(str(pair))
+
+            if config.two_phase and hashing.hash_store is not None:
+                cache_stats["hash"] = hashing.hash_store.stats()
+        finally:
+            output_handler.close()
+            if config.two_phase:
+                hashing.close_hash_store()
+
+        if write_error is not None:
             return ExitCodes.FILE_ERROR
+        # Run is complete, nothing left to resume
+        output_handler.remove_checkpoint()
+        logging.info(f"Successfully saved {num_of_processed_pairs} pair(s).")
 
         # Generate a execution summary
         time_end = time.process_time()
-        num_of_skipped_pairs = len([pair for pair in pairs if pair.skipped])
+        image_stats = cache_stats.get("image", {})
 
         logging.info(f"Summary: "
                      f"\n\tInput: {config.input_file}"
                      f"\n\tOutput: {config.output_file}"
-                     f"\n\tProcessed: {num_of_pairs}"
+                     f"\n\tResumed after line: {input_handler.start_line - 1}"
+                     f"\n\tProcessed: {num_of_processed_pairs}"
                      f"\n\tSkipped: {num_of_skipped_pairs}"
                      f"\n\tUsed Distance:{config.distance}"
+                     f"\n\tWorkers:{workers}"
+                     f"\n\tMax side:{config.max_side or 'full resolution'}"
+                     f"\n\tImage cache: hits:{image_stats.get('hits', 0)} misses:{image_stats.get('misses', 0)} "
+                     f"evictions:{image_stats.get('evictions', 0)}"
+                     f"{__format_hash_stats(cache_stats.get('hash'))}"
+                     f"{__format_pack_stats(cache_stats.get('pack'))}"
+                     f"{__format_threshold_stats(config.threshold, num_of_matches, cache_stats.get('threshold'))}"
+                     f"{__format_cascade_stats(config.cascade_threshold, methods, num_of_scored_pairs)}"
+                     f"{__format_schedule_stats(schedule_stats, cache_stats, workers)}"
+                     f"{__format_stage_stats(stage_times)}"
                      f"\n\tTotal time:{time_end - time_start} seconds")
 
     except Exception as e:
@@ -106,9 +302,174 @@ def __real_main(config):
     return 0
 
 
-def main(config):
-    """Main function"""
+def __real_dedupe(config):
+    from image_compare import hashing
+    from image_compare.dedupe import list_images, find_duplicates
+
+    time_start = time.process_time()
+    try:
+        headers = ["image1", "image2", "similarity"]
+
+        # Init output file handler
+        try:
+            output_handler = FileHandlerFactory().getOutputHandler(filename=config.output_file, headers=headers)
+        except FileError as fe:
+            logging.error(f"Error occurred while creating file handlers: {fe}")
+            return ExitCodes.FILE_ERROR
+
+        if config.distance not in get_distance_names("hash"):
+            logging.error(f"Dedupe is only supported by hash based methods {get_distance_names('hash')}, "
+                          f"not {config.distance}")
+            return ExitCodes.ARGUMENT_ERROR
+
+        # List images
+        try:
+            logging.info(f"Listing images of {config.input_file}")
+            paths = list(list_images(config.input_file))
+            logging.info(f"Successfully listed. {len(paths)} image(s)")
+        except FileError as fe:
+            logging.error(f"Error occured while listing images. {fe}")
+            return ExitCodes.FILE_ERROR
+
+        # Open output file before searching, so the pairs can be written as soon as they are found
+        try:
+            logging.info(f"Writing pairs to {config.output_file} with overwrite={config.overwrite_output}")
+            output_handler.open(config.overwrite_output)
+        except FileError as fe:
+            logging.error(f"Error occured while opening output file {fe}")
+            return ExitCodes.FILE_ERROR
+
+        # Search pairs within the threshold
+        hash_stats = None
+        num_of_pairs = 0
+        if config.hash_cache is not None:
+            hashing.open_hash_store(config.hash_cache)
+        try:
+            with output_handler:
+                for pair in find_duplicates(paths, config.distance, config.threshold, hash_size=config.hash_size,
+                                            workers=max(1, min(config.workers, len(paths)))):
+                    output_handler.write_pair(pair)
+                    num_of_pairs += 1
+            if hashing.hash_store is not None:
+                hash_stats = hashing.hash_store.stats()
+        finally:
+            hashing.close_hash_store()
+        logging.info(f"Successfully saved {num_of_pairs} pair(s).")
 
+        time_end = time.process_time()
+        logging.info(f"Summary: "
+                     f"\n\tInput: {config.input_file}"
+                     f"\n\tOutput: {config.output_file}"
+                     f"\n\tImages: {len(paths)}"
+                     f"\n\tMatching pairs: {num_of_pairs}"
+                     f"\n\tUsed Distance:{config.distance}"
+                     f"\n\tThreshold:{config.threshold}"
+                     f"{__format_hash_stats(hash_stats)}"
+                     f"\n\tTotal time:{time_end - time_start} seconds")
+
+    except Exception as e:
+        # Catch all statement in case we missed something
+        logging.exception(f"Unhandled exception occurred, exiting...\n {e}")
+        return ExitCodes.UNKNOWN_ERROR
+
+    return 0
+
+
+def __real_pack(config):
+    from image_compare.dedupe import list_images
+    from image_compare.pixel_pack import build_pixel_pack, get_index_filename
+
+    time_start = time.process_time()
+    try:
+        if os.path.isdir(config.output_file):
+            logging.error(f"Can not use a folder as pixel pack: {config.output_file}")
+            return ExitCodes.FILE_ERROR
+        if os.path.exists(config.output_file) and not config.overwrite_output:
+            logging.error(f"Pixel pack {config.output_file} already exists. Use --overwrite-output to replace it.")
+            return ExitCodes.FILE_ERROR
+
+        # List images, of the pairs of an input file or of a folder or list file
+        try:
+            logging.info(f"Listing images of {config.input_file}")
+            factory = FileHandlerFactory()
+            if os.path.isfile(config.input_file) and os.path.splitext(config.input_file)[1] in factory.input_handlers:
+                input_handler = factory.getInputHandler(filename=config.input_file)
+                paths = [path for pair in input_handler if pair.skipped is False for path in (pair.image1, pair.image2)]
+            else:
+                paths = list(list_images(config.input_file))
+            logging.info(f"Successfully listed. {len(paths)} image(s)")
+        except FileError as fe:
+            logging.error(f"Error occured while listing images. {fe}")
+            return ExitCodes.FILE_ERROR
+
+        num_of_images = build_pixel_pack(paths, config.output_file,
+                                         workers=max(1, min(config.workers, len(paths))))
+
+        time_end = time.process_time()
+        logging.info(f"Summary: "
+                     f"\n\tInput: {config.input_file}"
+                     f"\n\tPixel pack: {config.output_file}"
+                     f"\n\tIndex: {get_index_filename(config.output_file)}"
+                     f"\n\tPacked images: {num_of_images}"
+                     f"\n\tPack size: {os.path.getsize(config.output_file)} bytes"
+                     f"\n\tTotal time:{time_end - time_start} seconds")
+
+    except Exception as e:
+        # Catch all statement in case we missed something
+        logging.exception(f"Unhandled exception occurred, exiting...\n {e}")
+        return ExitCodes.UNKNOWN_ERROR
+
+    return 0
+
+
+def __stop_serving(signum, frame):
+    """Stops the service on SIGTERM like on Ctrl+C"""
+    raise KeyboardInterrupt
+
+
+def __real_serve(config):
+    from image_compare.parallel import ScoringPool
+    from image_compare.pixel_pack import get_index_filename
+    from image_compare.server import create_server
+
+    try:
+        if config.pixel_pack is not None and not (os.path.isfile(config.pixel_pack) and
+                                                  os.path.isfile(get_index_filename(config.pixel_pack))):
+            logging.error(f"Pixel pack {config.pixel_pack} or its index {get_index_filename(config.pixel_pack)} "
+                          f"does not exist, create it with image_compare_pack")
+            return ExitCodes.FILE_ERROR
+
+        try:
+            with ScoringPool(workers=config.workers, cache_size=config.cache_size, hash_cache=config.hash_cache,
+                             max_side=config.max_side, pack_file=config.pixel_pack,
+                             threshold=config.threshold) as pool:
+                server = create_server(pool, host=config.host, port=config.port, socket_path=config.socket_path)
+                with server:
+                    address = config.socket_path or f"http://{server.server_address[0]}:{server.server_address[1]}"
+                    logging.info(f"Serving on {address} with {config.workers} worker(s), press Ctrl+C to stop")
+                    signal.signal(signal.SIGTERM, __stop_serving)
+                    try:
+                        server.serve_forever()
+                    except KeyboardInterrupt:
+                        logging.info("Stopping")
+                    finally:
+                        if config.socket_path is not None:
+                            os.remove(config.socket_path)
+                logging.info(f"Summary: "
+                             f"\n\tCache stats: {pool.stats()}")
+        except OSError as oe:
+            logging.error(f"Error occurred while starting the server: {oe}")
+            return ExitCodes.FILE_ERROR
+
+    except Exception as e:
+        # Catch all statement in case we missed something
+        logging.exception(f"Unhandled exception occurred, exiting...\n {e}")
+        return ExitCodes.UNKNOWN_ERROR
+
+    return 0
+
+
+def __setup_logging(config):
     logging.basicConfig(filename=config.log_filename, filemode='a', level=log_levels[config.log_level],
                         format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
 
@@ -117,7 +478,42 @@ def main(config):
         console.setLevel(config.log_level)
         logging.getLogger('').addHandler(console)
 
+
+def main(config):
+    """Main function"""
+    __setup_logging(config)
+
     logging.info(f"Starting with {config}")
     exit_value = __real_main(config)
     logging.info(f"Ending with exit value: {exit_value}")
     return exit_value
+
+
+def dedupe(config):
+    """Near-duplicate search function, config is a `models.DedupeConfig`"""
+    __setup_logging(config)
+
+    logging.info(f"Starting dedupe with {config}")
+    exit_value = __real_dedupe(config)
+    logging.info(f"Ending with exit value: {exit_value}")
+    return exit_value
+
+
+def pack(config):
+    """Pixel pack creation function, config is a `models.PackConfig`"""
+    __setup_logging(config)
+
+    logging.info(f"Starting pack with {config}")
+    exit_value = __real_pack(config)
+    logging.info(f"Ending with exit value: {exit_value}")
+    return exit_value
+
+
+def serve(config):
+    """Comparison service function, config is a `models.ServeConfig`"""
+    __setup_logging(config)
+
+    logging.info(f"Starting serve with {config}")
+    exit_value = __real_serve(config)
+    logging.info(f"Ending with exit value: {exit_value}")
+    return exit_value
@@ -1,23 +1,262 @@
 # -*- coding: utf-8 -*-
+from image_compare.cache import DEFAULT_CACHE_SIZE
+
+
+# Stages of a similarity calculation, in the processing order
+STAGES = ("decode", "preprocess", "compute")
+
+# Output fields of the stage timings, wall and CPU time of every stage
+STAGE_FIELDS = [f"{stage}_{clock}" for stage in STAGES for clock in ("wall", "cpu")]
+
+
+def get_similarity_field(method):
+    """Returns the output field of the similarity of a method of a cascade e.g. dhash_similarity"""
+    return f"{method}_similarity"
 
 
 class FilePair:
-    def __init__(self, image1, image2, similarity=-1.0, elapsed=-1.0, line_num=-1, skipped=False):
+    # Fixed attributes without a per object __dict__, a pair takes a fraction of the memory
+    __slots__ = ("image1", "image2", "similarity", "elapsed", "line_num", "skipped", "match", "early_exit",
+                 "timings", "similarities")
+
+    def __init__(self, image1, image2, similarity=-1.0, elapsed=-1.0, line_num=-1, skipped=False, timings=None,
+                 match=None, similarities=None, early_exit=None):
         self.image1 = image1
         self.image2 = image2
         self.similarity = similarity
         self.elapsed = elapsed
         self.line_num = line_num
         self.skipped = skipped
+        # Whether the similarity is within the threshold of the threshold mode, None if there is no threshold
+        self.match = match
+        # Whether the similarity is the low resolution one the threshold mode decided the pair with, None if there is
+        # no threshold
+        self.early_exit = early_exit
+        # Dictionary of stage -> (wall, cpu) seconds, set by the similarity methods
+        self.timings = timings
+        # Dictionary of method -> similarity of every method of a cascade, -1.0 for the ones which did not run
+        self.similarities = similarities
+
+    def to_dict(self, fields=None):
+        """Returns the output fields of the pair
+
+        By default the fields of the pair are returned, `match` and `early_exit` only if they are set and the
+        similarities of a cascade as `get_similarity_field` fields only if there are any. Stage timings are only
+        returned when they are given in fields, as `STAGE_FIELDS`, -1.0 if they are not measured.
+
+        :param fields: list of field names to return, None returns the default fields
+        :return: dictionary of field name -> value
+        :raises:
+            KeyError: if a given field does not exist
+        """
+        if fields is None:
+            fields = [key for key in self.__slots__ if key not in ("match", "early_exit", "timings", "similarities")]
+            fields += [key for key in ("match", "early_exit") if getattr(self, key) is not None]
+            if self.similarities is not None:
+                fields += [get_similarity_field(method) for method in self.similarities]
+        return {field: self.__get_field(field) for field in fields}
+
+    def __get_field(self, field):
+        if field in STAGE_FIELDS:
+            stage, clock = field.rsplit("_", 1)
+            wall, cpu = self.timings.get(stage, (-1.0, -1.0)) if self.timings is not None else (-1.0, -1.0)
+            return wall if clock == "wall" else cpu
+        if field.endswith("_similarity"):
+            method = field[:-len("_similarity")]
+            return self.similarities.get(method, -1.0) if self.similarities is not None else -1.0
+        if field in ("timings", "similarities") or field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
 
     def __repr__(self):
         return f"[{self.line_num}]:{self.image1}<->{self.image2}, " \
                f"similarity:{self.similarity}, elapsed:{self.elapsed}, skipped:{self.skipped}"
 
 
+class PairTable:
+    """Columnar storage of pairs for large runs, e.g. the pairs held in memory to be scheduled with `--schedule`.
+
+    Image paths are interned, every unique path is stored once and the pairs keep their ids. The other fields are
+    kept in NumPy arrays, so a pair takes a few dozen bytes instead of a `FilePair` object and its strings.
+    The results of a calculated pair, `match`, `early_exit`, the similarities of a cascade and the stage timings,
+    are kept in `results` columns created by the first pair which has them. Pairs are appended as `FilePair` objects
+    and returned as new `FilePair` objects.
+
+    :param capacity: initial number of pairs, the arrays grow as needed
+    """
+
+    # Columns besides the image paths, with their NumPy types
+    COLUMNS = {"similarity": "float64", "elapsed": "float64", "line_num": "int64", "skipped": "bool"}
+
+    # Result columns of the threshold mode, -1 if the pair has no value like None of `FilePair`. The other result
+    # columns are float64, -1.0 if the pair has no value
+    FLAG_FIELDS = ("match", "early_exit")
+
+    def __init__(self, capacity=1024):
+        import numpy as np
+
+        self.paths = []
+        self.path_ids = {}
+        self.size = 0
+        self.image1 = np.empty(capacity, dtype=np.int32)
+        self.image2 = np.empty(capacity, dtype=np.int32)
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+        # Result field -> column, see `FLAG_FIELDS`
+        self.results = {}
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Returns a new table of the given `FilePair` objects"""
+        table = cls()
+        table.extend(pairs)
+        return table
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for position in range(self.size):
+            yield self[position]
+
+    def __getitem__(self, position):
+        position = self.__check_position(position)
+        pair = FilePair(self.paths[self.image1[position]], self.paths[self.image2[position]],
+                        similarity=float(self.similarity[position]), elapsed=float(self.elapsed[position]),
+                        line_num=int(self.line_num[position]), skipped=bool(self.skipped[position]))
+        if self.results:
+            self.__load_results(position, pair)
+        return pair
+
+    def __setitem__(self, position, pair):
+        self.__store(self.__check_position(position), pair)
+
+    def __check_position(self, position):
+        if not -self.size <= position < self.size:
+            raise IndexError("pair table index out of range")
+        return position % self.size
+
+    def __store(self, position, pair):
+        self.image1[position] = self.intern(pair.image1)
+        self.image2[position] = self.intern(pair.image2)
+        self.similarity[position] = pair.similarity
+        self.elapsed[position] = pair.elapsed
+        self.line_num[position] = pair.line_num
+        self.skipped[position] = pair.skipped
+        self.__store_results(position, pair)
+
+    def __store_results(self, position, pair):
+        values = {field: int(getattr(pair, field)) for field in self.FLAG_FIELDS if getattr(pair, field) is not None}
+        if pair.similarities is not None:
+            values.update((get_similarity_field(method), value) for method, value in pair.similarities.items())
+        if pair.timings is not None:
+            values.update((f"{stage}_{clock}", value) for stage, times in pair.timings.items()
+                          for clock, value in zip(("wall", "cpu"), times))
+        for field in values:
+            if field not in self.results:
+                self.__add_result_column(field)
+        for field, column in self.results.items():
+            column[position] = values.get(field, -1)
+
+    def __add_result_column(self, field):
+        import numpy as np
+
+        dtype = "int8" if field in self.FLAG_FIELDS else "float64"
+        self.results[field] = np.full(len(self.image1), -1, dtype=dtype)
+
+    def __load_results(self, position, pair):
+        for field in self.FLAG_FIELDS:
+            if field in self.results and self.results[field][position] >= 0:
+                setattr(pair, field, bool(self.results[field][position]))
+        similarities = {field[:-len("_similarity")]: float(column[position])
+                        for field, column in self.results.items() if field.endswith("_similarity")}
+        if similarities:
+            pair.similarities = similarities
+        if all(field in self.results for field in STAGE_FIELDS) and self.results[STAGE_FIELDS[0]][position] >= 0:
+            pair.timings = {stage: (float(self.results[f"{stage}_wall"][position]),
+                                    float(self.results[f"{stage}_cpu"][position])) for stage in STAGES}
+
+    def find(self, line_num):
+        """Returns the position of the pair with the line number, the pairs should be in ascending line number order
+        like the ones read from an input file
+
+        :raises:
+            KeyError: if there is no pair with the line number
+        """
+        import numpy as np
+
+        position = int(np.searchsorted(self.line_num[:self.size], line_num))
+        if position == self.size or self.line_num[position] != line_num:
+            raise KeyError(line_num)
+        return position
+
+    def intern(self, path):
+        """Returns the id of the path, adding it to the table if needed"""
+        path_id = self.path_ids.get(path)
+        if path_id is None:
+            path_id = self.path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        return path_id
+
+    def append(self, pair):
+        """Adds a `FilePair` to the end of the table"""
+        if self.size == len(self.image1):
+            self.__grow(max(1, 2 * self.size))
+        self.__store(self.size, pair)
+        self.size += 1
+
+    def extend(self, pairs):
+        for pair in pairs:
+            self.append(pair)
+
+    def __grow(self, capacity):
+        import numpy as np
+
+        for name in ["image1", "image2"] + list(self.COLUMNS):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+        for field, column in self.results.items():
+            grown = np.full(capacity, -1, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.results[field] = grown
+
+    def column(self, name, start=0, stop=None):
+        """Returns the values of an output field as a list, image paths are resolved
+
+        :param name: field name e.g. similarity, stage timing fields are -1.0 if they are not stored
+        :param start: position of the first pair
+        :param stop: position after the last pair, the end of the table by default
+        :return: list of values
+        :raises:
+            KeyError: if the field does not exist
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        if name in ("image1", "image2"):
+            return [self.paths[path_id] for path_id in getattr(self, name)[start:stop].tolist()]
+        if name in self.COLUMNS:
+            return getattr(self, name)[start:stop].tolist()
+        if name in self.FLAG_FIELDS and name in self.results:
+            return [None if value < 0 else bool(value) for value in self.results[name][start:stop].tolist()]
+        if name in self.results:
+            return self.results[name][start:stop].tolist()
+        if name in STAGE_FIELDS:
+            return [-1.0] * max(0, stop - start)
+        raise KeyError(name)
+
+    def nbytes(self):
+        """Returns the approximate memory usage of the pairs, without the unique path strings"""
+        return sum(getattr(self, name)[:self.size].nbytes for name in ["image1", "image2"] + list(self.COLUMNS)) + \
+            sum(column[:self.size].nbytes for column in self.results.values())
+
+
 class Config:
     def __init__(self, input_file, output_file, overwrite_output=False, quiet=False, distance="dhash",
-                 log_level="INFO", log_filename="image_compare.log"):
+                 log_level="INFO", log_filename="image_compare.log", workers=1,
+                 cache_size=DEFAULT_CACHE_SIZE, hash_cache=None, two_phase=False,
+                 resume=False, max_side=None, stage_timings=False, prefetch=0, pixel_pack=None, threshold=None,
+                 cascade_threshold=None, schedule=False, pair_with=None, reference=None):
         self.input_file = input_file
         self.output_file = output_file
         self.overwrite_output = overwrite_output
@@ -25,8 +264,80 @@ class Config:
         self.quiet = quiet
         self.log_level = log_level
         self.log_filename = log_filename
+        self.workers = workers
+        self.cache_size = cache_size
+        self.hash_cache = hash_cache
+        self.two_phase = two_phase
+        self.resume = resume
+        self.max_side = max_side
+        self.stage_timings = stage_timings
+        self.prefetch = prefetch
+        self.pixel_pack = pixel_pack
+        self.threshold = threshold
+        self.cascade_threshold = cascade_threshold
+        self.schedule = schedule
+        self.pair_with = pair_with
+        self.reference = reference
 
     def __repr__(self):
         return f"Config [input:{self.input_file}, output:{self.output_file}, " \
                f"overwrite_output: {self.overwrite_output}, quiet:{self.quiet}, " \
-               f"distance:{self.distance}, log_level:{self.log_level}, log_filename:{self.log_filename}]"
+               f"distance:{self.distance}, log_level:{self.log_level}, log_filename:{self.log_filename}, " \
+               f"workers:{self.workers}, cache_size:{self.cache_size}, " \
+               f"hash_cache:{self.hash_cache}, two_phase:{self.two_phase}, " \
+               f"resume:{self.resume}, max_side:{self.max_side}, stage_timings:{self.stage_timings}, " \
+               f"prefetch:{self.prefetch}, pixel_pack:{self.pixel_pack}, threshold:{self.threshold}, " \
+               f"cascade_threshold:{self.cascade_threshold}, schedule:{self.schedule}, " \
+               f"pair_with:{self.pair_with}, reference:{self.reference}]"
+
+
+class DedupeConfig(Config):
+    def __init__(self, input_file, output_file, overwrite_output=False, quiet=False, distance="phash",
+                 log_level="INFO", log_filename="image_compare.log", workers=1, hash_cache=None, threshold=0.1,
+                 hash_size=16):
+        super().__init__(input_file, output_file, overwrite_output=overwrite_output, quiet=quiet, distance=distance,
+                         log_level=log_level, log_filename=log_filename, workers=workers, hash_cache=hash_cache)
+        self.threshold = threshold
+        self.hash_size = hash_size
+
+    def __repr__(self):
+        return f"DedupeConfig [input:{self.input_file}, output:{self.output_file}, " \
+               f"overwrite_output: {self.overwrite_output}, quiet:{self.quiet}, " \
+               f"distance:{self.distance}, log_level:{self.log_level}, log_filename:{self.log_filename}, " \
+               f"workers:{self.workers}, hash_cache:{self.hash_cache}, threshold:{self.threshold}, " \
+               f"hash_size:{self.hash_size}]"
+
+
+class PackConfig(Config):
+    def __init__(self, input_file, output_file, overwrite_output=False, quiet=False, log_level="INFO",
+                 log_filename="image_compare.log", workers=1):
+        super().__init__(input_file, output_file, overwrite_output=overwrite_output, quiet=quiet,
+                         log_level=log_level, log_filename=log_filename, workers=workers)
+
+    def __repr__(self):
+        return f"PackConfig [input:{self.input_file}, output:{self.output_file}, " \
+               f"overwrite_output: {self.overwrite_output}, quiet:{self.quiet}, " \
+               f"log_level:{self.log_level}, log_filename:{self.log_filename}, workers:{self.workers}]"
+
+
+# Default address of the comparison service, it only listens on the local machine by default
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class ServeConfig(Config):
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, quiet=False, log_level="INFO",
+                 log_filename="image_compare.log", workers=1, cache_size=DEFAULT_CACHE_SIZE, hash_cache=None,
+                 max_side=None, pixel_pack=None, threshold=None):
+        super().__init__(None, None, quiet=quiet, log_level=log_level, log_filename=log_filename, workers=workers,
+                         cache_size=cache_size, hash_cache=hash_cache, max_side=max_side, pixel_pack=pixel_pack,
+                         threshold=threshold)
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+
+    def __repr__(self):
+        return f"ServeConfig [host:{self.host}, port:{self.port}, socket_path:{self.socket_path}, " \
+               f"quiet:{self.quiet}, log_level:{self.log_level}, log_filename:{self.log_filename}, " \
+               f"workers:{self.workers}, cache_size:{self.cache_size}, hash_cache:{self.hash_cache}, " \
+               f"max_side:{self.max_side}, pixel_pack:{self.pixel_pack}, threshold:{self.threshold}]"
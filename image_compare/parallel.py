@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""This module contains the process pool which spreads similarity calculations over multiple cores"""
+
+import os
+import logging
+import logging.handlers
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from image_compare import similarity
+from image_compare.similarity import get_similarity_measurement, set_max_side, set_threshold, calculate_similarities
+from image_compare.exceptions import ICError
+from image_compare.util import format_progress, get_default_worker_count  # noqa: F401
+from image_compare.cache import image_cache, sum_stats
+from image_compare import hashing
+from image_compare import pixel_pack
+from image_compare.prefetch import prefetch_pairs
+
+
+# Number of pending pairs kept per worker, bounds the memory used by the submitted but not yet consumed results
+PAIRS_PER_WORKER = 4
+
+
+def calculate_similarity(pair, distance, num_of_pairs, sources=None, cascade_threshold=None):
+    """Calculates the similarity of a single pair with the given distance and logs the outcome
+
+    Errors raised by the similarity method are logged as warnings, the method marks the pair as skipped.
+
+    :param pair: `FilePair` object
+    :param distance: name of the similarity method, or a list of names calculated from a single decode,
+        see `similarity.calculate_similarities`
+    :param num_of_pairs: total number of pairs, used for progress logging, None if it is not known
+    :param sources: optional dictionary of path -> file content of the pair's images, e.g. read by `prefetch_pairs`
+    :param cascade_threshold: maximum similarity of a pair to continue with the next method of a cascade,
+        None calculates every method of a list
+    :return: the updated pair object
+    """
+    if not isinstance(distance, str):
+        # Skipped pairs have the similarities of every method too
+        pair.similarities = {method: -1.0 for method in distance}
+    if pair.skipped is False:
+        image_cache.set_sources(sources)
+        try:
+            if isinstance(distance, str):
+                get_similarity_measurement(distance)(pair)
+            else:
+                calculate_similarities(pair, distance, cascade_threshold)
+            logging.info(f"Processed: {format_progress(pair.line_num, num_of_pairs)} - "
+                         f"similarity:{pair.similarity:.4f}\telapsed:{pair.elapsed:.5f}")
+        except ICError as e:
+            logging.warning(f"Skipping line number:{pair.line_num}, "
+                            f"error occured while calculating similarity> {e}")
+        finally:
+            image_cache.set_sources(None)
+    else:
+        logging.warning(f"Skipping line number:{pair.line_num}")
+
+    return pair
+
+
+def get_process_stats():
+    """Returns the cache counters of this process
+
+    :return: dictionary of counter dictionaries, "image" for the decoded image cache,
+        "hash" for the hash store, "pack" for the pixel pack if there is one and "threshold" for the early exits
+        of the threshold mode if it is enabled
+    """
+    stats = {"image": image_cache.stats()}
+    if similarity.threshold is not None:
+        stats["threshold"] = dict(similarity.threshold_stats)
+    if hashing.hash_store is not None:
+        stats["hash"] = hashing.hash_store.stats()
+    if pixel_pack.pixel_pack is not None:
+        stats["pack"] = pixel_pack.pixel_pack.stats()
+    return stats
+
+
+def _init_process(cache_size, hash_cache, max_side, pack_file, threshold):
+    set_max_side(max_side)
+    set_threshold(threshold)
+    if pack_file is not None:
+        pixel_pack.open_pixel_pack(pack_file)
+    if cache_size is not None:
+        image_cache.resize(cache_size)
+    image_cache.reset_stats()
+    if hash_cache is not None:
+        hashing.open_hash_store(hash_cache)
+
+
+def _init_worker(log_queue, log_level, cache_size, hash_cache, max_side, pack_file, threshold):
+    """Routes the worker's log records to the parent process, which writes them with its own handlers"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(log_level)
+    _init_process(cache_size, hash_cache, max_side, pack_file, threshold)
+
+
+def _calculate_similarity_in_worker(pair, distance, num_of_pairs, sources, cascade_threshold):
+    """Worker side of `calculate_similarity`, also returns the worker's cache counters"""
+    pair = calculate_similarity(pair, distance, num_of_pairs, sources, cascade_threshold)
+    return pair, os.getpid(), get_process_stats()
+
+
+def _sum_process_stats(stats_list):
+    stats_list = list(stats_list)
+    sections = set(section for stats in stats_list for section in stats)
+    return {section: sum_stats(stats[section] for stats in stats_list if section in stats) for section in sections}
+
+
+def score_pairs(pairs, distance, workers=1, num_of_pairs=0, cache_size=None, hash_cache=None, cache_stats=None,
+                max_side=None, prefetch=0, pack_file=None, threshold=None, cascade_threshold=None):
+    """Calculates the similarity of the given pairs, yielding them in the input order
+
+    With a single worker pairs are processed in the current process. Otherwise a process pool is used and the
+    log records of the workers are forwarded to the handlers of the root logger in this process, so every record
+    is written by a single process and the log file does not get interleaved lines.
+
+    :param pairs: iterable of `FilePair` objects
+    :param distance: name of the similarity method, or a list of names calculated from a single decode,
+        see `similarity.calculate_similarities`
+    :param workers: number of processes to use
+    :param num_of_pairs: total number of pairs, used for progress logging, None if it is not known
+    :param cache_size: memory budget of the decoded image cache of each process in bytes, None keeps the current one
+    :param hash_cache: path of the persistent hash store used by the hash based methods, None disables it
+    :param cache_stats: optional dictionary, updated with the summed cache counters of all processes
+        in `get_process_stats` format
+    :param max_side: longest image side used by the pixel based methods, None compares full resolution images
+    :param prefetch: number of pairs whose files are read ahead by background threads while calculating,
+        0 reads the files while calculating. With multiple workers the files are read by this process
+        and sent to the workers with the pairs
+    :param pack_file: path of a pixel pack written by `pixel_pack.build_pixel_pack`, the pixel based methods
+        load the packed images instead of decoding them. None disables it
+    :param threshold: maximum similarity of a matching pair, enables the early exit mode of the similarity methods,
+        see `similarity.set_threshold`. None calculates every pair at full cost
+    :param cascade_threshold: maximum similarity of a pair to continue with the next method of a cascade,
+        None calculates every method of a list
+    :return: generator of updated `FilePair` objects
+    """
+    if cache_stats is None:
+        cache_stats = {}
+    if prefetch > 0:
+        items = prefetch_pairs(pairs, depth=prefetch)
+    else:
+        items = ((pair, None) for pair in pairs)
+
+    if workers <= 1:
+        _init_process(cache_size, hash_cache, max_side, pack_file, threshold)
+        try:
+            for pair, sources in items:
+                pair = calculate_similarity(pair, distance, num_of_pairs, sources, cascade_threshold)
+                cache_stats.update(get_process_stats())
+                yield pair
+        finally:
+            set_max_side(None)
+            set_threshold(None)
+            if hash_cache is not None:
+                hashing.close_hash_store()
+            if pack_file is not None:
+                pixel_pack.close_pixel_pack()
+        return
+
+    root = logging.getLogger()
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(log_queue, root.level, cache_size, hash_cache, max_side,
+                                           pack_file, threshold)) as executor:
+            stats_by_worker = {}
+
+            def collect(future):
+                pair, pid, stats = future.result()
+                stats_by_worker[pid] = stats
+                cache_stats.update(_sum_process_stats(stats_by_worker.values()))
+                return pair
+
+            pending = deque()
+            for pair, sources in items:
+                pending.append(executor.submit(_calculate_similarity_in_worker, pair, distance, num_of_pairs,
+                                               sources, cascade_threshold))
+                if len(pending) >= workers * PAIRS_PER_WORKER:
+                    yield collect(pending.popleft())
+            while pending:
+                yield collect(pending.popleft())
+    finally:
+        listener.stop()
+
+
+class ScoringPool:
+    """Long-lived similarity calculations whose caches stay warm between the calls of `score`
+
+    With a single worker the pairs are calculated in the current process, one call at a time, so the pool can be used
+    by many threads. Otherwise a process pool is started once, every worker keeps its decoded image cache, hash store
+    and pixel pack open until `close` is called and its log records are forwarded like `score_pairs` does.
+
+    :param workers: number of processes to use
+    :param cache_size: memory budget of the decoded image cache of each process in bytes, None keeps the current one
+    :param hash_cache: path of the persistent hash store used by the hash based methods, None disables it
+    :param max_side: longest image side used by the pixel based methods, None compares full resolution images
+    :param pack_file: path of a pixel pack used by the pixel based methods, None disables it
+    :param threshold: maximum similarity of a matching pair, enables the early exit mode of the similarity methods
+    """
+
+    def __init__(self, workers=1, cache_size=None, hash_cache=None, max_side=None, pack_file=None, threshold=None):
+        self.workers = workers
+        self.hash_cache = hash_cache
+        self.pack_file = pack_file
+        self._lock = threading.Lock()
+        self._stats_by_worker = {}
+        self._executor = None
+        self._listener = None
+        if workers <= 1:
+            _init_process(cache_size, hash_cache, max_side, pack_file, threshold)
+            return
+
+        root = logging.getLogger()
+        log_queue = multiprocessing.Queue()
+        self._listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+        self._listener.start()
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                             initargs=(log_queue, root.level, cache_size, hash_cache, max_side,
+                                                       pack_file, threshold))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def score(self, pairs, distance, cascade_threshold=None):
+        """Calculates the similarity of the pairs, see `calculate_similarity`
+
+        :param pairs: list of `FilePair` objects
+        :param distance: name of the similarity method, or a list of names calculated from a single decode
+        :param cascade_threshold: maximum similarity of a pair to continue with the next method of a cascade,
+            None calculates every method of a list
+        :return: list of the updated `FilePair` objects in the given order
+        """
+        if self._executor is None:
+            with self._lock:
+                pairs = [calculate_similarity(pair, distance, len(pairs), cascade_threshold=cascade_threshold)
+                         for pair in pairs]
+                self._stats_by_worker[os.getpid()] = get_process_stats()
+            return pairs
+
+        results = self._executor.map(_calculate_similarity_in_worker, pairs, itertools.repeat(distance),
+                                     itertools.repeat(len(pairs)), itertools.repeat(None),
+                                     itertools.repeat(cascade_threshold))
+        scored = []
+        for pair, pid, stats in results:
+            scored.append(pair)
+            with self._lock:
+                self._stats_by_worker[pid] = stats
+        return scored
+
+    def stats(self):
+        """Returns the cache counters summed over the workers which calculated a pair, in `get_process_stats` format"""
+        with self._lock:
+            return _sum_process_stats(self._stats_by_worker.values())
+
+    def close(self):
+        """Stops the workers and closes the hash store and pixel pack of the pool"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._listener.stop()
+            return
+        set_max_side(None)
+        set_threshold(None)
+        if self.hash_cache is not None:
+            hashing.close_hash_store()
+        if self.pack_file is not None:
+            pixel_pack.close_pixel_pack()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""This module contains the pixel pack, a memory-mapped file of decoded images shared by the pixel based methods"""
+
+import os
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Number of pending decodes kept per worker, bounds the memory used by the decoded but not yet written images
+IMAGES_PER_WORKER = 4
+
+# Pack used by the pixel based similarity methods of this process
+pixel_pack = None
+
+
+def get_index_filename(filename):
+    """Returns the path of the index file of the pack"""
+    return f"{filename}.json"
+
+
+def decode_image(path):
+    """Decodes the image like the pixel based methods do, with `skimage.io.imread`
+
+    :param path: image path
+    :return: ndarray or None if the file does not exist
+    """
+    from skimage import io
+    try:
+        return io.imread(path)
+    except FileNotFoundError:
+        return None
+
+
+def build_pixel_pack(paths, filename, workers=1):
+    """Decodes every given image once and writes the pixels into a pack
+
+    The pixels of the images are written back to back into the pack file, the index file keeps the offset, shape
+    and dtype of every image as well as the modification time and size of the image file, by absolute path.
+    Missing images are logged and left out.
+
+    :param paths: iterable of image paths, duplicates are decoded once
+    :param filename: path of the pack file, its index is written to `get_index_filename(filename)`
+    :param workers: number of processes used to decode the images
+    :return: number of images in the pack
+    """
+    paths = list(dict.fromkeys(paths))
+    index = {}
+    offset = 0
+    with open(filename, 'wb') as pack_file:
+        for path, image in __decode_images(paths, workers):
+            if image is None:
+                logging.warning(f"Skipping image, File Not Found: {path}")
+                continue
+            stat = os.stat(path)
+            image = np.ascontiguousarray(image)
+            pack_file.write(image.tobytes())
+            index[os.path.abspath(path)] = {"offset": offset, "shape": list(image.shape),
+                                            "dtype": image.dtype.str, "mtime_ns": stat.st_mtime_ns,
+                                            "file_size": stat.st_size}
+            offset += image.nbytes
+            logging.info(f"Packed: {path} {image.shape}")
+
+    with open(get_index_filename(filename), 'w') as index_file:
+        json.dump(index, index_file)
+    return len(index)
+
+
+def __decode_images(paths, workers):
+    """Yields (path, decoded image) of the given paths in order
+
+    With multiple workers at most workers * IMAGES_PER_WORKER decodes are submitted ahead of the consumed ones,
+    so the decoded images waiting to be written do not pile up in memory.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield path, decode_image(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(decode_image, path)))
+            if len(pending) >= workers * IMAGES_PER_WORKER:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def open_pixel_pack(filename):
+    """Opens the pixel pack used by the pixel based similarity methods of this process
+
+    :param filename: path of the pack file
+    :return: the opened `PixelPack`
+    """
+    global pixel_pack
+    close_pixel_pack()
+    pixel_pack = PixelPack(filename)
+    return pixel_pack
+
+
+def close_pixel_pack():
+    """Closes the pixel pack of this process, if there is one"""
+    global pixel_pack
+    if pixel_pack is not None:
+        pixel_pack.close()
+        pixel_pack = None
+
+
+class PixelPack:
+    """Read-only, memory-mapped pack of decoded images written by `build_pixel_pack`.
+
+    Images are returned as read-only ndarray views of the mapped file, so loading an image does not decode or copy
+    it and the processes using the same pack share the pages of the file. An image is only served while the
+    modification time and size of its file match the ones in the index.
+
+    :param filename: path of the pack file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        with open(get_index_filename(filename), 'r') as index_file:
+            self.index = json.load(index_file)
+        # An empty file can not be mapped
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r') if os.path.getsize(filename) else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def load(self, path):
+        """Returns the decoded image from the pack
+
+        :param path: image path
+        :return: read-only ndarray or None if the image is not in the pack or its file changed
+        :raises:
+            FileNotFoundError: if the path does not exist
+        """
+        stat = os.stat(path)
+        entry = self.index.get(os.path.abspath(path))
+        if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry["file_size"] != stat.st_size:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"]))
+        return np.frombuffer(self.data, dtype=dtype, count=count, offset=entry["offset"]).reshape(entry["shape"])
+
+    def close(self):
+        # The file is unmapped once the returned views are released too
+        self.data = None
+        self.index = {}
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""This module contains the prefetcher which reads the image files of the upcoming pairs in background threads"""
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Default number of pairs read ahead of the pair being calculated
+DEFAULT_PREFETCH_DEPTH = 8
+
+# Default memory budget of the read but not yet calculated files, in bytes
+DEFAULT_PREFETCH_BYTES = 128 * 1024 * 1024
+
+# Default number of threads reading the files
+DEFAULT_PREFETCH_THREADS = 4
+
+
+def read_file(path):
+    """Returns the content of the file, None if it does not exist"""
+    try:
+        with open(path, 'rb') as image_file:
+            return image_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def prefetch_pairs(pairs, depth=DEFAULT_PREFETCH_DEPTH, max_bytes=DEFAULT_PREFETCH_BYTES,
+                   threads=DEFAULT_PREFETCH_THREADS):
+    """Reads the image files of the next pairs while the current one is being calculated
+
+    Files of up to `depth` pairs are read ahead by a thread pool. Reading ahead stops early when the files which are
+    read but not yet returned exceed `max_bytes`, a single pair is always read. A file used by more than one pair in
+    the window is read once, skipped pairs are not read.
+
+    :param pairs: iterable of `FilePair` objects
+    :param depth: number of pairs to read ahead
+    :param max_bytes: memory budget of the files read ahead
+    :param threads: number of threads reading the files
+    :return: generator of (pair, sources) tuples in the input order, sources is a dictionary of
+        path -> file content, None if the file does not exist
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        window = deque()
+        reads = {}
+        uses = Counter()
+
+        def buffered_bytes():
+            return sum(len(future.result() or b"") for future in reads.values() if future.done())
+
+        def pop():
+            pair, paths = window.popleft()
+            sources = {path: reads[path].result() for path in paths}
+            for path in paths:
+                uses[path] -= 1
+                if uses[path] == 0:
+                    del uses[path]
+                    del reads[path]
+            return pair, sources
+
+        for pair in pairs:
+            while window and (len(window) >= depth or buffered_bytes() > max_bytes):
+                yield pop()
+            paths = [] if pair.skipped else list(dict.fromkeys((pair.image1, pair.image2)))
+            for path in paths:
+                if path not in reads:
+                    reads[path] = executor.submit(read_file, path)
+                uses[path] += 1
+            window.append((pair, paths))
+
+        while window:
+            yield pop()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""This module contains the scheduler which orders the pairs so the pairs sharing an image are calculated together"""
+
+from collections import OrderedDict, defaultdict
+
+from PIL import Image
+
+
+def read_image_nbytes(path):
+    """Returns the memory usage of the decoded image from the header of the file, without decoding it
+
+    :param path: image path
+    :return: size in bytes, like `cache.get_image_nbytes`, or None if the file can not be opened
+    """
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            return width * height * len(image.getbands())
+    except (OSError, ValueError):
+        return None
+
+
+def order_positions(pairs):
+    """Returns the positions of the pairs in an order which calculates the pairs sharing an image one after the other
+
+    Images are the nodes and pairs are the edges of a graph which is walked depth first, in the order the images
+    first appear. All pending pairs of an image are calculated together, then the walk continues from the image
+    decoded last, which is the most recently used one of the cache. Skipped pairs are not decoded, they come first.
+
+    :param pairs: sequence of `FilePair` objects, e.g. a list or a `models.PairTable`
+    :return: list of positions
+    """
+    order = []
+    adjacency = defaultdict(list)
+    for position, pair in enumerate(pairs):
+        if pair.skipped:
+            order.append(position)
+        else:
+            adjacency[pair.image1].append(position)
+            if pair.image2 != pair.image1:
+                adjacency[pair.image2].append(position)
+
+    done = bytearray(len(pairs))
+    for start in list(adjacency):
+        stack = [start]
+        while stack:
+            image = stack.pop()
+            for position in adjacency[image]:
+                if done[position]:
+                    continue
+                done[position] = 1
+                order.append(position)
+                pair = pairs[position]
+                stack.append(pair.image2 if pair.image1 == image else pair.image1)
+            # Every pair of the image is in the order now, later visits have nothing to do
+            adjacency[image] = []
+    return order
+
+
+def order_pairs(pairs):
+    """Returns the pairs in the order of `order_positions`
+
+    :param pairs: list of `FilePair` objects
+    :return: list of the same `FilePair` objects
+    """
+    return [pairs[position] for position in order_positions(pairs)]
+
+
+def count_decodes(pairs, image_nbytes, max_bytes):
+    """Returns the number of image decodes of the pairs in the given order, with a least recently used cache of
+    max_bytes like `cache.ImageCache` of a single process
+
+    :param pairs: iterable of `FilePair` objects
+    :param image_nbytes: dictionary of path -> decoded size in bytes, images which are not in it are not decoded
+    :param max_bytes: memory budget of the cache
+    :return: number of decodes
+    """
+    cache = OrderedDict()
+    current_bytes = 0
+    decodes = 0
+    for pair in pairs:
+        if pair.skipped:
+            continue
+        for path in dict.fromkeys((pair.image1, pair.image2)):
+            nbytes = image_nbytes.get(path)
+            if nbytes is None:
+                continue
+            if path in cache:
+                cache.move_to_end(path)
+                continue
+            decodes += 1
+            if nbytes > max_bytes:
+                continue
+            cache[path] = nbytes
+            current_bytes += nbytes
+            while current_bytes > max_bytes:
+                _, evicted_nbytes = cache.popitem(last=False)
+                current_bytes -= evicted_nbytes
+    return decodes
+
+
+def schedule_pairs(pairs, max_bytes):
+    """Orders the pairs for the decoded image cache, see `order_positions`
+
+    The decodes of the input order and of the scheduled order are counted with `count_decodes` for a cache of
+    max_bytes, from the sizes in the headers of the images. The input order is kept if it does not need more
+    decodes than the scheduled one. Pairs are read from the sequence while they are yielded, so a `models.PairTable`
+    only creates the `FilePair` objects which are being calculated.
+
+    :param pairs: sequence of `FilePair` objects, e.g. a list or a `models.PairTable`
+    :param max_bytes: memory budget of the decoded image cache of a process
+    :return: (generator of `FilePair` objects in the order to calculate, dictionary of the "input" and "scheduled"
+        decode counts)
+    """
+    paths = dict.fromkeys(path for pair in pairs if not pair.skipped for path in (pair.image1, pair.image2))
+    image_nbytes = {path: read_image_nbytes(path) for path in paths}
+    positions = order_positions(pairs)
+    stats = {"input": count_decodes(pairs, image_nbytes, max_bytes),
+             "scheduled": count_decodes((pairs[position] for position in positions), image_nbytes, max_bytes)}
+    if stats["input"] <= stats["scheduled"]:
+        stats["scheduled"] = stats["input"]
+        positions = range(len(pairs))
+    return (pairs[position] for position in positions), stats
+
+
+def restore_order(pairs, table):
+    """Yields the calculated pairs of a table in the table order
+
+    Every calculated pair is written back into the table at the position of its line number, a pair is yielded from
+    the table once every pair before it is calculated. The pairs calculated early are kept in the columns of the
+    table, so waiting pairs do not take more memory than the table.
+
+    :param pairs: iterable of `FilePair` objects of the table, e.g. calculated in the order of `schedule_pairs`
+    :param table: `models.PairTable` in ascending line number order, e.g. read from an input file
+    :return: generator of `FilePair` objects
+    """
+    calculated = bytearray(len(table))
+    next_position = 0
+    for pair in pairs:
+        position = table.find(pair.line_num)
+        table[position] = pair
+        calculated[position] = 1
+        while next_position < len(table) and calculated[next_position]:
+            yield table[next_position]
+            next_position += 1
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""This module contains the comparison service, which serves the registered similarity methods over HTTP"""
+
+import json
+import logging
+from http import HTTPStatus
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import image_compare
+from image_compare.models import FilePair, DEFAULT_HOST, DEFAULT_PORT
+from image_compare.exceptions import ArgumentError
+from image_compare.distances import get_distance_names, split_distances
+
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+
+def parse_pair(record, line_num):
+    """Returns the `FilePair` of a request record
+
+    :param record: dictionary with "image1" and "image2" paths
+    :param line_num: position of the pair in the request, starting from 1
+    :return: `FilePair` object
+    :raises:
+        ArgumentError: if the record is not an object of two image paths
+    """
+    if not isinstance(record, dict):
+        raise ArgumentError(f"Pair {line_num} should be an object, not {record!r}")
+    paths = [record.get(field) for field in ("image1", "image2")]
+    if not all(isinstance(path, str) and path for path in paths):
+        raise ArgumentError(f"Pair {line_num} should have image1 and image2 paths")
+    return FilePair(paths[0], paths[1], line_num=line_num)
+
+
+def parse_distance(body):
+    """Returns the distance of a request, a method name or a list of names, and its cascade threshold
+
+    :param body: request dictionary, "distance" defaults to dhash, a comma separated list of methods is allowed
+    :return: (distance, cascade_threshold)
+    :raises:
+        ArgumentError: if a method is not supported or the cascade threshold is not a number
+    """
+    distance = body.get("distance", "dhash")
+    if not isinstance(distance, str):
+        raise ArgumentError(f"distance should be a string, not {distance!r}")
+    methods = split_distances(distance)
+    cascade_threshold = body.get("cascade_threshold")
+    if cascade_threshold is not None and (isinstance(cascade_threshold, bool) or
+                                          not isinstance(cascade_threshold, (int, float))):
+        raise ArgumentError(f"cascade_threshold should be a number, not {cascade_threshold!r}")
+    return (methods if len(methods) > 1 else methods[0]), cascade_threshold
+
+
+class ComparisonRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests of the comparison service, request and response bodies are JSON
+
+        * GET /distances: the registered similarity methods
+        * GET /stats: the cache counters of the workers
+        * POST /compare: {"image1": ..., "image2": ..., "distance": "dhash"} compares a single pair
+        * POST /compare/batch: {"pairs": [{"image1": ..., "image2": ...}, ...], "distance": "dhash"} compares
+          the pairs on the worker pool
+
+    A comma separated distance calculates every method, with "cascade_threshold" as a cascade. Compared pairs are
+    returned as `FilePair.to_dict`, pairs which could not be compared are skipped. Invalid requests get a 400 response
+    with an "error" message.
+    """
+
+    server_version = f"image_compare/{image_compare.__version__}"
+
+    def do_GET(self):
+        if self.path == "/distances":
+            self.send_json(HTTPStatus.OK, {"distances": get_distance_names()})
+        elif self.path == "/stats":
+            self.send_json(HTTPStatus.OK, {"stats": self.server.pool.stats()})
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path not in ("/compare", "/compare/batch"):
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            body = self.read_json()
+            distance, cascade_threshold = parse_distance(body)
+            if self.path == "/compare":
+                pairs = [parse_pair(body, 1)]
+            else:
+                records = body.get("pairs")
+                if not isinstance(records, list):
+                    raise ArgumentError("pairs should be a list of pairs")
+                pairs = [parse_pair(record, line_num) for line_num, record in enumerate(records, start=1)]
+        except ArgumentError as ae:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": ae.message})
+            return
+
+        try:
+            pairs = self.server.pool.score(pairs, distance, cascade_threshold=cascade_threshold)
+        except Exception as e:
+            # Catch all statement, the service keeps serving the other requests
+            logging.exception(f"Unhandled exception occurred while comparing {len(pairs)} pair(s)")
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+        if self.path == "/compare":
+            self.send_json(HTTPStatus.OK, pairs[0].to_dict())
+        else:
+            self.send_json(HTTPStatus.OK, {"pairs": [pair.to_dict() for pair in pairs]})
+
+    def read_json(self):
+        """Returns the JSON object of the request body
+
+        :raises:
+            ArgumentError: if the body is missing, too large or not a JSON object
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_REQUEST_BYTES:
+            raise ArgumentError(f"Request body should have 1 to {MAX_REQUEST_BYTES} bytes, not {length}")
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            raise ArgumentError(f"Request body is not valid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ArgumentError("Request body should be a JSON object")
+        return body
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+
+class ComparisonHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of the comparison service, every request is handled in its own thread
+
+    :param address: (host, port) to listen on, port 0 picks a free port
+    :param pool: `parallel.ScoringPool` calculating the similarities
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, pool):
+        self.pool = pool
+        super().__init__(address, ComparisonRequestHandler)
+
+
+class UnixComparisonHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """HTTP server of the comparison service listening on a Unix socket
+
+    :param path: path of the socket file to create
+    :param pool: `parallel.ScoringPool` calculating the similarities
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        self.pool = pool
+        super().__init__(path, ComparisonRequestHandler)
+
+
+def create_server(pool, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """Returns the server of the comparison service, call `serve_forever` to handle the requests
+
+    :param pool: `parallel.ScoringPool` calculating the similarities
+    :param host: host name or address of the HTTP server
+    :param port: port of the HTTP server, 0 picks a free port
+    :param socket_path: path of a Unix socket to listen on instead of host and port
+    :return: `ComparisonHTTPServer` or `UnixComparisonHTTPServer`
+    """
+    if socket_path is not None:
+        return UnixComparisonHTTPServer(socket_path, pool)
+    return ComparisonHTTPServer((host, port), pool)
@@ -2,17 +2,55 @@
 """This module contains the wrapper classes for scikit-image library methods"""
 
 import time
-import imagehash
+import functools
+import contextlib
 from PIL import Image
-from collections import defaultdict
-from skimage import io, img_as_float
-from skimage.measure import compare_ssim as ssim
-from skimage.measure import compare_nrmse as nrmse
+import numpy as np
 
 from image_compare.exceptions import FileError, ArgumentError
+from image_compare.distances import DISTANCES, DEFAULT_HASH_SIZE, split_distances  # noqa: F401
+from image_compare.models import STAGES
+from image_compare.cache import image_cache
+from image_compare import hashing
+from image_compare import pixel_pack
+from image_compare.tiled_ssim import tiled_ssim
 
 
-MEASUREMENTS = defaultdict(None)
+# Similarity methods by name, the lightweight `distances.Distance` descriptors
+MEASUREMENTS = DISTANCES
+
+# Similarity functions by method name, registered by `register_distance`. It has a function for every method of
+# MEASUREMENTS and no other one, it is checked when the module is imported
+_functions = {}
+
+# Stage timings of the similarity calculations in progress, the innermost one is the last
+_stage_timings = []
+
+# Longest image side used by the pixel based methods (ssim, nrmse) of this process, see `set_max_side`
+max_side = None
+
+# Threshold of the early exit mode of the similarity methods of this process, see `set_threshold`
+threshold = None
+
+# Longest image side and hash size of the low resolution stage of the threshold mode
+COARSE_MAX_SIDE = 128
+COARSE_HASH_SIZE = 8
+
+# Largest difference between the low resolution and the final similarity the threshold mode allows for, a pair is
+# decided at low resolution if its low resolution similarity is farther than this from the threshold.
+# About 1.5 times the largest difference measured on the same size pairs of files/images with
+# benchmarks/threshold_accuracy.py, which is a small corpus: ssim 0.226, nrmse 0.022, dhash 0.113, avghash 0.101,
+# phash 0.172, whash 0.18
+THRESHOLD_MARGINS = {"ssim": 0.35, "nrmse": 0.035, "dhash": 0.2, "avghash": 0.2, "phash": 0.3, "whash": 0.3}
+
+# Number of pairs decided at low resolution (early exits) and calculated at the final resolution in threshold mode
+threshold_stats = {"early_exits": 0, "full": 0}
+
+# Images decoded by `open_with_pil` for the methods of the calculation in progress, by path, see `shared_decode`
+_shared_images = None
+
+# PIL modes whose pixels are the same as the ones decoded by `skimage.io.imread`
+SHARED_DECODE_MODES = ("L", "RGB", "RGBA")
 
 
 def get_supported_similarity_methods():
@@ -20,7 +58,7 @@ def get_supported_similarity_methods():
 
     :return: supported_methods: list
     """
-    return MEASUREMENTS.keys() if MEASUREMENTS is not None else []
+    return MEASUREMENTS.keys()
 
 
 def get_similarity_measurement(name):
@@ -30,22 +68,119 @@ def get_similarity_measurement(name):
     :raises:
         ArgumentError: if name is a not a valid implemented method
     """
-    method = MEASUREMENTS.get(name)
-    if method is None:
+    if name not in MEASUREMENTS:
         raise ArgumentError(f"{name} is a not a supported similarity method")
 
-    return method
+    return _functions[name]
+
+
+def calculate_similarities(pair, methods, cascade_threshold=None):
+    """Calculates the similarity of the pair with every given method, every image is decoded once
+
+    The methods share a single decode of every image, see `shared_decode`. With a cascade threshold the methods form
+    a cascade in the given order, so the cheap ones should come first: a method runs only if the similarity of the
+    previous one is within cascade_threshold, so the expensive methods only score the pairs which pass the cheap ones.
+    The similarity of every method is kept in `pair.similarities`, -1.0 for the methods which did not run.
+    `pair.similarity` is the similarity of the last method, so it is on the same scale for every pair, -1.0 for the
+    pairs eliminated by the cascade. The elapsed time and the stage timings of the pair are the totals of the methods
+    which ran, they are left as they are if no method ran, e.g. if an image is missing. In threshold mode a pair
+    eliminated by the cascade does not match.
+
+    :param pair: `FilePair` object
+    :param methods: list of method names, in the order they run
+    :param cascade_threshold: maximum similarity of a pair to continue with the next method, None runs every method
+    :raises:
+        FileError: if an image is missing
+        ArgumentError: if the images have different dimensions
+    """
+    pair.similarities = {method: -1.0 for method in methods}
+    elapsed = 0.0
+    timings = {stage: (0.0, 0.0) for stage in STAGES}
+    num_of_runs = 0
+    try:
+        with shared_decode():
+            for position, method in enumerate(methods):
+                if cascade_threshold is not None and position > 0 and pair.similarity > cascade_threshold:
+                    # The final method did not score the pair, its similarity is not on the scale of the others
+                    pair.similarity = -1.0
+                    pair.match = False if threshold is not None else None
+                    pair.early_exit = False if threshold is not None else None
+                    break
+                get_similarity_measurement(method)(pair)
+                pair.similarities[method] = pair.similarity
+                num_of_runs += 1
+                elapsed += pair.elapsed
+                for stage, (wall, cpu) in pair.timings.items():
+                    total_wall, total_cpu = timings[stage]
+                    timings[stage] = (total_wall + wall, total_cpu + cpu)
+    finally:
+        if num_of_runs > 0:
+            pair.elapsed = elapsed
+            pair.timings = timings
+
+
+def compare_batch(pairs, method, hash_size=DEFAULT_HASH_SIZE):
+    """Calculates the similarity of many pairs at once with a hash based method
+
+    Every unique image is hashed once, dhash, avghash and phash hash all images as a single stacked array
+    (see `hashing.hash_batch`), whash hashes them one by one. Hashes are compared with a vectorized XOR and
+    popcount. The pairs are updated like the per pair methods do: pairs with a missing image or with images of
+    different sizes are marked as skipped, their similarity stays -1.0.
+
+    :param pairs: list of `FilePair` objects
+    :param method: name of a hash based method e.g. dhash
+    :param hash_size: hash size
+    :return: ndarray of the similarities in the pair order, -1.0 for the skipped pairs
+    :raises:
+        ArgumentError: if the method is not a hash based method
+    """
+    if method not in hashing.HASH_FUNCTIONS:
+        raise ArgumentError(f"{method} is not a hash based method, batches support {list(hashing.HASH_FUNCTIONS)}")
+
+    paths = list(dict.fromkeys(path for pair in pairs if pair.skipped is False for path in (pair.image1, pair.image2)))
+    if method in hashing.BATCH_HASH_METHODS:
+        hashes = hashing.hash_images_batch(paths, method, hash_size)
+    else:
+        hashes = {path: hashing.hash_image(path, method, hash_size) for path in paths}
+
+    valid = []
+    for position, pair in enumerate(pairs):
+        if pair.skipped:
+            continue
+        entry1, entry2 = hashes[pair.image1], hashes[pair.image2]
+        if entry1 is None or entry2 is None or entry1[1] != entry2[1]:
+            pair.skipped = True
+            continue
+        valid.append(position)
+
+    similarities = np.full(len(pairs), -1.0)
+    if valid:
+        index = {path: i for i, path in enumerate(path for path in paths if hashes[path] is not None)}
+        bits = hashing.unpack_words([hashes[path][0] for path in index], hash_size)
+        index1 = np.array([index[pairs[position].image1] for position in valid], dtype=np.int64)
+        index2 = np.array([index[pairs[position].image2] for position in valid], dtype=np.int64)
+        distances = hashing.hamming_distances(bits[index1], bits[index2])
+        similarities[valid] = np.round(distances / (hash_size * hash_size), 3)
+        for position in valid:
+            pairs[position].similarity = float(similarities[position])
+    return similarities
 
 
 def register_distance(name=""):
-    """Registers the similarity method with given name to MEASUREMENTS dictionary
+    """Registers the similarity function of the method with given name, the method should be in MEASUREMENTS
 
     :param name: name of the method e.g ssim, nrmse, etc.
     :return: decorated method
+    :raises:
+        ValueError: if the method is not in MEASUREMENTS, see `distances.DISTANCES`
     """
+    if name not in MEASUREMENTS:
+        raise ValueError(f"{name} is not in the distances registry, add its descriptor to distances.DISTANCES")
+
     def decorator_register(func):
         """Decorator to register similarity measurments"""
-        MEASUREMENTS[name] = func
+        _functions[name] = func
+        return func
 
     return decorator_register
 
@@ -54,6 +189,9 @@ class TimeSimilarityCalculation:
     """Measures the time of the execution of decorated function and
     update the pair parameter pass to that function.
 
+    Besides the total elapsed time, the wall and CPU time of every stage marked with `measure_stage`
+    is stored in the pair's timings, stages which are not entered are 0.
+
     :param method: similarity method to decorate
     :param timing_method: timing method to use, default value is time.process_time
     Process_time excludes time elapsed during sleep, if sleep time is important time.perf_counter() can be used.
@@ -68,24 +206,178 @@ class TimeSimilarityCalculation:
 
     def __call__(self, method):
         def timed(*args, **kw):
-            ts = self.timing_method()
-            result = method(*args, **kw)
-            te = self.timing_method()
+            timings = {stage: (0.0, 0.0) for stage in STAGES}
+            _stage_timings.append(timings)
+            try:
+                ts = self.timing_method()
+                result = method(*args, **kw)
+                te = self.timing_method()
+            finally:
+                _stage_timings.pop()
             # Update pair's elapsed time
             args[0].elapsed = te - ts
+            args[0].timings = timings
             return result
         return timed
 
 
+@contextlib.contextmanager
+def measure_stage(stage):
+    """Adds the wall and CPU time of the block to the given stage of the calculation in progress
+
+    :param stage: one of `models.STAGES`
+    """
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        if _stage_timings:
+            timings = _stage_timings[-1]
+            wall, cpu = timings[stage]
+            timings[stage] = (wall + time.perf_counter() - wall_start, cpu + time.process_time() - cpu_start)
+
+
+def open_with_pil(path):
+    """Opens and decodes the image with PIL, the file is closed after decoding"""
+    with Image.open(path) as image:
+        image.load()
+    return image
+
+
+def open_with_skimage(path):
+    """Decodes the image with `skimage.io.imread`, the reader of the pixel based methods at full resolution
+
+    scikit-image is imported on the first call, so listing or choosing the similarity methods does not import it.
+    """
+    from skimage import io
+    return io.imread(path)
+
+
+@contextlib.contextmanager
+def shared_decode():
+    """Decodes every image once for all the similarity methods calculated in the block
+
+    Inside the block the full resolution images are decoded with `open_with_pil` only, the pixel based methods use
+    the pixels of the PIL images instead of decoding the files again with `open_with_skimage`. Images of the other
+    modes than `SHARED_DECODE_MODES` are decoded by `open_with_skimage` as usual. The downscaled images of the
+    working resolution and of the threshold mode are decoded on their own.
+    """
+    global _shared_images
+    previous = _shared_images
+    _shared_images = {}
+    try:
+        yield
+    finally:
+        _shared_images = previous
+
+
+def set_max_side(value):
+    """Sets the working resolution of the pixel based methods (ssim, nrmse) of this process
+
+    :param value: longest image side in pixels, larger images are downscaled before the comparison.
+        None compares the images at full resolution
+    """
+    global max_side
+    max_side = value
+
+
+def set_threshold(value):
+    """Enables the early exit threshold mode of the similarity methods of this process
+
+    In threshold mode a pair is compared at a low resolution first, ssim and nrmse downscale the images to fit
+    `COARSE_MAX_SIDE` and the hash based methods use `COARSE_HASH_SIZE`. If the low resolution similarity is farther
+    from the threshold than the margin of the method in `THRESHOLD_MARGINS`, the pair is decided and keeps the low
+    resolution similarity, otherwise it is calculated as usual. `pair.match` is set to whether the similarity is
+    within the threshold and `pair.early_exit` to whether the pair was decided at low resolution. The counters of
+    `threshold_stats` are reset.
+
+    :param value: maximum similarity of a matching pair, None disables the threshold mode
+    """
+    global threshold
+    threshold = value
+    threshold_stats.update(early_exits=0, full=0)
+
+
+def get_working_size(size, max_side):
+    """Returns the image size scaled down to fit max_side, keeping the aspect ratio
+
+    :param size: (width, height) of the image
+    :param max_side: longest side of the returned size
+    :return: (width, height), the given size if it already fits
+    """
+    width, height = size
+    scale = max_side / max(width, height)
+    if scale >= 1:
+        return size
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def open_downscaled(path, max_side):
+    """Decodes the image at a working resolution which fits max_side
+
+    JPEG images are decoded at a reduced scale with PIL's draft mode, then the image is area resampled to
+    the working size. Images are converted to L, RGB or RGBA like `skimage.io.imread` does.
+
+    :param path: image path
+    :param max_side: longest image side in pixels
+    :return: uint8 ndarray
+    """
+    with Image.open(path) as image:
+        size = get_working_size(image.size, max_side)
+        if size != image.size:
+            # Only JPEG supports draft mode, it is a no-op for the other formats
+            image.draft(image.mode, size)
+        image.load()
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.mode or "transparency" in image.info else "RGB")
+    if image.size != size:
+        image = image.resize(size, Image.BOX)
+    return np.asarray(image)
+
+
+def open_with_pil_draft(path, max_side):
+    """Opens and decodes the image with PIL, JPEG images are decoded at the smallest scale that still covers
+    max_side, the other formats at full resolution"""
+    with Image.open(path) as image:
+        image.draft(image.mode, get_working_size(image.size, max_side))
+        image.load()
+    return image
+
+
 def __check_files_and_open_with_pil(pair, same_size_enforce=True):
-    return __check_files_and_open(pair, same_size_enforce=same_size_enforce, image_read_func=Image.open)
+    return __check_files_and_open(pair, same_size_enforce=same_size_enforce, image_read_func=open_with_pil)
 
 
-def __check_files_and_open(pair, same_size_enforce=True, image_read_func=io.imread):
+def __load_image(path, image_read_func):
+    """Returns the decoded image from the pixel pack of this process if it has the image, otherwise from the cache
+
+    The pack holds images decoded by `skimage.io.imread`, so it is only used for `open_with_skimage`. Inside
+    `shared_decode` both readers share the image decoded by `open_with_pil`.
+    """
+    if pixel_pack.pixel_pack is not None and image_read_func is open_with_skimage:
+        image = pixel_pack.pixel_pack.load(path)
+        if image is not None:
+            return image
+    if _shared_images is None or image_read_func not in (open_with_skimage, open_with_pil):
+        return image_cache.load(path, image_read_func)
+
+    image = _shared_images.get(path)
+    if image is None:
+        image = _shared_images[path] = image_cache.load(path, open_with_pil)
+    if image_read_func is open_with_pil:
+        return image
+    if image.mode not in SHARED_DECODE_MODES:
+        return image_cache.load(path, image_read_func)
+    return np.asarray(image)
+
+
+def __check_files_and_open(pair, same_size_enforce=True, image_read_func=open_with_skimage):
     """Private function that enforces common checks and returns the file handlers
 
     :param pair: `FilePair` object
     :param same_size_enforce: enables dimension check of image pairs
+    :param image_read_func: function to decode the images, decoded images are served from the pixel pack
+        opened by `pixel_pack.open_pixel_pack` or from `cache.image_cache`
     :return:
         image1, image2 : ndarray, ndarray
         loaded images
@@ -98,12 +390,14 @@ def __check_files_and_open(pair, same_size_enforce=True, image_read_func=io.imre
     image2 = None
 
     try:
-        image1 = image_read_func(pair.image1)
+        with measure_stage("decode"):
+            image1 = __load_image(pair.image1, image_read_func)
     except FileNotFoundError:
         pair.skipped = True
         raise FileError("File Not Found", pair.image1)
     try:
-        image2 = image_read_func(pair.image2)
+        with measure_stage("decode"):
+            image2 = __load_image(pair.image2, image_read_func)
     except FileNotFoundError:
         pair.skipped = True
         raise FileError("File Not Found", pair.image2)
@@ -116,19 +410,98 @@ def __check_files_and_open(pair, same_size_enforce=True, image_read_func=io.imre
     return image1, image2
 
 
+def __check_original_sizes(pair):
+    """Raises ArgumentError if the images of the pair have different sizes before they are downscaled, images of
+    different sizes may round to the same working size. Only the image headers are read."""
+    with Image.open(pair.image1) as image1, Image.open(pair.image2) as image2:
+        size1, size2 = image1.size, image2.size
+    if size1 != size2:
+        pair.skipped = True
+        raise ArgumentError(f"Images should be same size, "
+                            f"[line:{pair.line_num}]:{pair.image1}[{size1}], {pair.image2}[{size2}]")
+
+
+def __open_pixels(pair, working_side):
+    """Returns the images of the pair as ndarrays
+
+    At full resolution (working_side is None) images are returned as decoded, at a working resolution they are
+    downscaled to fit working_side and converted to float32.
+    """
+    from skimage import img_as_float32
+    if working_side is None:
+        return __check_files_and_open(pair)
+
+    image1, image2 = __check_files_and_open(pair, image_read_func=functools.partial(open_downscaled,
+                                                                                    max_side=working_side))
+    __check_original_sizes(pair)
+    with measure_stage("preprocess"):
+        return img_as_float32(image1), img_as_float32(image2)
+
+
+def __open_as_float(pair, working_side):
+    """Returns the images of the pair as float ndarrays, full resolution images are converted to float64"""
+    from skimage import img_as_float
+    image1, image2 = __open_pixels(pair, working_side)
+    if working_side is not None:
+        return image1, image2
+    with measure_stage("preprocess"):
+        return img_as_float(image1), img_as_float(image2)
+
+
+def __decide_early(pair, similarity, method):
+    """Sets the low resolution similarity of the pair, returns True if it is far enough from the threshold
+    to decide the pair"""
+    pair.similarity = similarity
+    if abs(similarity - threshold) <= THRESHOLD_MARGINS[method]:
+        return False
+    pair.match = bool(similarity <= threshold)
+    pair.early_exit = True
+    threshold_stats["early_exits"] += 1
+    return True
+
+
+def __set_match(pair):
+    """Sets whether the final similarity of the pair is within the threshold, in threshold mode"""
+    if threshold is not None:
+        pair.match = bool(pair.similarity <= threshold)
+        pair.early_exit = False
+        threshold_stats["full"] += 1
+
+
+def __calculate_pixel_similarity(pair, method, metric, open_images=__open_as_float):
+    """Compute pair object's similarity with a metric of the images at the working resolution set by
+    `set_max_side`, in threshold mode the images are compared at `COARSE_MAX_SIDE` first"""
+    if threshold is not None and (max_side is None or max_side > COARSE_MAX_SIDE):
+        if __decide_early(pair, metric(*open_images(pair, COARSE_MAX_SIDE)), method):
+            return
+    pair.similarity = metric(*open_images(pair, max_side))
+    __set_match(pair)
+
+
+def __ssim(image1, image2):
+    # Images are converted to float64 strip by strip, see `tiled_ssim`
+    with measure_stage("compute"):
+        return round(1 - tiled_ssim(image1, image2), 3)
+
+
+def __nrmse(img1f, img2f):
+    from skimage.measure import compare_nrmse as nrmse
+    with measure_stage("compute"):
+        return round(nrmse(img1f, img2f), 3)
+
+
 @register_distance(name="ssim")
 @TimeSimilarityCalculation()
 def calculate_ssim_similarity(pair):
     """Compute the mean structural similarity index between two images.
 
+    The images are compared in strips of rows with `tiled_ssim.tiled_ssim`, so the memory usage does not grow with
+    the image size beyond the decoded images.
+
     :param pair: image pair to compare
     :return:
     """
-    image1, image2 = __check_files_and_open(pair)
-    img1f = img_as_float(image1)
-    img2f = img_as_float(image2)
-    similarity = ssim(img1f, img2f, multichannel=True)
-    pair.similarity = round(1 - similarity, 3)
+    __calculate_pixel_similarity(pair, "ssim", __ssim, open_images=__open_pixels)
 
 
 @register_distance(name="nrmse")
@@ -139,50 +512,127 @@ def calculate_nrmse_similarity(pair):
     :param pair: image pair to compare
     :return:
     """
-    image1, image2 = __check_files_and_open(pair)
-    img1f = img_as_float(image1)
-    img2f = img_as_float(image2)
-    similarity = nrmse(img1f, img2f)
-    pair.similarity = round(similarity, 3)
+    __calculate_pixel_similarity(pair, "nrmse", __nrmse)
 
 
-@TimeSimilarityCalculation()
-def __calculate_imagehash_based_similarity(pair, hash_func, hash_size=16):
-    """Compute given hash_func over pair object's images and update pair object's similarity"""
-    image1_handle = None
-    image2_handle = None
+def __downscale_coarse(image):
+    """Returns the image of the low resolution stage of the threshold mode, decoded by `open_with_pil_draft`"""
+    return image.resize(get_working_size(image.size, COARSE_MAX_SIDE), Image.BOX)
+
+
+def __load_stored_hash(pair, path, method, hash_size, coarse=False):
+    """Returns the packed hash and size of the image, calculating and storing the hash if it is not in the store
+
+    Coarse hashes are calculated from the image of the low resolution stage, like without a store, and they are
+    stored under the method name with the `COARSE_MAX_SIDE` suffix e.g. dhash@128. Their size is the original one.
+    """
+    key = f"{method}@{COARSE_MAX_SIDE}" if coarse else method
     try:
-        image1_handle, image2_handle = __check_files_and_open_with_pil(pair)
-        image1 = hash_func(image1_handle, hash_size=hash_size)
-        image2 = hash_func(image2_handle, hash_size=hash_size)
-        pair.similarity = round(float(image1 - image2) / (hash_size * hash_size), 3)
-    finally:
-        # close the image files
-        if image1_handle:
-            image1_handle.close()
-        if image2_handle:
-            image2_handle.close()
+        entry = hashing.hash_store.lookup(path, key, hash_size)
+        if entry is None:
+            if coarse:
+                with measure_stage("decode"):
+                    image = image_cache.load(path, functools.partial(open_with_pil_draft, max_side=COARSE_MAX_SIDE))
+                with Image.open(path) as original:
+                    size = original.size
+                with measure_stage("preprocess"):
+                    image = __downscale_coarse(image)
+            else:
+                with measure_stage("decode"):
+                    image = image_cache.load(path, open_with_pil)
+                size = image.size
+            with measure_stage("compute"):
+                entry = hashing.pack_hash(hashing.get_hash_function(method)(image, hash_size=hash_size)), size
+            hashing.hash_store.store(path, key, hash_size, *entry)
+    except FileNotFoundError:
+        pair.skipped = True
+        raise FileError("File Not Found", path)
+    return entry
+
+
+def __calculate_stored_hash_similarity(pair, method, hash_size, coarse=False):
+    """Returns pair object's similarity from the packed hashes of `hashing.hash_store`"""
+    bits1, size1 = __load_stored_hash(pair, pair.image1, method, hash_size, coarse)
+    bits2, size2 = __load_stored_hash(pair, pair.image2, method, hash_size, coarse)
+    if size1 != size2:
+        pair.skipped = True
+        raise ArgumentError(f"Images should be same size, "
+                            f"[line:{pair.line_num}]:{pair.image1}[{size1}], {pair.image2}[{size2}]")
+    with measure_stage("compute"):
+        words1, words2 = hashing.unpack_words([bits1, bits2], hash_size)
+        return round(float(hashing.hamming_distance(words1, words2)) / (hash_size * hash_size), 3)
+
+
+def __calculate_hash_distance(images, method, hash_size):
+    """Returns the ratio of the different bits of the hashes of the decoded images"""
+    hash_func = hashing.get_hash_function(method)
+    # The hash functions convert and resize the image, it is measured as compute
+    with measure_stage("compute"):
+        words1, words2 = hashing.pack_words(np.stack([hash_func(image, hash_size=hash_size).reshape(-1)
+                                                      for image in images]))
+        return round(float(hashing.hamming_distance(words1, words2)) / (hash_size * hash_size), 3)
+
+
+@TimeSimilarityCalculation()
+def __calculate_hash_based_similarity(pair, method, hash_size=DEFAULT_HASH_SIZE):
+    """Compute given hash method over pair object's images and update pair object's similarity
+
+    If a hash store is opened with `hashing.open_hash_store`, stored hashes are reused. In threshold mode the hashes
+    of `COARSE_HASH_SIZE` of the images downscaled to fit `COARSE_MAX_SIDE` are compared first, JPEG images are
+    decoded at a reduced scale for them. The coarse hashes are the same with or without a store.
+    """
+    coarse = threshold is not None and hash_size > COARSE_HASH_SIZE
+    if hashing.hash_store is not None:
+        if coarse and __decide_early(pair, __calculate_stored_hash_similarity(pair, method, COARSE_HASH_SIZE,
+                                                                              coarse=True), method):
+            return
+        pair.similarity = __calculate_stored_hash_similarity(pair, method, hash_size)
+        __set_match(pair)
+        return
+
+    # Images are decoded by open_with_pil, their files are already closed
+    images = None
+    if coarse:
+        images = __check_files_and_open(pair, image_read_func=functools.partial(open_with_pil_draft,
+                                                                                max_side=COARSE_MAX_SIDE))
+        __check_original_sizes(pair)
+        with measure_stage("preprocess"):
+            small_images = [__downscale_coarse(image) for image in images]
+        if __decide_early(pair, __calculate_hash_distance(small_images, method, COARSE_HASH_SIZE), method):
+            return
+        # Only JPEG images are decoded at a reduced scale, the others are already at full resolution
+        if any(image.format == "JPEG" for image in images):
+            images = None
+    if images is None:
+        images = __check_files_and_open_with_pil(pair)
+    pair.similarity = __calculate_hash_distance(images, method, hash_size)
+    __set_match(pair)
 
 
 @register_distance(name="dhash")
-def calculate_dhash_similarity(pair, hash_size=16):
+def calculate_dhash_similarity(pair, hash_size=DEFAULT_HASH_SIZE):
     """Compute Difference Hash"""
-    __calculate_imagehash_based_similarity(pair, imagehash.dhash, hash_size=hash_size)
+    __calculate_hash_based_similarity(pair, "dhash", hash_size=hash_size)
 
 
 @register_distance(name="avghash")
-def calculate_avghash_similarity(pair, hash_size=16):
+def calculate_avghash_similarity(pair, hash_size=DEFAULT_HASH_SIZE):
     """Compute Average Hash"""
-    __calculate_imagehash_based_similarity(pair, imagehash.average_hash, hash_size=hash_size)
+    __calculate_hash_based_similarity(pair, "avghash", hash_size=hash_size)
 
 
 @register_distance(name="phash")
-def calculate_phash_similarity(pair, hash_size=16):
+def calculate_phash_similarity(pair, hash_size=DEFAULT_HASH_SIZE):
     """Compute Perception Hash"""
-    __calculate_imagehash_based_similarity(pair, imagehash.phash, hash_size=hash_size)
+    __calculate_hash_based_similarity(pair, "phash", hash_size=hash_size)
 
 
 @register_distance(name="whash")
-def calculate_whash_similarity(pair, hash_size=16):
+def calculate_whash_similarity(pair, hash_size=DEFAULT_HASH_SIZE):
     """Compute Wavelet Hash"""
-    __calculate_imagehash_based_similarity(pair, imagehash.whash, hash_size=hash_size)
+    __calculate_hash_based_similarity(pair, "whash", hash_size=hash_size)
+
+
+if set(_functions) != set(MEASUREMENTS):
+    raise ImportError(f"Similarity methods without a registered function: "
+                      f"{sorted(set(MEASUREMENTS) - set(_functions))}")
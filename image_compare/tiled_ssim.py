@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""This module contains the SSIM calculated over strips of rows, which bounds the memory usage for large images"""
+
+import numpy as np
+
+
+# Side of the uniform window of SSIM, as in `skimage.measure.compare_ssim`
+WIN_SIZE = 7
+
+# Constants of the SSIM formula, as in `skimage.measure.compare_ssim`
+K1 = 0.01
+K2 = 0.03
+
+# Number of values of a strip, about 16 MB per float64 buffer
+DEFAULT_STRIP_ELEMENTS = 2 ** 21
+
+
+def get_strip_rows(shape, strip_elements=DEFAULT_STRIP_ELEMENTS):
+    """Returns the number of output rows of a strip of an image of the given shape"""
+    return max(1, strip_elements // int(np.prod(shape[1:])))
+
+
+def tiled_ssim(image1, image2, data_range=2.0, win_size=WIN_SIZE, strip_elements=DEFAULT_STRIP_ELEMENTS):
+    """Returns the mean structural similarity index of two images, like
+    `skimage.measure.compare_ssim(image1, image2, multichannel=True)` of the float images
+
+    The images are processed in strips of rows. Every strip is converted to float64 with `skimage.img_as_float` and
+    read with win_size // 2 extra rows on both sides, so the window of every row of the strip is the same as in the
+    whole image. The local SSIM values of the rows are summed per channel, the border win_size // 2 pixels wide is
+    excluded like `compare_ssim` crops it. Only the float buffers of a strip of about strip_elements values are
+    allocated, whatever the image size. The result is equal to `compare_ssim` up to floating point rounding.
+
+    :param image1: (height, width, channels) ndarray, the last axis is the channel axis like with multichannel=True
+    :param image2: ndarray of the same shape and dtype
+    :param data_range: data range of the float images, 2.0 is the range `compare_ssim` uses for float images
+    :param win_size: side of the uniform window
+    :param strip_elements: number of values of a strip
+    :return: float
+    :raises:
+        ValueError: if the images have different shapes or are smaller than the window
+    """
+    from scipy.ndimage import uniform_filter
+    from skimage import img_as_float
+
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    spatial_dims = image1.ndim - 1
+    if spatial_dims < 1 or min(image1.shape[:-1]) < win_size:
+        raise ValueError(f"win_size exceeds image extent, images should be at least {win_size} pixels wide and high")
+
+    pad = (win_size - 1) // 2
+    num_of_pixels = win_size ** spatial_dims
+    cov_norm = num_of_pixels / (num_of_pixels - 1)
+    c1 = (K1 * data_range) ** 2
+    c2 = (K2 * data_range) ** 2
+    # The channel axis is not filtered
+    size = (win_size,) * spatial_dims + (1,)
+    # Border of the other spatial axes, the rows are cropped by the strips
+    crop = (slice(None),) + (slice(pad, -pad or None),) * (spatial_dims - 1)
+
+    height = image1.shape[0]
+    strip_rows = get_strip_rows(image1.shape, strip_elements)
+    totals = np.zeros(image1.shape[-1])
+    for start in range(pad, height - pad, strip_rows):
+        stop = min(start + strip_rows, height - pad)
+        x = img_as_float(image1[start - pad:stop + pad]).astype(np.float64)
+        y = img_as_float(image2[start - pad:stop + pad]).astype(np.float64)
+
+        ux = uniform_filter(x, size=size)
+        uy = uniform_filter(y, size=size)
+        uxx = uniform_filter(x * x, size=size)
+        uyy = uniform_filter(y * y, size=size)
+        uxy = uniform_filter(x * y, size=size)
+        del x, y
+        vx = cov_norm * (uxx - ux * ux)
+        vy = cov_norm * (uyy - uy * uy)
+        vxy = cov_norm * (uxy - ux * uy)
+        del uxx, uyy, uxy
+
+        a1, a2, b1, b2 = 2 * ux * uy + c1, 2 * vxy + c2, ux ** 2 + uy ** 2 + c1, vx + vy + c2
+        del ux, uy, vx, vy, vxy
+        ssim_map = (a1 * a2) / (b1 * b2)
+        # Rows of the strip without the extra rows of the windows
+        totals += ssim_map[pad:pad + stop - start][crop].sum(axis=tuple(range(spatial_dims)))
+
+    num_of_values = (height - 2 * pad) * int(np.prod([side - 2 * pad for side in image1.shape[1:-1]]))
+    return float((totals / num_of_values).mean())
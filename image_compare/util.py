@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 """Module holds utility functions"""
+import os
+import math
 from datetime import datetime
 
 
@@ -21,3 +23,70 @@ def clean_string(val, default=""):
 def get_timestamp_str():
     """Returns current time in {YEAR}{MONTH}{DAY}_{HOUR}{MINUTE}{SECOND}_{MICROSECOND} format"""
     return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def format_progress(line_num, total):
+    """Returns the progress of a line e.g. 007/120, only the line number if the total is None"""
+    if total is None:
+        return f"{line_num:03d}"
+    return f"{line_num:03d}/{total:03d}"
+
+
+def get_default_worker_count():
+    """Returns the number of workers to use when none is given, which is the CPU count of the machine"""
+    return os.cpu_count() or 1
+
+
+class DurationHistogram:
+    """Counts durations in fixed logarithmic buckets to give their approximate percentiles
+
+    A bucket spans a factor of 10 ** (1 / BUCKETS_PER_DECADE), so a percentile is within about 6% of the exact one
+    and the memory used is the same whatever the number of durations.
+    """
+
+    # Durations up to MIN_DURATION seconds are counted in the first bucket, longer ones than DECADES decades above it
+    # in the last one
+    MIN_DURATION = 1e-6
+    DECADES = 10
+    BUCKETS_PER_DECADE = 20
+
+    def __init__(self):
+        self.counts = [0] * (self.DECADES * self.BUCKETS_PER_DECADE + 2)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, duration):
+        """Counts a duration in seconds"""
+        if duration <= self.MIN_DURATION:
+            bucket = 0
+        else:
+            bucket = min(len(self.counts) - 1,
+                         1 + int(math.log10(duration / self.MIN_DURATION) * self.BUCKETS_PER_DECADE))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+
+    def percentile(self, q):
+        """Returns the approximate q-th percentile of the durations, the geometric middle of its bucket, bounded by
+        the shortest and the longest duration
+
+        :param q: percentile between 0 and 100
+        :return: duration in seconds, 0.0 if nothing is counted
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(q / 100 * self.count))
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                break
+        # The first and last buckets are open, they are represented by the shortest and the longest duration
+        if bucket == 0:
+            return self.min
+        if bucket == len(self.counts) - 1:
+            return self.max
+        duration = self.MIN_DURATION * 10 ** ((bucket - 0.5) / self.BUCKETS_PER_DECADE)
+        return min(max(duration, self.min), self.max)
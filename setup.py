@@ -11,7 +11,10 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['Click>=6.0', 'scikit-image>=0.15.0', 'scipy>=1.3.1', 'imagehash==4.0']
+requirements = ['Click>=6.0', 'scikit-image>=0.15.0', 'scipy>=1.3.1', 'PyWavelets>=1.0.3']
+
+# Parquet and Arrow files, reading Parquet in batches needs ParquetFile.iter_batches of pyarrow 3.0.0
+extras_requirements = {'arrow': ['pyarrow>=3.0.0']}
 
 setup_requirements = [ ]
 
@@ -25,22 +28,27 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Natural Language :: English',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
     description="CLI tool to compare image similarities.",
     entry_points={
         'console_scripts': [
             'image_compare=image_compare.cli:main',
+            'image_compare_dedupe=image_compare.cli:dedupe',
+            'image_compare_pack=image_compare.cli:pack',
+            'image_compare_serve=image_compare.cli:serve',
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
     keywords='image_compare',
     name='image_compare',
     packages=find_packages(include=['image_compare']),
+    # The worker pools are set up with the initializer of ProcessPoolExecutor, added in Python 3.7
+    python_requires='>=3.7',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
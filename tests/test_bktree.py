@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bktree` module."""
+import random
+import unittest
+from image_compare.bktree import BKTree, hamming_distance
+
+
+class TestBKTree(unittest.TestCase):
+    """Tests for `BKTree` class."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        generator = random.Random(42)
+        self.values = [generator.getrandbits(64) for _ in range(300)]
+        # Add near duplicates of the first values
+        self.values += [value ^ (1 << generator.randrange(64)) for value in self.values[:30]]
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_hamming_distance(self):
+        assert hamming_distance(0b1011, 0b0001) == 2
+        assert hamming_distance(7, 7) == 0
+
+    def test_empty_tree(self):
+        tree = BKTree()
+        assert len(tree) == 0
+        assert tree.find(0, 64) == []
+
+    def test_find_same_as_brute_force(self):
+        tree = BKTree()
+        for index, value in enumerate(self.values):
+            tree.add(value, index)
+        assert len(tree) == len(self.values)
+
+        for radius in [0, 1, 5, 24]:
+            for query in self.values[:50]:
+                expected = sorted((hamming_distance(query, value), index) for index, value in enumerate(self.values)
+                                  if hamming_distance(query, value) <= radius)
+                assert sorted(tree.find(query, radius)) == expected
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cache` module."""
+import unittest
+import functools
+import numpy as np
+from image_compare.cache import ImageCache, image_cache, get_image_nbytes, get_reader_key, sum_stats
+from image_compare.models import FilePair
+from image_compare.similarity import get_similarity_measurement, open_with_pil
+
+
+def read_dummy_image(path):
+    """helper function, returns a 10x10 RGB image (300 bytes)"""
+    return np.zeros((10, 10, 3), dtype=np.uint8)
+
+
+class TestImageCache(unittest.TestCase):
+    """Tests for `ImageCache` class."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.images = ["files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png",
+                       "files/tests/images/0-2-grey.png"]
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_hits_and_misses(self):
+        cache = ImageCache(max_bytes=1000)
+        first = cache.load(self.images[0], read_dummy_image)
+        second = cache.load(self.images[0], read_dummy_image)
+        assert first is second
+        assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+    def test_cached_images_are_read_only(self):
+        cache = ImageCache(max_bytes=1000)
+        image = cache.load(self.images[0], read_dummy_image)
+        assert image.flags.writeable is False
+
+    def test_reader_arguments_are_part_of_the_key(self):
+        cache = ImageCache(max_bytes=1000)
+        cache.load(self.images[0], functools.partial(read_dummy_image))
+        cache.load(self.images[0], functools.partial(read_dummy_image))
+        assert cache.stats()["hits"] == 1
+        assert get_reader_key(functools.partial(read_dummy_image)) != get_reader_key(read_dummy_image)
+        assert get_reader_key(functools.partial(read_dummy_image, 1)) != \
+            get_reader_key(functools.partial(read_dummy_image, 2))
+
+    def test_sources_are_decoded_instead_of_files(self):
+        cache = ImageCache(max_bytes=0)
+        with open(self.images[0], "rb") as f:
+            cache.set_sources({self.images[1]: f.read()})
+        image = cache.load(self.images[1], open_with_pil)
+        assert image.getpixel((0, 0)) == open_with_pil(self.images[0]).getpixel((0, 0))
+        cache.set_sources(None)
+        assert cache.sources == {}
+
+    def test_lru_eviction(self):
+        cache = ImageCache(max_bytes=600)
+        cache.load(self.images[0], read_dummy_image)
+        cache.load(self.images[1], read_dummy_image)
+        # Touch the first image, so the second one is the least recently used
+        cache.load(self.images[0], read_dummy_image)
+        cache.load(self.images[2], read_dummy_image)
+        assert len(cache) == 2
+        assert cache.current_bytes == 600
+        assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 1}
+        cache.load(self.images[0], read_dummy_image)
+        assert cache.stats()["hits"] == 2
+
+    def test_zero_budget_disables_cache(self):
+        cache = ImageCache(max_bytes=0)
+        cache.load(self.images[0], read_dummy_image)
+        cache.load(self.images[0], read_dummy_image)
+        assert len(cache) == 0
+        assert cache.stats() == {"hits": 0, "misses": 2, "evictions": 0}
+
+    def test_resize(self):
+        cache = ImageCache(max_bytes=1000)
+        for image in self.images:
+            cache.load(image, read_dummy_image)
+        cache.resize(300)
+        assert len(cache) == 1
+        assert cache.stats()["evictions"] == 2
+
+    def test_missing_file(self):
+        cache = ImageCache()
+        with self.assertRaises(FileNotFoundError):
+            cache.load("no_such_file_exists.png", read_dummy_image)
+
+    def test_image_nbytes(self):
+        assert get_image_nbytes(read_dummy_image(None)) == 300
+
+    def test_sum_stats(self):
+        stats = sum_stats([{"hits": 1, "misses": 2, "evictions": 3}, {"hits": 1, "misses": 0, "evictions": 1}])
+        assert stats == {"hits": 2, "misses": 2, "evictions": 4}
+
+    def test_similarity_methods_use_cache(self):
+        image_cache.clear()
+        image_cache.reset_stats()
+        for method_name in ["ssim", "dhash"]:
+            method = get_similarity_measurement(method_name)
+            pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-0-white.png")
+            method(pair)
+            assert pair.similarity <= .005, "Same files should return zero"
+        # Each method decodes the image once and reads the second one from the cache
+        assert image_cache.stats() == {"hits": 2, "misses": 2, "evictions": 0}
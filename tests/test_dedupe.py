@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `dedupe` module."""
+import os
+import tempfile
+import unittest
+from image_compare import hashing
+from image_compare.dedupe import list_images, find_duplicates, get_max_distance
+from image_compare.exceptions import FileError
+
+
+class TestDedupe(unittest.TestCase):
+    """Tests for `dedupe` module."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_list_images_of_folder(self):
+        paths = list(list_images("files/tests/images"))
+        assert len(paths) == 8
+        assert os.path.join("files/tests/images", "small", "cat.png") in paths
+        assert all(path.endswith(".png") for path in paths)
+
+    def test_list_images_of_list_file(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            list_file = os.path.join(temp_folder, "images.txt")
+            with open(list_file, "w") as f:
+                f.write("files/tests/images/0-0-white.png\n\n  files/tests/images/0-1-black.png  \n")
+            assert list(list_images(list_file)) == ["files/tests/images/0-0-white.png",
+                                                    "files/tests/images/0-1-black.png"]
+
+    def test_list_images_missing_source(self):
+        with self.assertRaises(FileError):
+            list(list_images("no_such_folder_exists"))
+
+    def test_max_distance(self):
+        assert get_max_distance(0.3) == 76
+        assert get_max_distance(0.25) == 64
+        assert get_max_distance(0.1, hash_size=8) == 6
+
+    def test_find_duplicates_same_as_brute_force(self):
+        paths = list(list_images("files/images"))[:12] + ["no_such_file_exists.png"]
+        hashes = hashing.hash_unique_images(paths, "phash")
+        for threshold in [0.0, 0.1, 0.3]:
+            expected = set()
+            for i, path1 in enumerate(paths):
+                for path2 in paths[i + 1:]:
+                    if hashes[path1] is None or hashes[path2] is None:
+                        continue
+                    distance = hashing.hamming_distance(*hashing.unpack_words([hashes[path1][0], hashes[path2][0]],
+                                                                              hash_size=16))
+                    if distance <= get_max_distance(threshold):
+                        expected.add((path1, path2, round(distance / 256, 3)))
+
+            pairs = list(find_duplicates(paths, "phash", threshold))
+            assert set((pair.image1, pair.image2, pair.similarity) for pair in pairs) == expected
+            assert [pair.line_num for pair in pairs] == list(range(1, len(pairs) + 1))
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `distances` module."""
+
+
+import unittest
+from image_compare.distances import DISTANCES, get_distance, get_distance_names
+from image_compare.exceptions import ArgumentError
+from image_compare import hashing
+from image_compare import similarity
+
+
+class TestDistances(unittest.TestCase):
+    """Tests for `distances` module."""
+
+    def test_distance_names(self):
+        assert get_distance_names() == ["ssim", "nrmse", "dhash", "avghash", "phash", "whash"]
+        assert get_distance_names("pixel") == ["ssim", "nrmse"]
+        assert get_distance_names("hash") == list(hashing.HASH_FUNCTIONS)
+
+    def test_every_distance_is_registered(self):
+        assert list(similarity.MEASUREMENTS) == list(DISTANCES)
+        for name in DISTANCES:
+            assert callable(similarity.get_similarity_measurement(name))
+        # A function can only be registered for a method of the registry
+        with self.assertRaises(ValueError):
+            similarity.register_distance(name="NoSuchDistance")
+
+    def test_unsupported_distance(self):
+        with self.assertRaises(ArgumentError):
+            get_distance("NoSuchDistance")
@@ -5,10 +5,15 @@
 
 
 import os
+import shutil
+import tempfile
 import unittest
+import importlib.util
 from image_compare.util import get_timestamp_str
-from image_compare.models import FilePair
-from image_compare.file_handlers import CSVInputHandler, CSVOutputHandler, FileHandlerFactory
+from image_compare.models import FilePair, PairTable
+from image_compare.file_handlers import CSVInputHandler, CSVOutputHandler, FileHandlerFactory, \
+    ParquetOutputHandler, ArrowOutputHandler, JSONLInputHandler, ParquetInputHandler, SamePathInputHandler, \
+    ReferenceInputHandler, scan_images, split_glob, match_glob
 from image_compare.exceptions import FileError
 
 
@@ -53,6 +58,35 @@ class TestCSVInputHandler(unittest.TestCase):
         records = csv_handler.read()
         assert len(records) == 4
 
+    def test_iterating_input_file(self):
+        csv_handler = CSVInputHandler("files/tests/input1-with-2-missing-elements.csv")
+        records = csv_handler.read()
+        # Iteration is lazy and can be repeated
+        for _ in range(2):
+            pairs = iter(csv_handler)
+            assert [(pair.image1, pair.image2, pair.skipped) for pair in pairs] == \
+                [(pair.image1, pair.image2, pair.skipped) for pair in records]
+
+    def test_count(self):
+        assert CSVInputHandler("files/tests/input1.csv").count() == 4
+        with self.assertRaises(FileError):
+            CSVInputHandler("files/tests/there_no_such_file.csv").count()
+
+    def test_read_table(self):
+        csv_handler = CSVInputHandler("files/tests/input1.csv")
+        table = csv_handler.read_table()
+        assert [repr(pair) for pair in table] == [repr(pair) for pair in csv_handler.read()]
+
+    def test_start_line(self):
+        csv_handler = CSVInputHandler("files/tests/input1.csv", start_line=3)
+        assert [pair.line_num for pair in csv_handler.read()] == [3, 4]
+        assert csv_handler.count() == 4
+
+    def test_iterating_missing_input_file(self):
+        csv_handler = CSVInputHandler("files/tests/there_no_such_file.csv")
+        with self.assertRaises(FileError):
+            iter(csv_handler)
+
     def test_read_and_line_nums_of_file_pairs(self):
         csv_handler = CSVInputHandler("files/tests/input1.csv")
         records = csv_handler.read()
@@ -60,6 +94,174 @@ class TestCSVInputHandler(unittest.TestCase):
         assert set([pair.line_num for pair in records]) == set([1, 2, 3, 4])
 
 
+class TestJSONLInputHandler(unittest.TestCase):
+    """Tests for `JSONLInputHandler` class."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.filename = "files/tests/input1-with-2-missing-elements.jsonl"
+        self.temp_files = []
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        for temp_file in self.temp_files:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def test_reading_input_file(self):
+        handler = JSONLInputHandler(self.filename)
+        records = handler.read()
+        assert [(pair.image1, pair.image2, pair.line_num) for pair in records] == [
+            ("aa.png", "<NO_FILE_GIVEN>", 1), ("ba.png", "bb.png", 2), ("ca.png", "<NO_FILE_GIVEN>", 3),
+            ("da.png", "db.png", 4)]
+        assert get_number_of_skipped_pairs(records) == 2
+        assert handler.count() == 4
+
+    def test_start_line(self):
+        handler = JSONLInputHandler(self.filename, start_line=3)
+        assert [pair.line_num for pair in handler] == [3, 4]
+        assert handler.count() == 4
+
+    def test_missing_input_file(self):
+        with self.assertRaises(FileError):
+            JSONLInputHandler("files/tests/there_no_such_file.jsonl").read()
+
+    def test_invalid_record(self):
+        tmp_file = os.path.join("files/tests/tmp", f"input_{get_timestamp_str()}.jsonl")
+        self.temp_files.append(tmp_file)
+        os.makedirs("files/tests/tmp", exist_ok=True)
+        with open(tmp_file, "w") as f:
+            f.write('{"image1": "aa.png", "image2": "ab.png"}\n["ba.png", "bb.png"]\n')
+        with self.assertRaises(FileError):
+            JSONLInputHandler(tmp_file).read()
+
+
+class TestImageSourceInputHandler(unittest.TestCase):
+    """Tests for `scan_images`, `SamePathInputHandler` and `ReferenceInputHandler`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.temp_folder = tempfile.mkdtemp()
+        self.folder1 = os.path.join(self.temp_folder, "a")
+        self.folder2 = os.path.join(self.temp_folder, "b")
+        shutil.copytree("files/tests/images", self.folder1)
+        shutil.copytree("files/tests/images", self.folder2)
+        os.remove(os.path.join(self.folder2, "0-1-black.png"))
+        with open(os.path.join(self.folder1, "notes.txt"), "w") as f:
+            f.write("not an image")
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self.temp_folder)
+
+    def test_split_and_match_glob(self):
+        assert split_glob("files/images") == ("files/images", None)
+        assert split_glob("files/**/cat-*.png") == ("files", "**/cat-*.png")
+        assert split_glob("*.png") == ("", "*.png")
+        assert split_glob("/*.png") == ("/", "*.png")
+        for pattern, path, expected in [("*.png", "a.png", True), ("*.png", "x/a.png", False),
+                                        ("**/*.png", "a.png", True), ("**/*.png", "x/y/a.png", True),
+                                        ("x/**", "x/y/a.png", True), ("a?.png", "ab.png", True),
+                                        ("[!a]*.png", "a.png", False), ("[a-c].png", "b.png", True),
+                                        ("a.png", "abpng", False), ("x/**/*.png", "x/a.png", True),
+                                        ("x/**/*.png", "y/a.png", False)]:
+            assert match_glob(path, pattern) == expected, (pattern, path)
+
+    def test_scan_images(self):
+        relative_paths = [relative_path for relative_path, _ in scan_images(self.folder1)]
+        assert relative_paths == ["0-0-white.png", "0-1-black.png", "0-2-grey.png", "1-0-small-white.png",
+                                  "1-1-big-white.png", "small/cat-wm-big.png", "small/cat-wm-small.png",
+                                  "small/cat.png"]
+        assert list(scan_images(os.path.join(self.folder1, "**", "cat-*.png"))) == [
+            ("small/cat-wm-big.png", os.path.join(self.folder1, "small/cat-wm-big.png")),
+            ("small/cat-wm-small.png", os.path.join(self.folder1, "small/cat-wm-small.png"))]
+        # Without ** the pattern is not matched in the sub folders
+        assert [relative_path for relative_path, _ in scan_images(os.path.join(self.folder1, "*.txt"))] == \
+            ["notes.txt"]
+        with self.assertRaises(FileError):
+            list(scan_images(os.path.join(self.temp_folder, "no_such_folder")))
+
+    def test_same_path_pairs(self):
+        handler = SamePathInputHandler(os.path.join(self.folder1, "0-*.png"), self.folder2)
+        assert [(pair.image1, pair.image2, pair.line_num) for pair in handler] == [
+            (os.path.join(self.folder1, name), os.path.join(self.folder2, name), line_num)
+            for line_num, name in enumerate(["0-0-white.png", "0-1-black.png", "0-2-grey.png"], start=1)]
+        assert handler.count() == 3
+        handler.start_line = 3
+        assert [pair.line_num for pair in handler] == [3]
+
+        with self.assertRaises(FileError):
+            SamePathInputHandler(self.folder1, os.path.join(self.temp_folder, "no_such_folder")).count()
+
+    def test_reference_pairs(self):
+        reference = os.path.join(self.folder1, "small", "cat.png")
+        handler = ReferenceInputHandler(os.path.join(self.folder2, "small"), reference)
+        assert [(pair.image1, pair.image2) for pair in handler.read()] == [
+            (reference, os.path.join(self.folder2, "small", name))
+            for name in ["cat-wm-big.png", "cat-wm-small.png", "cat.png"]]
+        with self.assertRaises(FileError):
+            ReferenceInputHandler(os.path.join(self.temp_folder, "no_such_folder"), reference).read()
+
+    def test_reference_is_not_paired_with_itself(self):
+        reference = os.path.join(self.folder1, "small", "cat.png")
+        handler = ReferenceInputHandler(os.path.join(self.folder1, "small"), os.path.relpath(reference))
+        assert [pair.image2 for pair in handler] == [os.path.join(self.folder1, "small", name)
+                                                     for name in ["cat-wm-big.png", "cat-wm-small.png"]]
+        assert handler.count() == 2
+
+    def test_folder_with_glob_characters(self):
+        folder = os.path.join(self.temp_folder, "[x]")
+        shutil.copytree(os.path.join(self.folder1, "small"), folder)
+        assert [relative_path for relative_path, _ in scan_images(folder)] == \
+            ["cat-wm-big.png", "cat-wm-small.png", "cat.png"]
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+class TestParquetInputHandler(unittest.TestCase):
+    """Tests for `ParquetInputHandler` class."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        import pyarrow
+        import pyarrow.parquet
+        os.makedirs("files/tests/tmp", exist_ok=True)
+        self.filename = os.path.join("files/tests/tmp", f"input_{get_timestamp_str()}.parquet")
+        image1 = [f"image{i}.png" for i in range(10)]
+        image2 = [None if i % 4 == 0 else f" other{i}.png " for i in range(10)]
+        table = pyarrow.table({"id": list(range(10)), "image1": image1, "image2": image2})
+        pyarrow.parquet.write_table(table, self.filename, row_group_size=3)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def test_reading_input_file(self):
+        handler = ParquetInputHandler(self.filename, chunk_size=2)
+        records = handler.read()
+        assert [pair.line_num for pair in records] == list(range(1, 11))
+        assert records[1].image1 == "image1.png" and records[1].image2 == "other1.png"
+        assert records[4].image2 == "<NO_FILE_GIVEN>"
+        assert get_number_of_skipped_pairs(records) == 3
+        assert handler.count() == 10
+
+    def test_start_line(self):
+        for start_line in range(1, 12):
+            handler = ParquetInputHandler(self.filename, start_line=start_line, chunk_size=2)
+            records = list(handler)
+            assert [pair.line_num for pair in records] == list(range(start_line, 11))
+            assert [pair.image1 for pair in records] == [f"image{i - 1}.png" for i in range(start_line, 11)]
+
+    def test_missing_columns(self):
+        import pyarrow
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(pyarrow.table({"image1": ["aa.png"]}), self.filename)
+        with self.assertRaises(FileError):
+            ParquetInputHandler(self.filename).read()
+        with self.assertRaises(FileError):
+            ParquetInputHandler("files/tests/input1.csv").count()
+
+
 class TestCSVOutputHandler(unittest.TestCase):
     """Tests for `CSVOutputHandler` class."""
 
@@ -78,7 +280,9 @@ class TestCSVOutputHandler(unittest.TestCase):
     def tearDown(self):
         """Tear down test fixtures, if any."""
         for temp_file in self.temp_files:
-            os.remove(temp_file)
+            for filename in [temp_file, f"{temp_file}.ckpt"]:
+                if os.path.exists(filename):
+                    os.remove(filename)
 
     def get_temp_file_name(self):
         tmp_file = os.path.join(self.temp_file_folder, f"output_{get_timestamp_str()}.csv")
@@ -108,6 +312,193 @@ class TestCSVOutputHandler(unittest.TestCase):
         assert len(csv_input_handler.read()) == len(self.sample_pairs)
 
 
+    def test_incremental_write(self):
+        tmp_file = self.get_temp_file_name()
+        csv_handler = CSVOutputHandler(tmp_file, self.headers, flush_every=2)
+        with csv_handler.open():
+            csv_handler.write_pair(self.sample_pairs[0])
+            csv_handler.write_pair(self.sample_pairs[1])
+            # Flushed rows are on disk before the file is closed
+            assert len(CSVInputHandler(tmp_file).read()) == 2
+            csv_handler.write_pair(self.sample_pairs[2])
+        assert len(CSVInputHandler(tmp_file).read()) == len(self.sample_pairs)
+
+    def test_headers_from_first_pair(self):
+        tmp_file = self.get_temp_file_name()
+        CSVOutputHandler(tmp_file, []).write(self.sample_pairs)
+        with open(tmp_file) as f:
+            assert f.readline().strip() == '"image1","image2","similarity","elapsed","line_num","skipped"'
+
+    def test_write_table(self):
+        pairs = self.get_numbered_pairs(5)
+        pairs[2].skipped = True
+        expected_file = self.get_temp_file_name()
+        CSVOutputHandler(expected_file, ["image1", "image2", "similarity", "line_num", "skipped"]).write(pairs)
+
+        tmp_file = self.get_temp_file_name()
+        csv_handler = CSVOutputHandler(tmp_file, ["image1", "image2", "similarity", "line_num", "skipped"],
+                                       checkpoint=True)
+        csv_handler.write_table(PairTable.from_pairs(pairs))
+        with open(expected_file) as expected, open(tmp_file) as actual:
+            assert actual.read() == expected.read()
+        assert csv_handler.last_line_num == 5
+
+    def test_write_table_headers(self):
+        tmp_file = self.get_temp_file_name()
+        CSVOutputHandler(tmp_file, []).write_table(PairTable.from_pairs(self.sample_pairs))
+        with open(tmp_file) as f:
+            assert f.readline().strip() == '"image1","image2","similarity","elapsed","line_num","skipped"'
+        assert len(CSVInputHandler(tmp_file).read()) == len(self.sample_pairs)
+
+    def get_numbered_pairs(self, count):
+        return [FilePair(f"image{i}a", f"image{i}b", similarity=0.5, line_num=i) for i in range(1, count + 1)]
+
+    def test_resume_from_checkpoint(self):
+        tmp_file = self.get_temp_file_name()
+        pairs = self.get_numbered_pairs(5)
+        csv_handler = CSVOutputHandler(tmp_file, self.headers, flush_every=2, checkpoint=True)
+        csv_handler.open()
+        for pair in pairs:
+            csv_handler.write_pair(pair)
+        csv_handler.flush()
+        # Simulate a crash while writing the 6th row, after the last checkpoint
+        csv_handler._csv_file.write('"image6a","ima')
+        csv_handler._csv_file.flush()
+        os.fsync(csv_handler._csv_file.fileno())
+
+        csv_handler2 = CSVOutputHandler(tmp_file, self.headers, checkpoint=True)
+        assert csv_handler2.resume() == 5
+        with csv_handler2:
+            for pair in self.get_numbered_pairs(7)[5:]:
+                csv_handler2.write_pair(pair)
+        records = CSVInputHandler(tmp_file).read()
+        assert [pair.image1 for pair in records] == [f"image{i}a" for i in range(1, 8)]
+
+    def test_resume_without_checkpoint(self):
+        tmp_file = self.get_temp_file_name()
+        CSVOutputHandler(tmp_file, self.headers).write(self.get_numbered_pairs(3))
+        with open(tmp_file, "a") as f:
+            f.write('"image4a","image4')
+
+        csv_handler = CSVOutputHandler(tmp_file, self.headers)
+        assert csv_handler.resume() == 3
+        with csv_handler:
+            csv_handler.write_pair(self.get_numbered_pairs(4)[3])
+        records = CSVInputHandler(tmp_file).read()
+        assert [pair.image2 for pair in records] == [f"image{i}b" for i in range(1, 5)]
+
+    def test_resume_with_different_headers(self):
+        tmp_file = self.get_temp_file_name()
+        CSVOutputHandler(tmp_file, self.headers).write(self.get_numbered_pairs(3))
+        with open(tmp_file, "rb") as f:
+            content = f.read()
+
+        with self.assertRaises(FileError):
+            CSVOutputHandler(tmp_file, self.headers + ["match"]).resume()
+        # The file is left as it is
+        with open(tmp_file, "rb") as f:
+            assert f.read() == content
+
+    def test_resume_missing_file(self):
+        tmp_file = self.get_temp_file_name()
+        csv_handler = CSVOutputHandler(tmp_file, self.headers)
+        assert csv_handler.resume() == 0
+        with csv_handler:
+            csv_handler.write_pair(self.sample_pairs[0])
+        assert len(CSVInputHandler(tmp_file).read()) == 1
+
+    def test_resume_folder(self):
+        with self.assertRaises(FileError):
+            CSVOutputHandler("files/", self.headers).resume()
+
+    def test_open_removes_stale_checkpoint(self):
+        tmp_file = self.get_temp_file_name()
+        with open(f"{tmp_file}.ckpt", "w") as f:
+            f.write("10,100\n")
+        CSVOutputHandler(tmp_file, self.headers).write(self.sample_pairs)
+        assert not os.path.exists(f"{tmp_file}.ckpt")
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+class TestColumnarOutputHandler(unittest.TestCase):
+    """Tests for `ParquetOutputHandler` and `ArrowOutputHandler` classes."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.temp_files = []
+        self.temp_file_folder = "files/tests/tmp"
+        self.headers = ["image1", "image2", "similarity", "line_num", "skipped"]
+        self.pairs = [FilePair(f"image{i}", "image", similarity=i / 10, line_num=i + 1, skipped=i == 3)
+                      for i in range(10)]
+        if not os.path.exists(self.temp_file_folder):
+            os.makedirs(self.temp_file_folder)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        for temp_file in self.temp_files:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def get_temp_file_name(self, extension):
+        tmp_file = os.path.join(self.temp_file_folder, f"output_{get_timestamp_str()}{extension}")
+        self.temp_files.append(tmp_file)
+        return tmp_file
+
+    def read(self, filename):
+        import pyarrow.ipc
+        import pyarrow.parquet
+        if filename.endswith(".parquet"):
+            return pyarrow.parquet.read_table(filename)
+        return pyarrow.ipc.open_file(filename).read_all()
+
+    def expected_rows(self, headers):
+        return [{field: pair.to_dict()[field] for field in headers} for pair in self.pairs]
+
+    def test_write_pairs(self):
+        for extension in [".parquet", ".arrow"]:
+            tmp_file = self.get_temp_file_name(extension)
+            handler = FileHandlerFactory().getOutputHandler(tmp_file, headers=self.headers, checkpoint=True)
+            handler.row_group_size = 4
+            handler.write(self.pairs)
+            table = self.read(tmp_file)
+            assert table.to_pylist() == self.expected_rows(self.headers)
+            assert str(table.schema.field("line_num").type) == "int64"
+            assert str(table.schema.field("skipped").type) == "bool"
+            assert handler.last_line_num == 10
+
+    def test_row_groups(self):
+        import pyarrow.parquet
+        tmp_file = self.get_temp_file_name(".parquet")
+        ParquetOutputHandler(tmp_file, self.headers, row_group_size=4).write(self.pairs)
+        assert pyarrow.parquet.ParquetFile(tmp_file).num_row_groups == 3
+
+    def test_write_table(self):
+        headers = ["image1", "image2", "similarity", "elapsed", "line_num", "skipped"]
+        for handler_class, extension in [(ParquetOutputHandler, ".parquet"), (ArrowOutputHandler, ".arrow")]:
+            tmp_file = self.get_temp_file_name(extension)
+            handler_class(tmp_file, [], row_group_size=3).write_table(PairTable.from_pairs(self.pairs))
+            assert self.read(tmp_file).to_pylist() == self.expected_rows(headers)
+
+    def test_default_headers(self):
+        tmp_file = self.get_temp_file_name(".arrow")
+        ArrowOutputHandler(tmp_file, []).write(self.pairs)
+        assert self.read(tmp_file).column_names == list(self.pairs[0].to_dict().keys())
+
+        empty_file = self.get_temp_file_name(".parquet")
+        ParquetOutputHandler(empty_file, []).write([])
+        assert self.read(empty_file).num_rows == 0
+
+    def test_existing_output(self):
+        tmp_file = self.get_temp_file_name(".parquet")
+        ParquetOutputHandler(tmp_file, self.headers).write(self.pairs)
+        with self.assertRaises(FileError):
+            ParquetOutputHandler(tmp_file, self.headers).write(self.pairs)
+        with self.assertRaises(FileError):
+            ParquetOutputHandler(tmp_file, self.headers).resume()
+        ParquetOutputHandler(tmp_file, self.headers).write(self.pairs[:2], overwrite=True)
+        assert self.read(tmp_file).num_rows == 2
+
+
 class TestFileHandlerFactory(unittest.TestCase):
     """Tests for `CSVInputHandler` class."""
 
@@ -121,11 +512,17 @@ class TestFileHandlerFactory(unittest.TestCase):
     def test_return_type(self):
         assert type(self.factory.getInputHandler("tests/files/dummy.csv")) == CSVInputHandler
         assert type(self.factory.getOutputHandler("tests/files/dummy.csv", headers=[])) == CSVOutputHandler
+        assert type(self.factory.getOutputHandler("tests/files/dummy.parquet", headers=[])) == ParquetOutputHandler
+        assert type(self.factory.getOutputHandler("tests/files/dummy.arrow", headers=[])) == ArrowOutputHandler
 
     def test_input_handler(self):
         input_handler = self.factory.getInputHandler("tests/files/dummy.csv")
         assert input_handler is not None
 
+    def test_input_handler_types(self):
+        assert type(self.factory.getInputHandler("tests/files/dummy.jsonl")) == JSONLInputHandler
+        assert type(self.factory.getInputHandler("tests/files/dummy.parquet")) == ParquetInputHandler
+
     def test_input_invalid_extension(self):
         with self.assertRaises(FileError):
             input_handler = self.factory.getInputHandler("tests/files/dummy.json")
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `hashing` module."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import imagehash
+import numpy as np
+from PIL import Image
+from image_compare import hashing
+from image_compare.models import FilePair
+from image_compare.exceptions import FileError, ArgumentError
+from image_compare.similarity import get_similarity_measurement
+
+
+# Reference implementations of the hash methods
+IMAGEHASH_FUNCTIONS = {"dhash": imagehash.dhash, "avghash": imagehash.average_hash, "phash": imagehash.phash,
+                       "whash": imagehash.whash}
+
+
+class TestHashHelpers(unittest.TestCase):
+    """Tests for hash packing functions."""
+
+    def test_pack_hash_and_hamming_distance(self):
+        with Image.open("files/tests/images/small/cat.png") as image1, \
+                Image.open("files/tests/images/small/cat-wm-big.png") as image2:
+            hash1 = imagehash.phash(image1, hash_size=16)
+            hash2 = imagehash.phash(image2, hash_size=16)
+        bits1 = hashing.pack_hash(hash1.hash)
+        bits2 = hashing.pack_hash(hash2.hash)
+        assert len(bits1) == 32
+        words1, words2 = hashing.unpack_words([bits1, bits2], hash_size=16)
+        assert words1.shape == (4,) and words1.dtype == np.uint64
+        assert hashing.hamming_distance(words1, words2) == hash1 - hash2
+        assert hashing.hamming_distance(words1, words1) == 0
+
+    def test_pack_words(self):
+        assert hashing.get_hash_words(8) == 1
+        assert hashing.get_hash_words(16) == 4
+        assert hashing.pack_words(np.ones((2, 64), dtype=bool)).shape == (2, 1)
+        # Hashes which are not a whole number of words are padded with zero bits
+        words = hashing.pack_words(np.ones((1, 16), dtype=bool))
+        assert words.shape == (1, 1) and hashing.hamming_distance(words, np.zeros(1, dtype=np.uint64)) == 16
+        assert (hashing.unpack_words([b"\xff\xff"], hash_size=4) == words).all()
+
+    def test_hamming_distances(self):
+        words1 = np.array([[0, 2 ** 64 - 1], [0xAAAA, 1]], dtype=np.uint64)
+        words2 = np.array([[0, 2 ** 64 - 1], [0x5555, 0]], dtype=np.uint64)
+        assert hashing.hamming_distances(words1, words2).tolist() == [0, 17]
+
+    def test_hamming_distances_without_bitwise_count(self):
+        words1 = np.array([[0, 2 ** 64 - 1], [0xAAAA, 1]], dtype=np.uint64)
+        words2 = np.array([[0, 2 ** 64 - 1], [0x5555, 0]], dtype=np.uint64)
+        with mock.patch.object(hashing, "HAS_BITWISE_COUNT", False):
+            assert hashing.hamming_distances(words1, words2).tolist() == [0, 17]
+
+    def test_identical_to_imagehash(self):
+        paths = sorted(os.path.join("files/images", name) for name in os.listdir("files/images"))
+        for path in paths + ["files/tests/images/0-2-grey.png", "files/tests/images/1-0-small-white.png"]:
+            with Image.open(path) as image:
+                for method, expected_function in IMAGEHASH_FUNCTIONS.items():
+                    for hash_size in [8, 16]:
+                        bits = hashing.get_hash_function(method)(image, hash_size=hash_size)
+                        expected = expected_function(image, hash_size=hash_size).hash
+                        assert (bits == expected).all(), f"{method} {hash_size} {path}"
+
+    def test_whash_invalid_hash_size(self):
+        with Image.open("files/tests/images/small/cat.png") as image:
+            with self.assertRaises(ValueError):
+                hashing.whash(image, hash_size=12)
+
+    def test_hash_image_missing_file(self):
+        assert hashing.hash_image("no_such_file_exists.png", "dhash") is None
+
+
+class TestBatchHashing(unittest.TestCase):
+    """Tests for `hash_batch` and `hash_images_batch` functions."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.images = ["files/tests/images/0-0-white.png", "files/tests/images/0-2-grey.png",
+                       "files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png"]
+
+    def test_identical_to_imagehash(self):
+        for method in hashing.BATCH_HASH_METHODS:
+            for hash_size in [8, 16]:
+                hashes = hashing.hash_images_batch(self.images, method, hash_size)
+                for path in self.images:
+                    with Image.open(path) as image:
+                        expected = hashing.pack_hash(IMAGEHASH_FUNCTIONS[method](image, hash_size=hash_size).hash)
+                        assert hashes[path] == (expected, image.size), f"{method} {hash_size} {path}"
+
+    def test_chunks(self):
+        expected = hashing.hash_images_batch(self.images, "phash")
+        for chunk_size in [1, 3]:
+            assert hashing.hash_images_batch(self.images, "phash", chunk_size=chunk_size) == expected
+
+    def test_missing_file(self):
+        hashes = hashing.hash_images_batch(["no_such_file_exists.png", self.images[0]], "dhash")
+        assert hashes["no_such_file_exists.png"] is None
+        assert hashes[self.images[0]] is not None
+
+    def test_unsupported_method(self):
+        with self.assertRaises(ValueError):
+            hashing.hash_batch(np.zeros((1, 16, 16), dtype=np.uint8), "whash")
+
+
+class TestTwoPhaseHashing(unittest.TestCase):
+    """Tests for `score_pairs_by_hash` function."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.images = ["files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png",
+                       "files/tests/images/small/cat-wm-small.png"]
+
+    def get_pairs(self):
+        pairs = [FilePair(image1, image2, line_num=i + 1)
+                 for i, (image1, image2) in enumerate((a, b) for a in self.images for b in self.images)]
+        pairs.append(FilePair("no_such_file_exists.png", self.images[0], line_num=len(pairs) + 1))
+        pairs.append(FilePair("files/tests/images/1-0-small-white.png", "files/tests/images/1-1-big-white.png",
+                              line_num=len(pairs) + 1))
+        pairs.append(FilePair("<NO_FILE_GIVEN>", self.images[0], line_num=len(pairs) + 1, skipped=True))
+        return pairs
+
+    def test_same_results_as_per_pair_methods(self):
+        for method_name in hashing.HASH_FUNCTIONS:
+            method = get_similarity_measurement(method_name)
+            expected = self.get_pairs()
+            for pair in expected:
+                try:
+                    if not pair.skipped:
+                        method(pair)
+                except (FileError, ArgumentError):
+                    pass
+
+            for workers in [1, 2]:
+                pairs = list(hashing.score_pairs_by_hash(self.get_pairs(), method_name, workers=workers,
+                                                         chunk_size=4))
+                assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+                assert [pair.skipped for pair in pairs] == [pair.skipped for pair in expected]
+                assert all(pair.elapsed > 0 for pair in pairs if not pair.skipped)
+
+    def test_no_valid_pairs(self):
+        pairs = [FilePair("no_such_file_exists.png", self.images[0])]
+        pairs = list(hashing.score_pairs_by_hash(pairs, "dhash"))
+        assert pairs[0].skipped is True
+
+    def test_unique_images_are_hashed_once(self):
+        hashes = hashing.hash_unique_images(self.images * 3, "dhash")
+        assert list(hashes) == self.images
+
+
+class TestHashStore(unittest.TestCase):
+    """Tests for `HashStore` class."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.temp_folder = tempfile.mkdtemp()
+        self.store_file = os.path.join(self.temp_folder, "hashes.db")
+        self.image = os.path.join(self.temp_folder, "cat.png")
+        shutil.copy("files/tests/images/small/cat.png", self.image)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        hashing.close_hash_store()
+        shutil.rmtree(self.temp_folder)
+
+    def test_store_and_lookup(self):
+        store = hashing.HashStore(self.store_file)
+        assert store.lookup(self.image, "dhash", 16) is None
+        store.store(self.image, "dhash", 16, b"\x01\x02", (10, 20))
+        assert store.lookup(self.image, "dhash", 16) == (b"\x01\x02", (10, 20))
+        # Different method and hash size are different entries
+        assert store.lookup(self.image, "dhash", 8) is None
+        assert store.lookup(self.image, "phash", 16) is None
+        assert store.stats() == {"hits": 1, "misses": 3}
+        store.close()
+
+    def test_store_is_persistent(self):
+        store = hashing.HashStore(self.store_file)
+        store.store(self.image, "dhash", 16, b"\x01\x02", (10, 20))
+        store.close()
+        store = hashing.HashStore(self.store_file)
+        assert store.lookup(self.image, "dhash", 16) == (b"\x01\x02", (10, 20))
+        store.close()
+
+    def test_store_many(self):
+        store = hashing.HashStore(self.store_file)
+        store.store_many([(self.image, "dhash", 16, b"\x01\x02", (10, 20)),
+                          (self.image, "phash", 8, b"\x03", (10, 20))])
+        assert store.lookup(self.image, "dhash", 16) == (b"\x01\x02", (10, 20))
+        assert store.lookup(self.image, "phash", 8) == (b"\x03", (10, 20))
+        # Nothing to store is not an error
+        store.store_many([])
+        store.close()
+
+    def test_changed_file_is_stale(self):
+        store = hashing.HashStore(self.store_file)
+        store.store(self.image, "dhash", 16, b"\x01\x02", (10, 20))
+        stat = os.stat(self.image)
+        os.utime(self.image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        assert store.lookup(self.image, "dhash", 16) is None
+        store.close()
+
+    def test_missing_file(self):
+        store = hashing.HashStore(self.store_file)
+        with self.assertRaises(FileNotFoundError):
+            store.lookup("no_such_file_exists.png", "dhash", 16)
+        store.close()
+
+    def test_similarity_with_hash_store(self):
+        pairs = [("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png"),
+                 ("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")]
+        for method_name in hashing.HASH_FUNCTIONS:
+            method = get_similarity_measurement(method_name)
+            expected = []
+            for image1, image2 in pairs:
+                pair = FilePair(image1, image2)
+                method(pair)
+                expected.append(pair.similarity)
+
+            store = hashing.open_hash_store(self.store_file)
+            # The first pass calculates the hashes, the second one reuses them
+            for _ in range(2):
+                for (image1, image2), similarity in zip(pairs, expected):
+                    pair = FilePair(image1, image2)
+                    method(pair)
+                    assert pair.similarity == similarity
+                    assert pair.elapsed > 0, "Elapsed should be bigger than zero"
+            assert store.stats() == {"hits": 4, "misses": 4}
+            hashing.close_hash_store()
+
+    def test_similarity_with_hash_store_errors(self):
+        hashing.open_hash_store(self.store_file)
+        dhash = get_similarity_measurement("dhash")
+        pair = FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png")
+        with self.assertRaises(FileError):
+            dhash(pair)
+        assert pair.skipped is True
+        pair = FilePair("files/tests/images/1-0-small-white.png", "files/tests/images/1-1-big-white.png")
+        with self.assertRaises(ArgumentError):
+            dhash(pair)
+        assert pair.skipped is True
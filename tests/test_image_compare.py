@@ -4,11 +4,20 @@
 """Tests for `image_compare` package."""
 
 
+import os
+import sys
+import tempfile
+import subprocess
 import unittest
+from unittest import mock
 from click.testing import CliRunner
 
 from image_compare import image_compare
 from image_compare import cli
+from image_compare.models import Config, ServeConfig
+from image_compare.scheduler import read_image_nbytes
+from image_compare.pixel_pack import PixelPack
+from image_compare.file_handlers import CSVInputHandler, ReferenceInputHandler
 
 
 class TestImage_compare(unittest.TestCase):
@@ -39,6 +48,12 @@ class TestImage_compare(unittest.TestCase):
         assert result.exit_code == 2, result.exit_code
         assert "Invalid value for \"--distance\": invalid choice:" in result.output
 
+    def test_cli_error_invalid_cascade_distance(self):
+        args = ["files/tests/dummy.csv", "output.csv", "--distance=dhash,NoSuchDistance"]
+        result = self.runner.invoke(cli.main, args)
+        assert result.exit_code == 2, result.exit_code
+        assert "Invalid value for \"--distance\": invalid choice: NoSuchDistance" in result.output
+
     def test_cli_error_invalid_log_level(self):
         args = ["files/tests/dummy.csv", "output.csv", "--log-level=NoSuchDistance"]
         result = self.runner.invoke(cli.main, args)
@@ -49,7 +64,305 @@ class TestImage_compare(unittest.TestCase):
         result = self.runner.invoke(cli.main, ["files/tests/dummy.csv", "files/tests/output.csv", "--overwrite-output"])
         assert result.exit_code == 0
 
+    def test_cli_with_workers(self):
+        args = ["files/tests/dummy.csv", "files/tests/output.csv", "--overwrite-output", "--workers=2"]
+        result = self.runner.invoke(cli.main, args)
+        assert result.exit_code == 0
+
+    def test_cli_error_invalid_workers(self):
+        args = ["files/tests/dummy.csv", "output.csv", "--workers=0"]
+        result = self.runner.invoke(cli.main, args)
+        assert result.exit_code == 2, result.exit_code
+
+    def test_cli_two_phase(self):
+        args = ["files/tests/dummy.csv", "files/tests/output.csv", "--overwrite-output", "--two-phase"]
+        result = self.runner.invoke(cli.main, args)
+        assert result.exit_code == 0
+
+    def test_main_writes_all_pairs_in_order(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            for two_phase in [False, True]:
+                output_file = os.path.join(temp_folder, "output.csv")
+                config = Config("files/product-cat-photos.csv", output_file, overwrite_output=True, quiet=True,
+                                workers=2, two_phase=two_phase)
+                assert image_compare.main(config) == 0
+                input_pairs = CSVInputHandler("files/product-cat-photos.csv").read()
+                output_pairs = CSVInputHandler(output_file).read()
+                assert [(pair.image1, pair.image2) for pair in output_pairs] == \
+                    [(pair.image1, pair.image2) for pair in input_pairs]
+
+    def test_main_stage_timings(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            output_file = os.path.join(temp_folder, "output.csv")
+            config = Config("files/product-cat-photos.csv", output_file, quiet=True, stage_timings=True)
+            with self.assertLogs(level="INFO") as logs:
+                assert image_compare.main(config) == 0
+            assert any("Stage times in ms" in line for line in logs.output)
+            with open(output_file) as f:
+                headers = f.readline().strip().replace('"', '').split(",")
+                rows = [line.split(",") for line in f.read().splitlines()]
+            assert headers == ["image1", "image2", "similarity", "elapsed", "decode_wall", "decode_cpu",
+                               "preprocess_wall", "preprocess_cpu", "compute_wall", "compute_cpu"]
+            assert all(len(row) == len(headers) for row in rows)
+            assert any(float(row[4]) > 0 for row in rows), "Decode time should be measured"
+
+    def test_main_threshold(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            input_file = os.path.join(temp_folder, "input.csv")
+            with open(input_file, "w") as f:
+                f.write("image1,image2\n"
+                        "files/tests/images/small/cat.png,files/tests/images/small/cat-wm-big.png\n"
+                        "files/tests/images/small/cat.png,files/tests/images/small/cat-wm-small.png\n"
+                        "files/tests/images/small/cat.png,no_such_file_exists.png\n")
+            for two_phase in [False, True]:
+                output_file = os.path.join(temp_folder, "output.csv")
+                config = Config(input_file, output_file, overwrite_output=True, quiet=True, two_phase=two_phase,
+                                threshold=0.037)
+                assert image_compare.main(config) == 0
+                with open(output_file) as f:
+                    headers = f.readline().strip().replace('"', '').split(",")
+                    rows = [line.split(",") for line in f.read().splitlines()]
+                assert headers == ["image1", "image2", "similarity", "elapsed", "match", "early_exit"]
+                assert [row[4] for row in rows] == ["False", "True", '""']
+                assert [row[5] for row in rows] == ["False", "False", '""']
+
+    def test_main_cascade(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            input_file = os.path.join(temp_folder, "input.csv")
+            with open(input_file, "w") as f:
+                f.write("image1,image2\n"
+                        "files/tests/images/small/cat.png,files/tests/images/small/cat-wm-big.png\n"
+                        "files/tests/images/0-0-white.png,files/tests/images/0-1-black.png\n"
+                        "files/tests/images/small/cat.png,no_such_file_exists.png\n")
+            output_file = os.path.join(temp_folder, "output.csv")
+            config = Config(input_file, output_file, quiet=True, distance="ssim,dhash", cascade_threshold=0.2)
+            assert image_compare.main(config) == 0
+            with open(output_file) as f:
+                headers = f.readline().strip().replace('"', '').split(",")
+                rows = [line.split(",") for line in f.read().splitlines()]
+            assert headers == ["image1", "image2", "similarity", "elapsed", "ssim_similarity", "dhash_similarity"]
+            # The white and black images are eliminated by ssim, dhash does not score them
+            assert [row[5] for row in rows] == ["0.039", "-1.0", "-1.0"]
+            assert [row[4] for row in rows] == ["0.014", "1.0", "-1.0"]
+            # The similarity column has the dhash similarity of every pair
+            assert [row[2] for row in rows] == ["0.039", "-1.0", "-1.0"]
+
+    def test_main_multiple_distances(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            input_file = os.path.join(temp_folder, "input.csv")
+            with open(input_file, "w") as f:
+                f.write("image1,image2\n"
+                        "files/tests/images/small/cat.png,files/tests/images/small/cat-wm-big.png\n"
+                        "files/tests/images/small/cat.png,files/tests/images/small/cat-wm-small.png\n")
+            columns = {}
+            for distance in ["dhash", "nrmse", "dhash,nrmse"]:
+                output_file = os.path.join(temp_folder, f"{distance}.csv")
+                config = Config(input_file, output_file, quiet=True, distance=distance)
+                assert image_compare.main(config) == 0
+                with open(output_file) as f:
+                    headers = f.readline().strip().replace('"', '').split(",")
+                    columns[distance] = list(zip(*[line.split(",") for line in f.read().splitlines()]))
+            assert headers == ["image1", "image2", "similarity", "elapsed", "dhash_similarity", "nrmse_similarity"]
+            assert columns["dhash,nrmse"][4] == columns["dhash"][2]
+            assert columns["dhash,nrmse"][5] == columns["nrmse"][2]
+
+    def test_main_schedule(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            input_file = os.path.join(temp_folder, "input.csv")
+            with open(input_file, "w") as f:
+                f.write("image1,image2\n"
+                        "files/tests/images/0-0-white.png,files/tests/images/0-1-black.png\n"
+                        "files/tests/images/0-2-grey.png,files/tests/images/1-1-big-white.png\n"
+                        "files/tests/images/small/cat.png,no_such_file_exists.png\n"
+                        "files/tests/images/0-1-black.png,files/tests/images/0-0-white.png\n")
+            outputs = []
+            for schedule in [False, True]:
+                output_file = os.path.join(temp_folder, f"output{schedule}.csv")
+                # Room for three of the white, black and grey images, the scheduled order decodes them once
+                config = Config(input_file, output_file, quiet=True, schedule=schedule,
+                                cache_size=3 * read_image_nbytes("files/tests/images/0-0-white.png"))
+                assert image_compare.main(config) == 0
+                with open(output_file) as f:
+                    outputs.append([line.split(",")[:3] for line in f.read().splitlines()])
+            # The output keeps the input order
+            assert outputs[0] == outputs[1]
+
+            # The results of the threshold mode and of the cascade are kept while the pairs wait for their turn
+            outputs = []
+            for schedule in [False, True]:
+                output_file = os.path.join(temp_folder, f"output-cascade{schedule}.csv")
+                config = Config(input_file, output_file, quiet=True, schedule=schedule, distance="dhash,nrmse",
+                                threshold=0.5, cache_size=3 * read_image_nbytes("files/tests/images/0-0-white.png"))
+                assert image_compare.main(config) == 0
+                with open(output_file) as f:
+                    # Without the elapsed time
+                    outputs.append([line.split(",")[:3] + line.split(",")[4:] for line in f.read().splitlines()])
+            assert outputs[0] == outputs[1]
+            assert outputs[1][0][-2:] == ['"match"', '"early_exit"']
+            assert outputs[1][1][-2:] == ["False", "True"]
+
+            # Every worker has its own cache, the estimate of a single cache is not reported
+            config = Config(input_file, os.path.join(temp_folder, "output.csv"), quiet=True, schedule=True, workers=2)
+            with self.assertLogs(level="INFO") as logs:
+                assert image_compare.main(config) == 0
+            assert not any("estimated decodes input order" in line for line in logs.output)
+            assert any("only reported with a single worker" in line for line in logs.output)
+
+    def test_main_pair_with(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            output_file = os.path.join(temp_folder, "output.csv")
+            result = self.runner.invoke(cli.main, ["files/tests/images/small", output_file, "--quiet", "--workers=1",
+                                                   "--pair-with=files/tests/images/small"])
+            assert result.exit_code == 0, result.output
+            with open(output_file) as f:
+                rows = [line.split(",")[:3] for line in f.read().splitlines()[1:]]
+            assert [row[0] for row in rows] == ['"files/tests/images/small/cat-wm-big.png"',
+                                                '"files/tests/images/small/cat-wm-small.png"',
+                                                '"files/tests/images/small/cat.png"']
+            assert [row[2] for row in rows] == ["0.0"] * 3
+
+            result = self.runner.invoke(cli.main, ["files/tests/images/small/cat-*.png", output_file, "--quiet",
+                                                   "--overwrite-output", "--workers=1",
+                                                   "--reference=files/tests/images/small/cat.png"])
+            assert result.exit_code == 0, result.output
+            with open(output_file) as f:
+                assert len(f.read().splitlines()) == 1 + 2
+
+    def test_main_image_source_is_not_counted(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            config = Config("files/tests/images", os.path.join(temp_folder, "output.csv"), quiet=True,
+                            reference="files/tests/images/0-0-white.png")
+            # Scoring starts while the folder is scanned, the progress has no total
+            with mock.patch.object(ReferenceInputHandler, "count", side_effect=AssertionError), \
+                    self.assertLogs(level="INFO") as logs:
+                assert image_compare.main(config) == 0
+            assert any("Processed: 001 - " in line for line in logs.output)
+
+            config = Config(os.path.join(temp_folder, "no_such_folder"), os.path.join(temp_folder, "output.csv"),
+                            quiet=True, overwrite_output=True, reference="files/tests/images/0-0-white.png")
+            assert image_compare.main(config) == image_compare.ExitCodes.FILE_ERROR
+
+    def test_main_error_pair_with_and_reference(self):
+        config = Config("files/tests/images", "output.csv", quiet=True, pair_with="files/images",
+                        reference="files/images/cat.png")
+        assert image_compare.main(config) == image_compare.ExitCodes.ARGUMENT_ERROR
+
+    def test_cli_error_repeated_distance(self):
+        args = ["files/tests/dummy.csv", "output.csv", "--distance=dhash,dhash"]
+        result = self.runner.invoke(cli.main, args)
+        assert result.exit_code == 2, result.exit_code
+        assert "Invalid value for \"--distance\"" in result.output
+
+    def test_pack_and_main_with_pixel_pack(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            pack_file = os.path.join(temp_folder, "images.pack")
+            result = self.runner.invoke(cli.pack, ["--quiet", "--workers=1", "files/tests/input-wgb.csv", pack_file])
+            assert result.exit_code == 0, result.output
+            assert os.path.isfile(pack_file)
+
+            outputs = []
+            for pixel_pack in [None, pack_file]:
+                output_file = os.path.join(temp_folder, f"output{len(outputs)}.csv")
+                config = Config("files/tests/input-wgb.csv", output_file, quiet=True, distance="nrmse",
+                                pixel_pack=pixel_pack)
+                assert image_compare.main(config) == 0
+                with open(output_file) as f:
+                    outputs.append([line.split(",")[:3] for line in f])
+            assert outputs[0] == outputs[1]
+
+    def test_pack_of_jsonl_input(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            input_file = os.path.join(temp_folder, "input.jsonl")
+            with open(input_file, "w") as f:
+                for image in ["0-0-white", "0-1-black", "0-2-grey"]:
+                    f.write(f'{{"image1": "files/tests/images/{image}.png", '
+                            f'"image2": "files/tests/images/0-0-white.png"}}\n')
+            pack_file = os.path.join(temp_folder, "images.pack")
+            result = self.runner.invoke(cli.pack, ["--workers=2", input_file, pack_file])
+            assert result.exit_code == 0, result.output
+            assert len(PixelPack(pack_file)) == 3
+
+    def test_main_missing_pixel_pack(self):
+        config = Config("files/tests/input-wgb.csv", "files/tests/tmp/output.csv", quiet=True,
+                        pixel_pack="no_such_file_exists.pack")
+        assert image_compare.main(config) == image_compare.ExitCodes.FILE_ERROR
+
+    def test_main_resume(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            output_file = os.path.join(temp_folder, "output.csv")
+            config = Config("files/product-cat-photos.csv", output_file, overwrite_output=True, quiet=True)
+            assert image_compare.main(config) == 0
+            assert not os.path.exists(f"{output_file}.ckpt"), "Checkpoint of a complete run should be removed"
+            with open(output_file) as f:
+                expected = f.read().splitlines()
+
+            # Keep 10 rows and a partial one, as if the run was interrupted
+            with open(output_file, "w") as f:
+                f.write("\n".join(expected[:11]) + "\n" + expected[11][:20])
+            config = Config("files/product-cat-photos.csv", output_file, quiet=True, resume=True)
+            assert image_compare.main(config) == 0
+            with open(output_file) as f:
+                lines = f.read().splitlines()
+            assert len(lines) == len(expected)
+            assert [line.split(",")[:3] for line in lines] == [line.split(",")[:3] for line in expected]
+
+            # The output of a single method can not be continued with a cascade
+            config = Config("files/product-cat-photos.csv", output_file, quiet=True, resume=True,
+                            distance="dhash,ssim")
+            assert image_compare.main(config) == image_compare.ExitCodes.FILE_ERROR
+
+    def test_error_existing_output(self):
+        config = Config("files/tests/dummy.csv", "files/tests/dummy.csv", quiet=True)
+        assert image_compare.main(config) == image_compare.ExitCodes.FILE_ERROR
+
+    def test_error_two_phase_with_ssim(self):
+        config = Config("files/tests/dummy.csv", "files/tests/output.csv", overwrite_output=True, quiet=True,
+                        distance="ssim", two_phase=True)
+        assert image_compare.main(config) == image_compare.ExitCodes.ARGUMENT_ERROR
+
+    def test_cli_dedupe(self):
+        args = ["files/tests/images", "files/tests/output.csv", "--overwrite-output", "--threshold=0"]
+        result = self.runner.invoke(cli.dedupe, args)
+        assert result.exit_code == 0
+        with open("files/tests/output.csv") as output:
+            lines = output.read().splitlines()
+        # Solid white and grey images have the same phash, there are 4 of them
+        assert lines[0] == '"image1","image2","similarity"'
+        assert len(lines) == 1 + 6
+
+    def test_cli_dedupe_error_no_args(self):
+        result = self.runner.invoke(cli.dedupe, [])
+        assert result.exit_code == 2, result.exit_code
+
+    def test_cli_dedupe_error_whash_hash_size(self):
+        # The hash size is checked even when it is given before the distance
+        for args in (["--distance=whash", "--hash-size=12"], ["--hash-size=12", "--distance=whash"]):
+            result = self.runner.invoke(cli.dedupe, ["files/tests/images", "output.csv"] + args)
+            assert result.exit_code == 2, result.output
+            assert "whash needs a power of 2, not 12" in result.output
+        result = self.runner.invoke(cli.dedupe, ["files/tests/images", "files/tests/output.csv", "--overwrite-output",
+                                                 "--distance=dhash", "--hash-size=12"])
+        assert result.exit_code == 0, result.output
+
     def test_cli_help(self):
         help_result = self.runner.invoke(cli.main, ['--help'])
         assert help_result.exit_code == 0
         assert "--help" in help_result.output and "Show this message and exit." in help_result.output
+
+    def test_cli_imports_are_lazy(self):
+        # numpy, PIL and the scientific libraries are imported when a method which needs them runs, not at startup
+        script = ("import sys; before = set(sys.modules); import image_compare.cli; "
+                  "print(' '.join(sorted(set(sys.modules) - before)))")
+        imported = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, universal_newlines=True,
+                                  check=True).stdout.split()
+        for module in ("numpy", "PIL", "imagehash", "scipy.fftpack", "skimage.io", "skimage.measure"):
+            assert module not in imported, module
+
+    def test_cli_serve_help(self):
+        help_result = self.runner.invoke(cli.serve, ['--help'])
+        assert help_result.exit_code == 0
+        assert "--socket" in help_result.output and "POST /compare" in help_result.output
+
+    def test_serve_error_missing_pixel_pack(self):
+        config = ServeConfig(port=0, quiet=True, pixel_pack="no_such_file_exists.pack")
+        assert image_compare.serve(config) == image_compare.ExitCodes.FILE_ERROR
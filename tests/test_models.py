@@ -25,6 +25,83 @@ class TestModels(unittest.TestCase):
         assert fp.elapsed == -1.0
         assert fp.line_num == -1
         assert fp.skipped is False
+        assert fp.timings is None
+
+    def test_file_pair_has_no_dict(self):
+        fp = models.FilePair("aa.png", "bb.png")
+        assert not hasattr(fp, "__dict__")
+        with self.assertRaises(AttributeError):
+            fp.unknown = 1
+
+    def test_pair_table(self):
+        pairs = [models.FilePair(f"a{i % 3}.png", f"b{i % 2}.png", similarity=i / 10, elapsed=0.5, line_num=i + 1,
+                                 skipped=i == 4) for i in range(5)]
+        table = models.PairTable(capacity=2)
+        table.extend(pairs)
+        assert len(table) == 5
+        assert table.paths == ["a0.png", "b0.png", "a1.png", "b1.png", "a2.png"], "Paths should be interned"
+        assert [repr(pair) for pair in table] == [repr(pair) for pair in pairs]
+        assert repr(table[-1]) == repr(pairs[-1])
+        with self.assertRaises(IndexError):
+            table[5]
+
+        table[1] = models.FilePair("a1.png", "b1.png", similarity=0.75, line_num=2)
+        assert table[1].similarity == 0.75
+        assert table.column("similarity", 0, 2) == [0.0, 0.75]
+        assert table.column("image2", 3) == ["b1.png", "b0.png"]
+        assert table.column("compute_wall", 0, 2) == [-1.0, -1.0]
+        with self.assertRaises(KeyError):
+            table.column("unknown")
+        assert table.nbytes() == 5 * (4 + 4 + 8 + 8 + 8 + 1)
+
+    def test_pair_table_results(self):
+        table = models.PairTable.from_pairs(models.FilePair("aa.png", f"b{i}.png", line_num=i + 1) for i in range(3))
+        timings = {stage: (0.5, 0.25) for stage in models.STAGES}
+        table[1] = models.FilePair("aa.png", "b1.png", similarity=0.5, line_num=2, match=True, early_exit=False,
+                                   similarities={"dhash": 0.25, "ssim": 0.5}, timings=timings)
+        pair = table[1]
+        assert (pair.match, pair.early_exit, pair.similarities, pair.timings) == \
+            (True, False, {"dhash": 0.25, "ssim": 0.5}, timings)
+        # Pairs without results are returned as they are stored
+        pair = table[2]
+        assert (pair.match, pair.early_exit, pair.timings) == (None, None, None)
+        assert table.column("match") == [None, True, None]
+        assert table.column("compute_wall") == [-1.0, 0.5, -1.0]
+        assert table.column("dhash_similarity") == [-1.0, 0.25, -1.0]
+        # The result columns grow with the table
+        table.append(models.FilePair("aa.png", "b3.png", line_num=4))
+        assert table.column("match") == [None, True, None, None]
+
+    def test_pair_table_find(self):
+        table = models.PairTable.from_pairs(models.FilePair("aa.png", "bb.png", line_num=i) for i in [2, 3, 7])
+        assert [table.find(line_num) for line_num in [2, 3, 7]] == [0, 1, 2]
+        for line_num in [1, 5, 8]:
+            with self.assertRaises(KeyError):
+                table.find(line_num)
+
+    def test_pair_table_from_pairs(self):
+        table = models.PairTable.from_pairs(models.FilePair("aa.png", "bb.png", line_num=i) for i in range(3000))
+        assert len(table) == 3000
+        assert table[2999].line_num == 2999
+        assert len(table.paths) == 2
+
+    def test_file_pair_to_dict(self):
+        fp = models.FilePair("aa.png", "bb.png", timings={"decode": (0.5, 0.25)})
+        fields = fp.to_dict()
+        # The default fields are the ones of a pair without the threshold and stage timing features
+        assert list(fields) == ["image1", "image2", "similarity", "elapsed", "line_num", "skipped"]
+        fields = fp.to_dict(["image1"] + models.STAGE_FIELDS)
+        assert [fields[field] for field in models.STAGE_FIELDS] == [0.5, 0.25, -1.0, -1.0, -1.0, -1.0]
+        assert models.FilePair("aa.png", "bb.png", match=True).to_dict()["match"] is True
+        with self.assertRaises(KeyError):
+            fp.to_dict(["timings"])
+
+    def test_file_pair_to_dict_similarities(self):
+        fp = models.FilePair("aa.png", "bb.png", similarity=0.5, similarities={"dhash": 0.1, "ssim": 0.5})
+        fields = fp.to_dict()
+        assert "similarities" not in fields
+        assert list(fields)[-2:] == ["dhash_similarity", "ssim_similarity"]
+        assert fields["dhash_similarity"] == 0.1
 
     def test_config_initial_values(self):
         config = models.Config("input.csv", "output.csv")
@@ -35,3 +112,42 @@ class TestModels(unittest.TestCase):
         assert config.distance == "dhash"
         assert config.log_level == "INFO"
         assert config.log_filename == "image_compare.log"
+        assert config.workers == 1
+        assert config.cache_size == 256 * 1024 * 1024
+        assert config.hash_cache is None
+        assert config.two_phase is False
+        assert config.resume is False
+        assert config.max_side is None
+        assert config.stage_timings is False
+        assert config.prefetch == 0
+        assert config.pixel_pack is None
+        assert config.threshold is None
+        assert config.cascade_threshold is None
+        assert config.schedule is False
+        assert config.pair_with is None
+        assert config.reference is None
+
+    def test_dedupe_config_initial_values(self):
+        config = models.DedupeConfig("images", "output.csv")
+        assert config.input_file == "images"
+        assert config.output_file == "output.csv"
+        assert config.distance == "phash"
+        assert config.threshold == 0.1
+        assert config.hash_size == 16
+        assert config.workers == 1
+
+    def test_pack_config_initial_values(self):
+        config = models.PackConfig("images", "images.pack")
+        assert config.input_file == "images"
+        assert config.output_file == "images.pack"
+        assert config.overwrite_output is False
+        assert config.workers == 1
+
+    def test_serve_config_initial_values(self):
+        config = models.ServeConfig()
+        assert config.host == "127.0.0.1"
+        assert config.port == 8765
+        assert config.socket_path is None
+        assert config.workers == 1
+        assert config.cache_size == 256 * 1024 * 1024
+        assert config.threshold is None
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `parallel` module."""
+import os
+import tempfile
+import unittest
+from image_compare.models import FilePair
+from image_compare.parallel import score_pairs, calculate_similarity, get_default_worker_count, ScoringPool
+
+
+def get_sample_pairs():
+    """helper function"""
+    return [FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png", line_num=1),
+            FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png", line_num=2),
+            FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png", line_num=3),
+            FilePair("<NO_FILE_GIVEN>", "files/tests/images/0-0-white.png", line_num=4, skipped=True),
+            FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-0-white.png", line_num=5)]
+
+
+class TestParallel(unittest.TestCase):
+    """Tests for `score_pairs` function."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_default_worker_count(self):
+        assert get_default_worker_count() >= 1
+
+    def test_calculate_similarity_missing_file(self):
+        pair = calculate_similarity(FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png"),
+                                    "dhash", 1)
+        assert pair.skipped is True
+        assert pair.similarity == -1.0
+
+    def test_sequential(self):
+        pairs = list(score_pairs(get_sample_pairs(), "dhash", workers=1, num_of_pairs=5))
+        assert [pair.line_num for pair in pairs] == [1, 2, 3, 4, 5]
+        assert [pair.skipped for pair in pairs] == [False, True, False, True, False]
+
+    def test_parallel_keeps_input_order_and_results(self):
+        expected = list(score_pairs(get_sample_pairs(), "dhash", workers=1, num_of_pairs=5))
+        pairs = list(score_pairs(get_sample_pairs(), "dhash", workers=2, num_of_pairs=5))
+        assert [pair.line_num for pair in pairs] == [pair.line_num for pair in expected]
+        assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+        assert [pair.skipped for pair in pairs] == [pair.skipped for pair in expected]
+        assert all(pair.elapsed > 0 for pair in pairs if not pair.skipped), "Elapsed should be bigger than zero"
+
+    def test_parallel_with_hash_cache(self):
+        expected = list(score_pairs(get_sample_pairs(), "dhash", workers=1, num_of_pairs=5))
+        with tempfile.TemporaryDirectory() as temp_folder:
+            hash_cache = os.path.join(temp_folder, "hashes.db")
+            for workers in [2, 1]:
+                cache_stats = {}
+                pairs = list(score_pairs(get_sample_pairs(), "dhash", workers=workers, num_of_pairs=5,
+                                         hash_cache=hash_cache, cache_stats=cache_stats))
+                assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+            # Second run reuses all hashes calculated by the workers of the first run
+            assert cache_stats["hash"]["misses"] == 0
+            assert cache_stats["hash"]["hits"] > 0
+
+    def test_parallel_with_max_side(self):
+        expected = list(score_pairs(get_sample_pairs(), "ssim", workers=1, num_of_pairs=5, max_side=64))
+        pairs = list(score_pairs(get_sample_pairs(), "ssim", workers=2, num_of_pairs=5, max_side=64))
+        assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+
+    def test_prefetch(self):
+        expected = list(score_pairs(get_sample_pairs(), "ssim", workers=1, num_of_pairs=5))
+        for workers in [1, 2]:
+            pairs = list(score_pairs(get_sample_pairs(), "ssim", workers=workers, num_of_pairs=5, prefetch=2))
+            assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+            assert [pair.skipped for pair in pairs] == [pair.skipped for pair in expected]
+
+    def test_threshold(self):
+        expected = list(score_pairs(get_sample_pairs(), "nrmse", workers=1, num_of_pairs=5))
+        for workers in [1, 2]:
+            cache_stats = {}
+            pairs = list(score_pairs(get_sample_pairs(), "nrmse", workers=workers, num_of_pairs=5, threshold=0.05,
+                                     cache_stats=cache_stats))
+            assert [pair.match for pair in pairs] == [False, None, False, None, True]
+            # Only the pair of the same image is close enough to the threshold to be calculated at full cost
+            assert pairs[4].similarity == expected[4].similarity
+            assert cache_stats["threshold"] == {"early_exits": 2, "full": 1}
+
+    def test_scoring_pool(self):
+        expected = list(score_pairs(get_sample_pairs(), "dhash", workers=1, num_of_pairs=5))
+        for workers in [1, 2]:
+            with ScoringPool(workers=workers, cache_size=64 * 1024 * 1024) as pool:
+                for _ in range(2):
+                    pairs = pool.score(get_sample_pairs(), "dhash")
+                    assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+                    assert [pair.skipped for pair in pairs] == [pair.skipped for pair in expected]
+                # The images of the second call are in the caches of the workers
+                assert pool.stats()["image"]["hits"] > 0
+
+    def test_cascade(self):
+        expected = list(score_pairs(get_sample_pairs(), "ssim", workers=1, num_of_pairs=5))
+        for workers in [1, 2]:
+            pairs = list(score_pairs(get_sample_pairs(), ["dhash", "ssim"], workers=workers, num_of_pairs=5,
+                                     cascade_threshold=0.2))
+            assert [pair.line_num for pair in pairs] == [1, 2, 3, 4, 5]
+            # Every pair has a similarity of every method, including the skipped ones
+            assert [list(pair.similarities) for pair in pairs] == [["dhash", "ssim"]] * 5
+            assert [pair.similarities["ssim"] for pair in pairs] == [pair.similarity for pair in expected]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `pixel_pack` module."""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from skimage import io
+from image_compare import pixel_pack
+from image_compare.models import FilePair
+from image_compare.pixel_pack import PixelPack, build_pixel_pack, get_index_filename
+from image_compare.similarity import get_similarity_measurement
+
+
+class TestPixelPack(unittest.TestCase):
+    """Tests for `PixelPack` class."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.temp_folder = tempfile.mkdtemp()
+        self.pack_file = os.path.join(self.temp_folder, "images.pack")
+        self.images = ["files/tests/images/0-0-white.png", "files/tests/images/small/cat.png",
+                       "files/tests/images/small/cat-wm-big.png"]
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        pixel_pack.close_pixel_pack()
+        shutil.rmtree(self.temp_folder)
+
+    def test_build_and_load(self):
+        assert build_pixel_pack(self.images + ["no_such_file_exists.png", self.images[0]], self.pack_file) == 3
+        assert os.path.isfile(get_index_filename(self.pack_file))
+        pack = PixelPack(self.pack_file)
+        assert len(pack) == 3
+        for path in self.images:
+            image = pack.load(path)
+            assert np.array_equal(image, io.imread(path))
+            assert image.flags.writeable is False
+        # Paths are matched by their absolute path
+        assert pack.load(os.path.abspath(self.images[0])) is not None
+        assert pack.stats() == {"hits": 4, "misses": 0}
+
+    def test_build_with_workers(self):
+        assert build_pixel_pack(self.images, self.pack_file, workers=2) == 3
+        pack = PixelPack(self.pack_file)
+        assert np.array_equal(pack.load(self.images[2]), io.imread(self.images[2]))
+
+    def test_changed_and_missing_files(self):
+        image = os.path.join(self.temp_folder, "white.png")
+        shutil.copy(self.images[0], image)
+        build_pixel_pack([image], self.pack_file)
+        pack = PixelPack(self.pack_file)
+        assert pack.load(self.images[1]) is None, "Images which are not packed should not be served"
+        os.utime(image, ns=(0, 0))
+        assert pack.load(image) is None, "Changed images should not be served"
+        assert pack.stats() == {"hits": 0, "misses": 2}
+        with self.assertRaises(FileNotFoundError):
+            pack.load("no_such_file_exists.png")
+
+    def test_empty_pack(self):
+        assert build_pixel_pack([], self.pack_file) == 0
+        assert PixelPack(self.pack_file).load(self.images[0]) is None
+
+    def test_similarity_with_pack(self):
+        pair = FilePair(self.images[1], self.images[2])
+        get_similarity_measurement("ssim")(pair)
+        build_pixel_pack(self.images, self.pack_file)
+        pack = pixel_pack.open_pixel_pack(self.pack_file)
+        packed_pair = FilePair(self.images[1], self.images[2])
+        get_similarity_measurement("ssim")(packed_pair)
+        assert packed_pair.similarity == pair.similarity
+        assert pack.stats()["hits"] == 2
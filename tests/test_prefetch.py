@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `prefetch` module."""
+import unittest
+from unittest import mock
+from image_compare.models import FilePair
+from image_compare import prefetch
+from image_compare.prefetch import prefetch_pairs, read_file
+
+
+def get_sample_pairs():
+    """helper function"""
+    return [FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png", line_num=1),
+            FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png", line_num=2),
+            FilePair("<NO_FILE_GIVEN>", "files/tests/images/0-0-white.png", line_num=3, skipped=True),
+            FilePair("files/tests/images/0-2-grey.png", "files/tests/images/0-2-grey.png", line_num=4)]
+
+
+class TestPrefetch(unittest.TestCase):
+    """Tests for `prefetch_pairs` function."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_read_file(self):
+        with open("files/tests/images/0-0-white.png", "rb") as f:
+            assert read_file("files/tests/images/0-0-white.png") == f.read()
+        assert read_file("no_such_file_exists.png") is None
+
+    def test_keeps_order_and_reads_sources(self):
+        items = list(prefetch_pairs(get_sample_pairs(), depth=2))
+        assert [pair.line_num for pair, _ in items] == [1, 2, 3, 4]
+        assert sorted(items[0][1]) == ["files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png"]
+        assert items[0][1]["files/tests/images/0-0-white.png"] == read_file("files/tests/images/0-0-white.png")
+        assert items[1][1]["no_such_file_exists.png"] is None
+        assert items[2][1] == {}, "Skipped pairs should not be read"
+        assert list(items[3][1]) == ["files/tests/images/0-2-grey.png"]
+
+    def test_shared_files_are_read_once(self):
+        read_paths = []
+
+        def read_and_record(path):
+            read_paths.append(path)
+            return b"content"
+
+        with mock.patch.object(prefetch, "read_file", read_and_record):
+            items = list(prefetch_pairs(get_sample_pairs(), depth=2, threads=1))
+        assert len(items) == 4
+        # The white image of the first two pairs is read once, the grey image of the last pair once
+        assert len(read_paths) == 4
+
+    def test_memory_budget(self):
+        items = prefetch_pairs(get_sample_pairs(), depth=10, max_bytes=0)
+        assert [pair.line_num for pair, _ in items] == [1, 2, 3, 4]
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `scheduler` module."""
+import unittest
+from image_compare.models import FilePair, PairTable
+from image_compare.scheduler import read_image_nbytes, order_pairs, count_decodes, schedule_pairs, restore_order
+
+
+def get_sample_pairs():
+    """helper function, the images of the first pair come back at the end"""
+    return [FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png", line_num=1),
+            FilePair("files/tests/images/0-2-grey.png", "files/tests/images/1-0-small-white.png", line_num=2),
+            FilePair("<NO_FILE_GIVEN>", "files/tests/images/0-0-white.png", line_num=3, skipped=True),
+            FilePair("files/tests/images/1-1-big-white.png", "files/tests/images/small/cat.png", line_num=4),
+            FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-2-grey.png", line_num=5),
+            FilePair("files/tests/images/0-1-black.png", "files/tests/images/0-0-white.png", line_num=6)]
+
+
+class TestScheduler(unittest.TestCase):
+    """Tests for `schedule_pairs` and `restore_order` functions."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_read_image_nbytes(self):
+        assert read_image_nbytes("files/tests/images/small/cat.png") > 0
+        assert read_image_nbytes("no_such_file_exists.png") is None
+
+    def test_order_pairs(self):
+        pairs = order_pairs(get_sample_pairs())
+        assert sorted(pair.line_num for pair in pairs) == [1, 2, 3, 4, 5, 6]
+        # Skipped pairs first, then every pair of the white image, then the pairs of its partners
+        assert [pair.line_num for pair in pairs] == [3, 1, 5, 6, 2, 4]
+
+    def test_count_decodes(self):
+        pairs = get_sample_pairs()
+        image_nbytes = {path: 1 for pair in pairs for path in (pair.image1, pair.image2)}
+        assert count_decodes(pairs, image_nbytes, max_bytes=100) == 6
+        assert count_decodes(pairs, image_nbytes, max_bytes=0) == 10
+        # The white and the black images are evicted before the last pair
+        assert count_decodes(pairs, image_nbytes, max_bytes=3) == 9
+        assert count_decodes(order_pairs(pairs), image_nbytes, max_bytes=3) == 6
+
+    def test_schedule_pairs(self):
+        # Room for three of the white, black and grey images
+        max_bytes = 3 * read_image_nbytes("files/tests/images/0-0-white.png")
+        pairs, stats = schedule_pairs(get_sample_pairs(), max_bytes=max_bytes)
+        assert stats == {"input": 9, "scheduled": 6}
+        assert [pair.line_num for pair in pairs] == [3, 1, 5, 6, 2, 4]
+
+    def test_schedule_pair_table(self):
+        max_bytes = 3 * read_image_nbytes("files/tests/images/0-0-white.png")
+        pairs, stats = schedule_pairs(PairTable.from_pairs(get_sample_pairs()), max_bytes=max_bytes)
+        assert stats == {"input": 9, "scheduled": 6}
+        assert [pair.line_num for pair in pairs] == [3, 1, 5, 6, 2, 4]
+
+    def test_schedule_pairs_keeps_the_input_order_if_it_is_not_worse(self):
+        pairs, stats = schedule_pairs(get_sample_pairs(), max_bytes=2 ** 30)
+        assert stats["scheduled"] == stats["input"] == 6
+        assert [pair.line_num for pair in pairs] == [1, 2, 3, 4, 5, 6]
+
+    def test_restore_order(self):
+        table = PairTable.from_pairs(get_sample_pairs())
+        pairs, _ = schedule_pairs(table, max_bytes=0)
+        scored = []
+        for pair in pairs:
+            pair.similarity = pair.line_num / 10
+            pair.match = pair.line_num % 2 == 0
+            scored.append(pair)
+        restored = list(restore_order(scored, table))
+        assert [pair.line_num for pair in restored] == [1, 2, 3, 4, 5, 6]
+        assert [(pair.similarity, pair.match) for pair in restored] == [(i / 10, i % 2 == 0) for i in range(1, 7)]
+        assert list(restore_order([], PairTable())) == []
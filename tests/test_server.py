@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `server` module."""
+import os
+import json
+import socket
+import tempfile
+import threading
+import unittest
+import http.client
+from image_compare.models import FilePair
+from image_compare.parallel import ScoringPool
+from image_compare.similarity import get_similarity_measurement
+from image_compare.server import create_server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """helper class, HTTP connection over a Unix socket"""
+
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class TestServer(unittest.TestCase):
+    """Tests for the comparison service."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.pool = ScoringPool(workers=1)
+        self.server = create_server(self.pool, port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.pool.close()
+
+    def request(self, method, path, body=None, connection=None):
+        """helper function, returns the status and the JSON body of the response"""
+        connection = connection or http.client.HTTPConnection(*self.server.server_address)
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_distances(self):
+        status, body = self.request("GET", "/distances")
+        assert status == 200
+        assert sorted(body["distances"]) == ["avghash", "dhash", "nrmse", "phash", "ssim", "whash"]
+
+    def test_compare(self):
+        expected = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png")
+        get_similarity_measurement("ssim")(expected)
+        status, body = self.request("POST", "/compare", {"image1": expected.image1, "image2": expected.image2,
+                                                         "distance": "ssim"})
+        assert status == 200
+        assert body["similarity"] == expected.similarity
+        assert body["skipped"] is False
+
+    def test_compare_batch_keeps_the_caches_warm(self):
+        pairs = [{"image1": "files/tests/images/small/cat.png", "image2": "files/tests/images/small/cat-wm-big.png"},
+                 {"image1": "no_such_file_exists.png", "image2": "files/tests/images/0-0-white.png"}]
+        for _ in range(2):
+            status, body = self.request("POST", "/compare/batch", {"pairs": pairs, "distance": "dhash,avghash"})
+            assert status == 200
+            assert [pair["line_num"] for pair in body["pairs"]] == [1, 2]
+            assert [pair["skipped"] for pair in body["pairs"]] == [False, True]
+            assert body["pairs"][0]["similarity"] == body["pairs"][0]["avghash_similarity"] >= 0
+            assert body["pairs"][0]["dhash_similarity"] >= 0
+        _, body = self.request("GET", "/stats")
+        # The second request is served from the decoded image cache
+        assert body["stats"]["image"]["hits"] >= 2
+
+    def test_invalid_requests(self):
+        for path, body in [("/compare", {"image1": "a.png"}),
+                           ("/compare", {"image1": "a.png", "image2": "b.png", "distance": "NoSuchDistance"}),
+                           ("/compare", {"image1": "a.png", "image2": "b.png", "cascade_threshold": "high"}),
+                           ("/compare/batch", {"pairs": "a.png"}),
+                           ("/compare/batch", {"pairs": ["a.png"]}),
+                           ("/compare", [])]:
+            status, response = self.request("POST", path, body)
+            assert status == 400, (path, body)
+            assert "error" in response
+
+        assert self.request("GET", "/no_such_path")[0] == 404
+        assert self.request("POST", "/no_such_path", {})[0] == 404
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            socket_path = os.path.join(temp_folder, "image_compare.sock")
+            server = create_server(self.pool, socket_path=socket_path)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                status, body = self.request("GET", "/distances", connection=UnixHTTPConnection(socket_path))
+            finally:
+                server.shutdown()
+                thread.join()
+                server.server_close()
+            assert status == 200
+            assert "ssim" in body["distances"]
@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 
 """Tests for `similarity` module."""
+import os
+import tempfile
 import unittest
+from PIL import Image
 from image_compare.models import FilePair
 from image_compare.exceptions import FileError, ArgumentError
-from image_compare.similarity import get_similarity_measurement
+from image_compare.cache import image_cache, DEFAULT_CACHE_SIZE
+from image_compare import hashing
+from image_compare.similarity import get_similarity_measurement, set_max_side, get_working_size, open_downscaled, \
+    compare_batch, set_threshold, threshold_stats, split_distances, calculate_similarities
 
 class TestSimilarity(unittest.TestCase):
     def setUp(self):
@@ -27,6 +33,40 @@ class TestSimilarity(unittest.TestCase):
             method = get_similarity_measurement("")
 
 
+class TestCompareBatch(unittest.TestCase):
+    """Tests for `compare_batch` function."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.pairs = [("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png"),
+                      ("files/tests/images/0-0-white.png", "files/tests/images/0-2-grey.png"),
+                      ("no_such_file_exists.png", "files/tests/images/0-0-white.png"),
+                      ("files/tests/images/1-0-small-white.png", "files/tests/images/1-1-big-white.png"),
+                      ("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-small.png")]
+
+    def test_same_results_as_per_pair_methods(self):
+        for method in ["dhash", "avghash", "phash", "whash"]:
+            pairs = [FilePair(image1, image2) for image1, image2 in self.pairs]
+            similarities = compare_batch(pairs, method)
+            expected = [FilePair(image1, image2) for image1, image2 in self.pairs]
+            for pair in expected:
+                try:
+                    get_similarity_measurement(method)(pair)
+                except (FileError, ArgumentError):
+                    pass
+            assert similarities.tolist() == [pair.similarity for pair in expected], method
+            assert [pair.similarity for pair in pairs] == [pair.similarity for pair in expected]
+            assert [pair.skipped for pair in pairs] == [False, False, True, True, False]
+
+    def test_skipped_pairs_are_not_compared(self):
+        pairs = [FilePair("<NO_FILE_GIVEN>", "files/tests/images/0-0-white.png", skipped=True)]
+        assert compare_batch(pairs, "dhash").tolist() == [-1.0]
+
+    def test_unsupported_method(self):
+        with self.assertRaises(ArgumentError):
+            compare_batch([], "ssim")
+
+
 class TestSSIMSimilarity(unittest.TestCase):
     """Tests for `SSIM` method."""
 
@@ -103,6 +143,14 @@ class TestSSIMSimilarity(unittest.TestCase):
         assert pair.elapsed > 0, "Elapsed should be bigger than zero"
         assert pair.skipped is False
 
+    def test_ssim_stage_timings(self):
+        pair = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png")
+        self.ssim(pair)
+        assert list(pair.timings) == ["decode", "preprocess", "compute"]
+        assert all(wall >= 0 and cpu >= 0 for wall, cpu in pair.timings.values())
+        assert pair.timings["compute"][1] > 0
+        assert sum(cpu for _, cpu in pair.timings.values()) <= pair.elapsed + 1e-3
+
     def test_ssim_similarity_big_files_small_wm_cat(self):
         pair = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-small.png")
         self.ssim(pair)
@@ -111,6 +159,222 @@ class TestSSIMSimilarity(unittest.TestCase):
         assert pair.skipped is False
 
 
+class TestDownscaledSimilarity(unittest.TestCase):
+    """Tests for ssim and nrmse at a working resolution set by `set_max_side`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        set_max_side(64)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        set_max_side(None)
+
+    def test_working_size(self):
+        assert get_working_size((1355, 905), 512) == (512, 342)
+        assert get_working_size((660, 990), 512) == (341, 512)
+        assert get_working_size((100, 50), 512) == (100, 50)
+
+    def test_open_downscaled(self):
+        image = open_downscaled("files/tests/images/small/cat.png", 64)
+        assert max(image.shape[:2]) == 64
+        assert str(image.dtype) == "uint8"
+
+    def test_ssim_similarity_of_white_black(self):
+        pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")
+        get_similarity_measurement("ssim")(pair)
+        assert pair.similarity >= .995, f"Files are the opposite, should be one {pair.similarity}"
+        assert pair.skipped is False
+
+    def test_ssim_close_to_full_resolution(self):
+        pair = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-big.png")
+        get_similarity_measurement("ssim")(pair)
+        set_max_side(None)
+        full = FilePair(pair.image1, pair.image2)
+        get_similarity_measurement("ssim")(full)
+        assert abs(pair.similarity - full.similarity) <= .05
+
+    def test_nrmse_similarity_of_white_black(self):
+        pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")
+        get_similarity_measurement("nrmse")(pair)
+        assert pair.similarity >= .995, "Files are the opposite, should be one"
+        assert pair.skipped is False
+
+    def test_ssim_missing_file(self):
+        pair = FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png")
+        with self.assertRaises(FileError):
+            get_similarity_measurement("ssim")(pair)
+        assert pair.skipped is True
+
+    def test_different_original_sizes(self):
+        # Both sizes are downscaled to (128, 77), the original sizes are still compared
+        with tempfile.TemporaryDirectory() as folder:
+            paths = [os.path.join(folder, f"{width}.png") for width in (1000, 1001)]
+            for path, width in zip(paths, (1000, 1001)):
+                Image.new("RGB", (width, 600)).save(path)
+            assert get_working_size((1000, 600), 128) == get_working_size((1001, 600), 128)
+            set_max_side(128)
+            for method in ["ssim", "nrmse"]:
+                pair = FilePair(*paths)
+                with self.assertRaises(ArgumentError):
+                    get_similarity_measurement(method)(pair)
+                assert pair.skipped is True, method
+
+
+class TestThresholdMode(unittest.TestCase):
+    """Tests for the early exit mode enabled by `set_threshold`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        set_threshold(0.05)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        set_threshold(None)
+
+    def test_pairs_far_from_the_threshold_exit_early(self):
+        # Hashes of single color images are the same, pixel based methods find them the opposite
+        for method, threshold, match in [("ssim", 0.05, False), ("nrmse", 0.05, False), ("dhash", 0.5, True),
+                                         ("avghash", 0.5, True), ("phash", 0.5, True), ("whash", 0.5, True)]:
+            set_threshold(threshold)
+            pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")
+            get_similarity_measurement(method)(pair)
+            assert pair.match is match, method
+            assert pair.early_exit is True, method
+            assert threshold_stats == {"early_exits": 1, "full": 0}, method
+
+    def test_borderline_pairs_are_calculated_at_full_cost(self):
+        for method in ["ssim", "dhash"]:
+            set_threshold(None)
+            expected = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-small.png")
+            get_similarity_measurement(method)(expected)
+            assert expected.match is None
+
+            set_threshold(expected.similarity)
+            pair = FilePair(expected.image1, expected.image2)
+            get_similarity_measurement(method)(pair)
+            assert pair.similarity == expected.similarity, method
+            assert pair.match is True
+            assert pair.early_exit is False
+            assert threshold_stats == {"early_exits": 0, "full": 1}, method
+
+    def test_same_decisions_with_hash_store(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            # JPEG images are decoded at a reduced scale for the low resolution stage, their low resolution hashes
+            # differ from the ones of the full resolution images
+            paths = [os.path.join(temp_folder, "cat.jpg"), os.path.join(temp_folder, "cat-mirrored.jpg")]
+            with Image.open("files/tests/images/small/cat.png") as image:
+                image = image.convert("RGB")
+                image.save(paths[0])
+                image.transpose(Image.FLIP_LEFT_RIGHT).save(paths[1])
+
+            def score(method, threshold):
+                set_threshold(threshold)
+                pair = FilePair(*paths)
+                get_similarity_measurement(method)(pair)
+                return pair.similarity, pair.match, pair.early_exit
+
+            for method in ["dhash", "avghash", "phash", "whash"]:
+                for threshold in [i / 20 for i in range(21)]:
+                    expected = score(method, threshold)
+                    hashing.open_hash_store(os.path.join(temp_folder, "hashes.db"))
+                    try:
+                        # Calculated and stored, then loaded from the store
+                        for _ in range(2):
+                            assert score(method, threshold) == expected, (method, threshold)
+                    finally:
+                        hashing.close_hash_store()
+
+    def test_no_low_resolution_stage_below_coarse_side(self):
+        set_max_side(64)
+        try:
+            pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")
+            get_similarity_measurement("ssim")(pair)
+        finally:
+            set_max_side(None)
+        assert pair.match is False
+        assert threshold_stats == {"early_exits": 0, "full": 1}
+
+    def test_missing_file(self):
+        pair = FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png")
+        with self.assertRaises(FileError):
+            get_similarity_measurement("dhash")(pair)
+        assert pair.skipped is True
+        assert pair.match is None
+
+
+class TestCascade(unittest.TestCase):
+    """Tests for `split_distances` and `calculate_similarities` functions."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        image_cache.resize(DEFAULT_CACHE_SIZE)
+
+    def test_split_distances(self):
+        assert split_distances("dhash") == ["dhash"]
+        assert split_distances("dhash, ssim") == ["dhash", "ssim"]
+        for distance in ["dhash,NoSuchDistance", "dhash,dhash", "dhash,"]:
+            with self.assertRaises(ArgumentError):
+                split_distances(distance)
+
+    def test_every_method_from_a_single_decode(self):
+        methods = ["dhash", "avghash", "phash", "whash", "nrmse", "ssim"]
+        pair = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-small.png")
+        expected = {}
+        for method in methods:
+            get_similarity_measurement(method)(pair)
+            expected[method] = pair.similarity
+
+        # Without the decoded image cache only the shared decode avoids decoding the images for every method
+        image_cache.resize(0)
+        image_cache.reset_stats()
+        pair = FilePair(pair.image1, pair.image2)
+        calculate_similarities(pair, methods)
+        assert pair.similarities == expected
+        assert pair.similarity == expected["ssim"]
+        assert image_cache.stats()["misses"] == 2
+
+    def test_pairs_passing_every_method(self):
+        pair = FilePair("files/tests/images/small/cat.png", "files/tests/images/small/cat-wm-small.png")
+        calculate_similarities(pair, ["dhash", "ssim"], 0.2)
+        expected = FilePair(pair.image1, pair.image2)
+        get_similarity_measurement("ssim")(expected)
+        assert pair.similarity == expected.similarity
+        assert list(pair.similarities) == ["dhash", "ssim"]
+        assert pair.similarities["dhash"] <= 0.2
+        assert pair.similarities["ssim"] == expected.similarity
+        assert pair.elapsed > 0
+
+    def test_pairs_eliminated_by_the_cheap_method(self):
+        # ssim finds the white and black images the opposite, dhash the same
+        pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")
+        calculate_similarities(pair, ["ssim", "dhash"], 0.2)
+        assert pair.similarities["dhash"] == -1.0
+        assert pair.similarities["ssim"] > 0.2
+        # The similarity is the one of the last method, which did not run
+        assert pair.similarity == -1.0
+        assert pair.match is None
+
+    def test_eliminated_pairs_do_not_match(self):
+        set_threshold(0.5)
+        try:
+            pair = FilePair("files/tests/images/0-0-white.png", "files/tests/images/0-1-black.png")
+            calculate_similarities(pair, ["ssim", "dhash"], 0.2)
+        finally:
+            set_threshold(None)
+        assert pair.match is False
+
+    def test_missing_file(self):
+        pair = FilePair("no_such_file_exists.png", "files/tests/images/0-0-white.png")
+        with self.assertRaises(FileError):
+            calculate_similarities(pair, ["dhash", "ssim"], 0.2)
+        assert pair.skipped is True
+        assert pair.similarities == {"dhash": -1.0, "ssim": -1.0}
+        # No method ran, the pair did not take no time
+        assert pair.elapsed == -1.0
+        assert pair.timings is None
+
+
 class TestNRMSESimilarity(unittest.TestCase):
     """Tests for `NRMSE` method."""
 
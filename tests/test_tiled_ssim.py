@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `tiled_ssim` module."""
+import unittest
+import numpy as np
+from skimage import io, img_as_float
+from skimage.measure import compare_ssim
+from image_compare.tiled_ssim import tiled_ssim, get_strip_rows
+
+
+class TestTiledSSIM(unittest.TestCase):
+    """Tests for `tiled_ssim` function."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.image1 = io.imread("files/tests/images/small/cat.png")
+        self.image2 = io.imread("files/tests/images/small/cat-wm-big.png")
+
+    def test_same_as_compare_ssim(self):
+        expected = compare_ssim(img_as_float(self.image1), img_as_float(self.image2), multichannel=True)
+        # A single strip, strips of a few rows and strips of a single row
+        for strip_elements in [self.image1.size, 20 * self.image1[0].size, 1]:
+            assert abs(tiled_ssim(self.image1, self.image2, strip_elements=strip_elements) - expected) < 1e-10
+
+    def test_float_images(self):
+        image1 = img_as_float(self.image1).astype(np.float32)
+        image2 = img_as_float(self.image2).astype(np.float32)
+        assert abs(tiled_ssim(image1, image2) - tiled_ssim(self.image1, self.image2)) < 1e-6
+
+    def test_same_image(self):
+        assert tiled_ssim(self.image1, self.image1, strip_elements=10000) == 1.0
+
+    def test_strip_rows(self):
+        assert get_strip_rows((100, 50, 4), strip_elements=1000) == 5
+        assert get_strip_rows((100, 50, 4), strip_elements=10) == 1
+
+    def test_invalid_images(self):
+        with self.assertRaises(ValueError):
+            tiled_ssim(self.image1, self.image1[:-1])
+        with self.assertRaises(ValueError):
+            tiled_ssim(self.image1[:6], self.image2[:6])
@@ -5,7 +5,8 @@
 
 
 import unittest
-from image_compare.util import clean_string
+import random
+from image_compare.util import clean_string, DurationHistogram
 
 
 class TestUtilMethods(unittest.TestCase):
@@ -35,4 +36,24 @@ class TestUtilMethods(unittest.TestCase):
         assert clean_string("a    ", None) == "a"
         assert clean_string("    a     ", None) == "a"
 
-
+    def test_duration_histogram(self):
+        histogram = DurationHistogram()
+        assert histogram.percentile(50) == 0.0
+
+        generator = random.Random(0)
+        durations = sorted(generator.lognormvariate(-5, 1) for _ in range(10000))
+        for duration in durations:
+            histogram.add(duration)
+        assert histogram.count == len(durations)
+        for q in (50, 95, 99):
+            exact = durations[int(q / 100 * len(durations)) - 1]
+            assert abs(histogram.percentile(q) - exact) / exact < 0.07, q
+        assert histogram.percentile(0) == durations[0]
+        assert histogram.percentile(100) == durations[-1]
+
+    def test_duration_histogram_bounds(self):
+        histogram = DurationHistogram()
+        for duration in (0.0, 1e9):
+            histogram.add(duration)
+        assert histogram.percentile(50) == 0.0
+        assert histogram.percentile(100) == 1e9